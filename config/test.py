@@ -47,6 +47,7 @@ RDS_SCHEMA_SIS_INTERNAL = 'sis_internal_test'
 RDS_SCHEMA_STUDENT = 'student_test'
 RDS_SCHEMA_TERMS = 'terms_test'
 
+REDSHIFT_COPY_SHARDS = 2
 REDSHIFT_DATABASE = 'nessie_redshift_test'
 REDSHIFT_HOST = 'localhost'
 REDSHIFT_PASSWORD = 'nessie'
@@ -29,6 +29,31 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_demographics
     feed TEXT NOT NULL
 );
 
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.demographics
+(
+    sid VARCHAR NOT NULL,
+    gender VARCHAR,
+    minority BOOLEAN
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.ethnicities
+(
+    sid VARCHAR NOT NULL,
+    ethnicity VARCHAR
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.intended_majors
+(
+    sid VARCHAR NOT NULL,
+    major VARCHAR NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.minors
+(
+    sid VARCHAR NOT NULL,
+    minor VARCHAR NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_enrollment_terms
 (
     sid VARCHAR NOT NULL,
@@ -53,7 +78,15 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_majors
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}.student_profiles
 (
     sid VARCHAR NOT NULL,
-    profile TEXT NOT NULL
+    profile TEXT NOT NULL,
+    profile_summary TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}.visas
+(
+    sid VARCHAR NOT NULL,
+    visa_status VARCHAR,
+    visa_type VARCHAR
 );
 
 CREATE SCHEMA IF NOT EXISTS {redshift_schema_student}_staging;
@@ -81,6 +114,31 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_profile_ind
     terms_in_attendance INT
 );
 
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.demographics
+(
+    sid VARCHAR NOT NULL,
+    gender VARCHAR,
+    minority BOOLEAN
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.ethnicities
+(
+    sid VARCHAR NOT NULL,
+    ethnicity VARCHAR
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.intended_majors
+(
+    sid VARCHAR NOT NULL,
+    major VARCHAR NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.minors
+(
+    sid VARCHAR NOT NULL,
+    minor VARCHAR NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_enrollment_terms
 (
     sid VARCHAR NOT NULL,
@@ -105,5 +163,13 @@ CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_majors
 CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.student_profiles
 (
     sid VARCHAR NOT NULL,
-    profile TEXT NOT NULL
+    profile TEXT NOT NULL,
+    profile_summary TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS {redshift_schema_student}_staging.visas
+(
+    sid VARCHAR NOT NULL,
+    visa_status VARCHAR,
+    visa_type VARCHAR
 );
@@ -29,7 +29,8 @@ from random import randint
 import dateutil.parser
 from flask import current_app as app, request
 from nessie.api.auth_helper import auth_required
-from nessie.lib import http, metadata
+from nessie.lib import http, metadata, query_stats
+from nessie.lib.db import get_pool_stats
 from nessie.lib.http import tolerant_jsonify
 
 
@@ -71,6 +72,54 @@ def background_job_status():
     return tolerant_jsonify([to_api_json(row) for row in rows])
 
 
+@app.route('/api/admin/query_stats')
+@auth_required
+def get_query_stats():
+    job_id = request.args.get('jobId')
+
+    def to_api_json(stats):
+        return {
+            'source': stats['source'],
+            'fingerprint': stats['fingerprint'],
+            'sql': stats['sql'],
+            'count': stats['count'],
+            'errors': stats['errors'],
+            'retries': stats['retries'],
+            'totalSeconds': stats['total_seconds'],
+            'maxSeconds': stats['max_seconds'],
+            'p50Seconds': stats['p50_seconds'],
+            'p95Seconds': stats['p95_seconds'],
+            'histogram': dict(zip([str(b) for b in query_stats.HISTOGRAM_BUCKETS], stats['histogram'])),
+            'rows': stats['rows'],
+            'bytes': stats['bytes'],
+        }
+    return tolerant_jsonify({
+        'jobIds': query_stats.get_job_ids(),
+        'retries': query_stats.get_retry_counts(),
+        'statements': [to_api_json(stats) for stats in query_stats.get_query_stats(job_id=job_id)],
+    })
+
+
+@app.route('/api/admin/connection_pools')
+@auth_required
+def connection_pools():
+    def to_api_json(stats):
+        return {
+            'name': stats['name'],
+            'idle': stats['idle'],
+            'inUse': stats['in_use'],
+            'minSize': stats['min_size'],
+            'maxSize': stats['max_size'],
+            'checkouts': stats['checkouts'],
+            'connectionsCreated': stats['connections_created'],
+            'connectionsDiscarded': stats['connections_discarded'],
+            'connectionsEvicted': stats['connections_evicted'],
+            'failedHealthChecks': stats['failed_health_checks'],
+            'waits': stats['waits'],
+        }
+    return tolerant_jsonify([to_api_json(stats) for stats in get_pool_stats()])
+
+
 @app.route('/api/admin/xkcd')
 @auth_required
 def xkcd():
@@ -60,6 +60,7 @@ from nessie.jobs.index_advising_notes import IndexAdvisingNotes
 from nessie.jobs.index_enrollments import IndexEnrollments
 from nessie.jobs.migrate_sis_advising_note_attachments import MigrateSisAdvisingNoteAttachments
 from nessie.jobs.refresh_canvas_data_catalog import RefreshCanvasDataCatalog
+from nessie.jobs.refresh_s3_key_index import RefreshS3KeyIndex
 from nessie.jobs.resync_canvas_snapshots import ResyncCanvasSnapshots
 from nessie.jobs.sync_canvas_requests_snapshots import SyncCanvasRequestsSnapshots
 from nessie.jobs.sync_canvas_snapshots import SyncCanvasSnapshots
@@ -207,7 +208,12 @@ def generate_intermediate_tables():
 @app.route('/api/job/generate_merged_student_feeds', methods=['POST'])
 @auth_required
 def generate_merged_student_feeds():
-    job_started = GenerateMergedStudentFeeds().run_async()
+    args = get_json_args(request)
+    if args:
+        incremental = args.get('incremental')
+    else:
+        incremental = None
+    job_started = GenerateMergedStudentFeeds(incremental=incremental).run_async()
     return respond_with_status(job_started)
 
 
@@ -307,6 +313,13 @@ def refresh_canvas_data_catalog():
     return respond_with_status(job_started)
 
 
+@app.route('/api/job/refresh_s3_key_index', methods=['POST'])
+@auth_required
+def refresh_s3_key_index():
+    job_started = RefreshS3KeyIndex().run_async()
+    return respond_with_status(job_started)
+
+
 @app.route('/api/job/resync_canvas_snapshots', methods=['POST'])
 @auth_required
 def resync_canvas_snapshots():
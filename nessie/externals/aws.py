@@ -0,0 +1,123 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from datetime import timezone
+import threading
+
+import boto3
+from botocore.credentials import RefreshableCredentials
+import botocore.session
+from flask import current_app as app
+
+"""Process-wide cache of assumed-role credentials, and of boto3 clients built from them.
+
+The credentials refresh themselves by assuming the role again when they near expiry, so cached clients stay valid
+however long they are held.
+"""
+
+_lock = threading.Lock()
+_credentials = None
+_session = None
+_clients = {}
+
+
+def get_sts_credentials():
+    sts_client = boto3.client('sts')
+    role_arn = app.config['AWS_APP_ROLE_ARN']
+    assumed_role_object = sts_client.assume_role(
+        RoleArn=role_arn,
+        RoleSessionName='AssumeAppRoleSession',
+        DurationSeconds=app.config['AWS_STS_SESSION_DURATION'],
+    )
+    return assumed_role_object['Credentials']
+
+
+def get_session():
+    """Return a new boto3 session for the app role, sharing the cached refreshable credentials.
+
+    Sessions are not thread-safe, so each caller gets its own; clients from get_client may be shared.
+    """
+    with _lock:
+        return _new_session(_get_credentials())
+
+
+def get_client(service, region_name=None):
+    """Return a shared, thread-safe client for the given service and region."""
+    global _session
+    with _lock:
+        key = (service, region_name)
+        if key not in _clients:
+            if _session is None:
+                _session = _new_session(_get_credentials())
+            _clients[key] = _session.client(service, region_name=region_name)
+        return _clients[key]
+
+
+def reset():
+    """Discard cached credentials and clients."""
+    global _credentials, _session
+    with _lock:
+        _credentials = None
+        _session = None
+        _clients.clear()
+
+
+def _get_credentials():
+    global _credentials
+    if _credentials is None:
+        app_obj = app._get_current_object()
+
+        def _refresh():
+            # Refreshes may run on whichever thread next signs a request.
+            with app_obj.app_context():
+                return _credentials_metadata(get_sts_credentials())
+        _credentials = RefreshableCredentials.create_from_metadata(
+            metadata=_refresh(),
+            refresh_using=_refresh,
+            method='sts-assume-role',
+        )
+        # Refresh within the margin of expiry, keeping the current credentials if that fails until half the margin remains.
+        margin = app.config['AWS_STS_REFRESH_MARGIN']
+        _credentials._advisory_refresh_timeout = margin
+        _credentials._mandatory_refresh_timeout = margin // 2
+    return _credentials
+
+
+def _credentials_metadata(credentials):
+    expiration = credentials['Expiration']
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=timezone.utc)
+    return {
+        'access_key': credentials['AccessKeyId'],
+        'secret_key': credentials['SecretAccessKey'],
+        'token': credentials['SessionToken'],
+        'expiry_time': expiration.isoformat(),
+    }
+
+
+def _new_session(credentials):
+    botocore_session = botocore.session.get_session()
+    botocore_session._credentials = credentials
+    return boto3.Session(botocore_session=botocore_session)
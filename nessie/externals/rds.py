@@ -27,27 +27,38 @@ from contextlib import contextmanager
 from datetime import datetime
 
 from flask import current_app as app
-from nessie.lib.db import get_psycopg_cursor
+from nessie.lib import query_stats
+from nessie.lib.db import call_with_retries, get_connection_pool, get_psycopg_cursor, is_transient_error, \
+    TransientQueryError
 import psycopg2
 import psycopg2.extras
 
 """Client code to run queries against RDS."""
 
+# Characters read per round trip when streaming COPY data.
+COPY_BUFFER_SIZE = 1024 * 1024
 
-def execute(sql, params=None, log_query=True):
-    with _get_cursor() as cursor:
-        if not cursor:
-            return None
-        else:
-            return _execute(sql, cursor, params, 'write', log_query)
+_COPY_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+def execute(sql, params=None, log_query=True, retry_safe=False):
+    def _attempt(raise_transient):
+        with _get_cursor(raise_transient=raise_transient) as cursor:
+            if not cursor:
+                return None
+            else:
+                return _execute(sql, cursor, params, 'write', log_query, raise_transient)
+    return _call_with_retries(_attempt, sql, enabled=retry_safe)
 
 
 def fetch(sql, params=None, log_query=True):
-    with _get_cursor(operation='read') as cursor:
-        if not cursor:
-            return None
-        else:
-            return _execute(sql, cursor, params, 'read', log_query)
+    def _attempt(raise_transient):
+        with _get_cursor(operation='read', raise_transient=raise_transient) as cursor:
+            if not cursor:
+                return None
+            else:
+                return _execute(sql, cursor, params, 'read', log_query, raise_transient)
+    return _call_with_retries(_attempt, sql)
 
 
 class Transaction():
@@ -61,6 +72,9 @@ class Transaction():
     def insert_bulk(self, sql, rows):
         return _insert_bulk(sql, self.cursor, rows)
 
+    def copy_rows(self, table, columns, rows, copy_format='text'):
+        return _copy_rows(table, columns, rows, self.cursor, copy_format)
+
     def commit(self):
         return self.execute('COMMIT TRANSACTION')
 
@@ -68,6 +82,65 @@ class Transaction():
         return self.execute('ROLLBACK TRANSACTION')
 
 
+class CopyRowReader:
+    """Read-only file-like object rendering an iterable of row tuples in COPY text or CSV format."""
+
+    def __init__(self, rows, copy_format='text'):
+        self.rows = iter(rows)
+        self.row_count = 0
+        # Characters rendered so far, which equal bytes sent for ASCII data.
+        self.char_count = 0
+        self._pending = ''
+        if copy_format == 'csv':
+            self._format_row = self._format_csv_row
+        elif copy_format == 'text':
+            self._format_row = self._format_text_row
+        else:
+            raise ValueError(f'Unsupported COPY format: {copy_format}')
+
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = self._format_row(row)
+            chunks.append(line)
+            length += len(line)
+            self.row_count += 1
+        data = ''.join(chunks)
+        if 0 <= size < len(data):
+            self._pending = data[size:]
+            data = data[:size]
+        else:
+            self._pending = ''
+        self.char_count += len(data)
+        return data
+
+    def _format_csv_row(self, row):
+        def _to_copy_csv(value):
+            # COPY reads an unquoted empty field as NULL, so empty strings are quoted, as are delimiters, quotes and line breaks.
+            if value is None:
+                return ''
+            if isinstance(value, bool):
+                return 't' if value else 'f'
+            value = str(value)
+            if value == '' or value == '\\.' or any(c in value for c in ',"\n\r'):
+                return '"' + value.replace('"', '""') + '"'
+            return value
+        return ','.join(_to_copy_csv(v) for v in row) + '\n'
+
+    def _format_text_row(self, row):
+        def _to_copy_text(value):
+            if value is None:
+                return '\\N'
+            if isinstance(value, bool):
+                return 't' if value else 'f'
+            return str(value).translate(_COPY_TEXT_ESCAPES)
+        return '\t'.join(_to_copy_text(v) for v in row) + '\n'
+
+
 @contextmanager
 def transaction():
     with _get_cursor(autocommit=False) as cursor:
@@ -75,25 +148,58 @@ def transaction():
 
 
 @contextmanager
-def _get_cursor(autocommit=True, operation='write'):
-    with get_psycopg_cursor(
-        operation=operation,
-        autocommit=autocommit,
+def _get_cursor(autocommit=True, operation='write', raise_transient=False):
+    try:
+        with get_psycopg_cursor(
+            operation=operation,
+            autocommit=autocommit,
+            pool=_get_connection_pool(),
+        ) as cursor:
+            yield cursor
+    except psycopg2.Error as e:
+        if raise_transient and is_transient_error(e):
+            raise TransientQueryError(e) from e
+        raise
+
+
+def _call_with_retries(attempt, sql, enabled=True):
+    def _on_retry(error, retry, delay):
+        query_stats.record_retry('rds', str(sql), error.pgcode)
+        app.logger.warning(f'Transient RDS error ({error.pgcode}: {error}); retry {retry} in {delay:.1f} seconds.')
+    return call_with_retries(
+        attempt,
+        max_retries=app.config['RDS_RETRY_MAX_ATTEMPTS'] if enabled else 0,
+        base_delay=app.config['RDS_RETRY_BASE_DELAY'],
+        max_delay=app.config['RDS_RETRY_MAX_DELAY'],
+        on_retry=_on_retry,
+    )
+
+
+def _get_connection_pool():
+    return get_connection_pool(
+        name='rds',
+        min_size=app.config['RDS_POOL_MIN_SIZE'],
+        max_size=app.config['RDS_POOL_MAX_SIZE'],
+        idle_timeout=app.config['RDS_POOL_IDLE_TIMEOUT'],
+        health_check_interval=app.config['RDS_POOL_HEALTH_CHECK_INTERVAL'],
         uri=app.config.get('SQLALCHEMY_DATABASE_URI'),
-    ) as cursor:
-        yield cursor
+    )
 
 
-def _execute(sql, cursor, params=None, operation='write', log_query=True):
+def _execute(sql, cursor, params=None, operation='write', log_query=True, raise_transient=False):
     result = None
+    ts = datetime.now().timestamp()
     try:
-        ts = datetime.now().timestamp()
         cursor.execute(sql, params)
         result = cursor.statusmessage
         query_time = datetime.now().timestamp() - ts
+        query_stats.record('rds', str(sql), query_time, rows=cursor.rowcount if cursor.rowcount >= 0 else None)
         if log_query:
             app.logger.debug(f'RDS query returned status {result} in {query_time} seconds: \n{sql}\n{params or ""}')
     except psycopg2.Error as e:
+        query_stats.record('rds', str(sql), datetime.now().timestamp() - ts, error=True)
+        if raise_transient and is_transient_error(e):
+            raise TransientQueryError(e) from e
         _log_db_error(e, sql)
     if operation == 'read':
         rows = cursor.fetchall()
@@ -104,10 +210,32 @@ def _execute(sql, cursor, params=None, operation='write', log_query=True):
 
 def _insert_bulk(sql, cursor, rows):
     result = None
+    ts = datetime.now().timestamp()
     try:
         psycopg2.extras.execute_values(cursor, sql, rows, page_size=5000)
         result = cursor.statusmessage
+        query_stats.record('rds', sql, datetime.now().timestamp() - ts, rows=len(rows))
+    except psycopg2.Error as e:
+        query_stats.record('rds', sql, datetime.now().timestamp() - ts, error=True)
+        _log_db_error(e, sql)
+    return result
+
+
+def _copy_rows(table, columns, rows, cursor, copy_format='text'):
+    """Stream rows from any iterable into a table with COPY FROM STDIN, rendering them only as Postgres asks for data."""
+    result = None
+    options = 'FORMAT csv' if copy_format == 'csv' else 'FORMAT text'
+    sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH ({options})'
+    ts = datetime.now().timestamp()
+    try:
+        reader = CopyRowReader(rows, copy_format)
+        cursor.copy_expert(sql, reader, size=COPY_BUFFER_SIZE)
+        result = cursor.statusmessage
+        query_time = datetime.now().timestamp() - ts
+        query_stats.record('rds', sql, query_time, rows=reader.row_count, num_bytes=reader.char_count)
+        app.logger.debug(f'RDS copy returned status {result} ({reader.row_count} rows) in {query_time} seconds: \n{sql}')
     except psycopg2.Error as e:
+        query_stats.record('rds', sql, datetime.now().timestamp() - ts, error=True)
         _log_db_error(e, sql)
     return result
 
@@ -23,46 +23,91 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+import heapq
 import io
 import re
 
 from flask import current_app as app
 from nessie.externals import s3
-from nessie.lib.db import get_psycopg_cursor, get_psycopg_cursor_streaming
+from nessie.lib import query_stats, sql_scripts
+from nessie.lib.db import call_with_retries, get_connection_pool, get_psycopg_cursor, get_psycopg_cursor_streaming, \
+    is_transient_error, ResultStream, TransientQueryError
+import numpy
+import pandas
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import psycopg2.sql
 
 """Client code to run queries against Redshift."""
 
-# Batch size to use when streaming large result sets.
+# Default batch size to use when streaming large result sets. Individual streams may override it.
 CURSOR_ITERSIZE = 1000
 
-
-def execute(sql, **kwargs):
-    """Execute SQL write operation with optional keyword arguments for formatting, returning a status string."""
-    with _get_cursor() as cursor:
-        if not cursor:
-            return None
-        return _execute(sql, operation='write', cursor=cursor, **kwargs)
+# Row types accepted by fetch. 'dict' rows are independent copies safe to hand to pandas; 'dictrow' rows are psycopg's
+# DictRow objects, which support the same lookups without the copy; 'namedtuple' and 'tuple' rows are more compact still.
+ROW_CURSOR_FACTORIES = {
+    'dict': psycopg2.extras.DictCursor,
+    'dictrow': psycopg2.extras.DictCursor,
+    'namedtuple': psycopg2.extras.NamedTupleCursor,
+    'tuple': psycopg2.extensions.cursor,
+}
+
+# Column arrays built by fetch_dataframes take their dtype from the Postgres type OID reported in the cursor description.
+# Integer columns containing nulls fall back to float64, and booleans containing nulls to object.
+COLUMN_DTYPES_BY_TYPE_CODE = {
+    16: 'bool',
+    20: 'int64',
+    21: 'int64',
+    23: 'int64',
+    700: 'float64',
+    701: 'float64',
+    1700: 'float64',
+}
+
+# Slice count of the cluster, looked up once per process by get_copy_shard_count.
+_copy_shard_count = None
+
+
+def execute(sql, retry_safe=False, **kwargs):
+    """Execute SQL write operation with optional keyword arguments for formatting, returning a status string.
+
+    Statements that can safely be repeated after a transient failure, whether or not the failed attempt took effect,
+    may be marked retry_safe.
+    """
+    def _attempt(raise_transient):
+        with _get_cursor(raise_transient=raise_transient) as cursor:
+            if not cursor:
+                return None
+            return _execute(sql, operation='write', cursor=cursor, raise_transient=raise_transient, **kwargs)
+    return _call_with_retries(_attempt, sql, enabled=retry_safe)
 
 
-def execute_ddl_script(sql):
+def execute_ddl_script(sql, max_concurrency=None, retry_safe=False):
     """Handle Redshift DDL scripts, which are exceptional in a number of ways.
 
     * CREATE EXTERNAL SCHEMA must be executed separately from any later references to that schema.
       The simplest way to enforce that requirement is to split the multi-statement SQL string by semicolon,
-      and execute each statement in turn.
+      and execute each statement in turn. Semicolons within quotes, dollar quotes and comments are not split on.
     * DROP EXTERNAL TABLE and CREATE EXTERNAL TABLE will fail with a 'cannot run inside a transaction block'
       message unless autocommit is enabled.
 
-    WARNING: This will break horribly if a semicolon terminated statement is inside a block quote.
+    Unless max_concurrency (by default REDSHIFT_DDL_MAX_CONCURRENCY) is greater than one, statements run in order on a
+    single cursor. Otherwise, statements run on pooled connections as soon as every earlier statement touching the
+    same tables or schemas has completed; see nessie.lib.sql_scripts for the dependency rules.
+
+    If retry_safe is set, statements (or transaction blocks) failing with transient errors are retried on a fresh
+    connection, in which case statements run on pooled connections even without concurrency.
     """
-    statements = sql.split(';')
-    # Remove any trailing debris after the last SQL statement.
-    del statements[-1]
+    statements = sql_scripts.split_statements(sql)
+    if max_concurrency is None:
+        max_concurrency = app.config['REDSHIFT_DDL_MAX_CONCURRENCY']
+    if (max_concurrency > 1 or retry_safe) and not sql_scripts.requires_single_session(statements):
+        return _execute_ddl_script_units(statements, max_concurrency, retry_safe)
     with _get_cursor() as cursor:
         if not cursor:
             app.logger.error('Failed to get cursor to execute DDL script; aborting.')
@@ -76,13 +121,77 @@ def execute_ddl_script(sql):
     return True
 
 
-def copy_tsv_from_s3(table, s3_key):
+def _execute_ddl_script_units(statements, max_concurrency, retry_safe):
+    units = sql_scripts.group_transactions(statements)
+    predecessors = sql_scripts.dependency_graph(units)
+    app.logger.info(f'Executing DDL script of {len(statements)} statements in {len(units)} units, up to {max_concurrency} at a time')
+
+    app_obj = app._get_current_object()
+
+    def _attempt_unit(index, raise_transient):
+        with _get_cursor(raise_transient=raise_transient) as cursor:
+            if not cursor:
+                app.logger.error('Failed to get cursor to execute DDL script; aborting.')
+                return False
+            for statement in units[index]:
+                if not _execute(statement, operation='write', cursor=cursor, raise_transient=raise_transient):
+                    app.logger.error(f'Aborting DDL script. Error executing statement: {statement}')
+                    return False
+            return True
+
+    def _execute_unit(index):
+        with app_obj.app_context():
+            return _call_with_retries(partial(_attempt_unit, index), units[index][-1], enabled=retry_safe)
+
+    return _run_in_dependency_order(predecessors, _execute_unit, max_concurrency)
+
+
+def _run_in_dependency_order(predecessors, run, max_workers):
+    """Call run(index) for each index once its predecessors have succeeded, returning True if every call succeeds."""
+    dependents = {index: [] for index in range(len(predecessors))}
+    for index, index_predecessors in enumerate(predecessors):
+        for predecessor in index_predecessors:
+            dependents[predecessor].append(index)
+    remaining = [set(p) for p in predecessors]
+    ready = [index for index, index_predecessors in enumerate(remaining) if not index_predecessors]
+    heapq.heapify(ready)
+    succeeded = 0
+    failed = False
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        # Once a call fails, let running calls finish but start no more.
+        while running or (ready and not failed):
+            while ready and not failed:
+                index = heapq.heappop(ready)
+                running[executor.submit(run, index)] = index
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                if not future.result():
+                    failed = True
+                    continue
+                succeeded += 1
+                for dependent in dependents[index]:
+                    remaining[dependent].discard(index)
+                    if not remaining[dependent]:
+                        heapq.heappush(ready, dependent)
+    return not failed and succeeded == len(predecessors)
+
+
+def copy_tsv_from_s3(table, s3_key, manifest=False, gzip=False):
+    """Load a TSV file, or if manifest is set every file listed in the manifest at s3_key, into a table."""
     # In a test environment, retrieve object contents from mock S3 and use Postgres COPY FROM STDIN.
     if app.config['NESSIE_ENV'] == 'test':
         try:
-            buf = io.StringIO(s3.get_object_text(s3_key))
+            if manifest:
+                s3_prefix = 's3://' + app.config['LOCH_S3_BUCKET'] + '/'
+                keys = [entry['url'][len(s3_prefix):] for entry in s3.get_object_json(s3_key)['entries']]
+            else:
+                keys = [s3_key]
             with _get_cursor(operation='read') as cursor:
-                cursor.copy_from(buf, table)
+                for key in keys:
+                    buf = s3.get_unzipped_text_reader(key) if gzip else io.StringIO(s3.get_object_text(key))
+                    cursor.copy_from(buf, table)
             return True
         except psycopg2.Error as e:
             error_str = str(e)
@@ -94,7 +203,22 @@ def copy_tsv_from_s3(table, s3_key):
     else:
         iam_role = app.config['REDSHIFT_IAM_ROLE']
         s3_prefix = 's3://' + app.config['LOCH_S3_BUCKET'] + '/'
-        return execute(f"COPY {table} FROM '{s3_prefix}{s3_key}' IAM_ROLE '{iam_role}' DELIMITER '\\t';")
+        options = ''.join([' GZIP' if gzip else '', ' MANIFEST' if manifest else ''])
+        return execute(f"COPY {table} FROM '{s3_prefix}{s3_key}' IAM_ROLE '{iam_role}' DELIMITER '\\t'{options};")
+
+
+def get_copy_shard_count():
+    """Return the number of files to split a COPY into: REDSHIFT_COPY_SHARDS if set, else one per cluster slice."""
+    global _copy_shard_count
+    if app.config['REDSHIFT_COPY_SHARDS']:
+        return app.config['REDSHIFT_COPY_SHARDS']
+    if _copy_shard_count is None:
+        rows = fetch('SELECT COUNT(*) AS slices FROM stv_slices')
+        if not rows:
+            # Try again on the next call, but don't fail the load.
+            return 1
+        _copy_shard_count = rows[0]['slices']
+    return _copy_shard_count
 
 
 def create_external_schema(external_schema, role):
@@ -146,22 +270,107 @@ def drop_external_schema(schema_name):
     execute(sql)
 
 
-def fetch(sql, **kwargs):
-    """Execute SQL read operation with optional keyword arguments for formatting."""
+def fetch(sql, row_type='dict', **kwargs):
+    """Execute SQL read operation with optional keyword arguments for formatting.
+
+    Unless streaming is requested, rows are returned in a list. See ROW_CURSOR_FACTORIES for supported row types; 'tuple'
+    rows come back in a TupleRows list, whose 'columns' attribute maps column names to tuple indexes. If stream_results
+    is set, a ResultStream of DictRows is returned as from stream, and the caller is responsible for closing it.
+    """
     if kwargs.pop('stream_results', None):
-        cursor = _get_streaming_cursor()
-        _execute_streaming(sql, cursor, **kwargs)
-        return cursor
-    else:
-        # If streaming is not requested, return an array of dictionaries.
-        with _get_cursor(operation='read') as cursor:
+        return stream(sql, **kwargs)
+
+    # Reads are idempotent, and are retried on transient errors.
+    def _attempt(raise_transient):
+        with _get_cursor(operation='read', cursor_factory=ROW_CURSOR_FACTORIES[row_type], raise_transient=raise_transient) as cursor:
             if not cursor:
                 return None
-            rows = _execute(sql, 'read', cursor, **kwargs)
+            rows = _execute(sql, 'read', cursor, raise_transient=raise_transient, **kwargs)
             if rows is None:
                 return None
-            else:
+            elif row_type == 'dict':
                 return copy_for_pandas(rows)
+            elif row_type == 'tuple':
+                return TupleRows(rows, [column.name for column in cursor.description])
+            else:
+                return rows
+    return _call_with_retries(_attempt, sql)
+
+
+def fetch_dataframes(sql, group_by=None, batch_size=CURSOR_ITERSIZE, **kwargs):
+    """Stream query results as pandas DataFrames, built column by column from server-side cursor batches.
+
+    Without group_by, one DataFrame is iterated per batch. With group_by, the query must be ordered by that column, and
+    a (key, DataFrame) tuple is iterated for each distinct value, however many batches its rows span. The query is
+    executed immediately; as with stream, the returned DataFrameStream must be closed.
+    """
+    results = stream(sql, itersize=batch_size, cursor_factory=psycopg2.extensions.cursor, **kwargs)
+    return DataFrameStream(results, group_by)
+
+
+def stream(sql, itersize=CURSOR_ITERSIZE, prefetch=None, cursor_factory=psycopg2.extras.DictCursor, **kwargs):
+    """Execute SQL read operation on a server-side cursor, returning a ResultStream over its rows.
+
+    The stream holds a dedicated connection until closed, and is best used as a context manager:
+
+        with redshift.stream(sql, itersize=5000) as rows:
+            for row in rows:
+                ...
+
+    Rows are fetched itersize at a time. Unless prefetch is given, up to REDSHIFT_STREAM_PREFETCH_BATCHES batches are
+    fetched ahead of the consumer on a background thread; pass prefetch=0 to fetch only on demand. Opening the stream
+    is retried on transient errors, but errors while fetching rows are raised to the consumer.
+    """
+    if prefetch is None:
+        prefetch = app.config['REDSHIFT_STREAM_PREFETCH_BATCHES']
+    sql_for_stats = _redact_credentials(str(sql))
+
+    def _attempt(raise_transient):
+        try:
+            cursor = get_psycopg_cursor_streaming(cursor_factory=cursor_factory, **_connection_args())
+        except psycopg2.Error as e:
+            if raise_transient and is_transient_error(e):
+                raise TransientQueryError(e) from e
+            _handle_psycopg2_error(e)
+            raise
+        ts = datetime.now().timestamp()
+        try:
+            _execute_streaming(sql, cursor, **kwargs)
+        except Exception as e:
+            query_stats.record('redshift', sql_for_stats, datetime.now().timestamp() - ts, error=True)
+            cursor.connection.close()
+            if raise_transient and isinstance(e, psycopg2.Error) and is_transient_error(e):
+                raise TransientQueryError(e) from e
+            raise
+        return cursor, datetime.now().timestamp() - ts
+    cursor, execute_time = _call_with_retries(_attempt, sql_for_stats)
+
+    def _on_close(result_stream):
+        stats = result_stream.stats
+        # Time spent by the consumer between batches is not counted against the query.
+        query_stats.record('redshift', sql_for_stats, execute_time + stats['fetch_seconds'], rows=stats['rows'])
+        app.logger.debug(
+            f"Redshift cursor {cursor.name} closed after streaming {stats['rows']} rows in {stats['batches']} batches "
+            f"({stats['fetch_seconds']:.3f} seconds fetching, {stats['wait_seconds']:.3f} seconds waiting on prefetch)",
+        )
+    return ResultStream(cursor, itersize=itersize, prefetch=prefetch, on_close=_on_close)
+
+
+def _rows_to_dataframe(rows, description):
+    columns = {}
+    for index, column in enumerate(description):
+        values = [row[index] for row in rows]
+        dtype = COLUMN_DTYPES_BY_TYPE_CODE.get(column.type_code, 'object')
+        if None in values:
+            if dtype == 'int64':
+                dtype = 'float64'
+            elif dtype == 'bool':
+                dtype = 'object'
+        if dtype == 'object':
+            columns[column.name] = pandas.Series(values, dtype='object')
+        else:
+            columns[column.name] = numpy.array(values, dtype=dtype)
+    return pandas.DataFrame(columns, columns=[column.name for column in description])
 
 
 def copy_for_pandas(rows):
@@ -169,6 +378,59 @@ def copy_for_pandas(rows):
     return [r.copy() for r in rows]
 
 
+class DataFrameStream:
+    """Iterable of DataFrames, optionally grouped, built from the batches of an open ResultStream."""
+
+    def __init__(self, results, group_by=None):
+        self.results = results
+        self.group_by = group_by
+        self._frames = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        if self._frames is None:
+            self._frames = self._iter_grouped() if self.group_by else self._iter_batches()
+        return self._frames
+
+    def close(self):
+        self.results.close()
+
+    def _iter_batches(self):
+        for rows in self.results.batches():
+            yield _rows_to_dataframe(rows, self.results.description)
+
+    def _iter_grouped(self):
+        pending = None
+        for frame in self._iter_batches():
+            if pending is not None:
+                frame = pandas.concat([pending, frame], ignore_index=True)
+            keys = frame[self.group_by].values
+            boundaries = [0, *(numpy.flatnonzero(keys[1:] != keys[:-1]) + 1), len(frame)]
+            # The last group may continue into the next batch, so hold it back.
+            for start, end in zip(boundaries[:-2], boundaries[1:-1]):
+                yield keys[start], frame.iloc[start:end].reset_index(drop=True)
+            pending = frame.iloc[boundaries[-2]:].reset_index(drop=True)
+        if pending is not None and len(pending):
+            yield pending[self.group_by].values[0], pending
+
+
+class TupleRows(list):
+    """List of plain tuple rows, carrying a single shared index of column names to positions."""
+
+    def __init__(self, rows, column_names):
+        super().__init__(rows)
+        self.columns = {name: index for index, name in enumerate(column_names)}
+
+    def column(self, name):
+        index = self.columns[name]
+        return [row[index] for row in self]
+
+
 class Transaction():
     def __init__(self, cursor):
         self.cursor = cursor
@@ -191,29 +453,22 @@ def transaction():
 
 
 @contextmanager
-def _get_cursor(autocommit=True, operation='write'):
+def _get_cursor(autocommit=True, operation='write', cursor_factory=None, raise_transient=False):
     try:
         with get_psycopg_cursor(
             operation=operation,
             autocommit=autocommit,
-            **_connection_args(),
+            pool=_get_connection_pool(),
+            cursor_factory=cursor_factory,
         ) as cursor:
             yield cursor
     except psycopg2.Error as e:
+        if raise_transient and is_transient_error(e):
+            raise TransientQueryError(e) from e
         _handle_psycopg2_error(e)
         yield None
 
 
-def _get_streaming_cursor():
-    try:
-        cursor = get_psycopg_cursor_streaming(**_connection_args())
-        cursor.itersize = CURSOR_ITERSIZE
-        return cursor
-    except psycopg2.Error as e:
-        _handle_psycopg2_error(e)
-        return None
-
-
 def _handle_psycopg2_error(e):
     error_str = str(e)
     if e.pgcode:
@@ -221,6 +476,17 @@ def _handle_psycopg2_error(e):
     app.logger.warning(error_str)
 
 
+def _get_connection_pool():
+    return get_connection_pool(
+        name='redshift',
+        min_size=app.config['REDSHIFT_POOL_MIN_SIZE'],
+        max_size=app.config['REDSHIFT_POOL_MAX_SIZE'],
+        idle_timeout=app.config['REDSHIFT_POOL_IDLE_TIMEOUT'],
+        health_check_interval=app.config['REDSHIFT_POOL_HEALTH_CHECK_INTERVAL'],
+        **_connection_args(),
+    )
+
+
 def _connection_args():
     return {
         'dbname': app.config.get('REDSHIFT_DATABASE'),
@@ -231,34 +497,42 @@ def _connection_args():
     }
 
 
-def _execute(sql, operation, cursor, **kwargs):
+def _execute(sql, operation, cursor, raise_transient=False, **kwargs):
     """Execute SQL string with optional keyword arguments for formatting.
 
     If 'operation' is set to 'write', a transaction is enforced and a status string is returned. If 'operation' is
-    set to 'read', results are returned as an array of named tuples.
+    set to 'read', results are returned as a list of rows of whatever type the cursor produces. Errors are logged and
+    None returned, unless raise_transient is set and the error is transient, in which case TransientQueryError is raised.
     """
     result = None
     silent = kwargs.pop('silent', False)
+    # Statements are fingerprinted before identifiers are formatted in, and with credentials removed.
+    sql_for_stats = _redact_credentials(str(sql))
+    ts = datetime.now().timestamp()
     try:
         params = None
         if kwargs:
             params = kwargs.pop('params', None)
             sql = psycopg2.sql.SQL(sql).format(**kwargs)
         # Don't log sensitive credentials in the SQL.
-        sql_for_log = re.sub(r"CREDENTIALS '[^']+'", "CREDENTIALS '<credentials>'", str(sql))
-        ts = datetime.now().timestamp()
+        sql_for_log = _redact_credentials(str(sql))
         cursor.execute(sql, params)
         if operation == 'read':
-            result = [row for row in cursor]
+            result = cursor.fetchall()
             query_time = datetime.now().timestamp() - ts
+            query_stats.record('redshift', sql_for_stats, query_time, rows=len(result))
             if not silent:
                 app.logger.debug(f'Redshift query returned {len(result)} rows in {query_time} seconds:\n{sql_for_log}\n{params or ""}')
         else:
             result = cursor.statusmessage
             query_time = datetime.now().timestamp() - ts
+            query_stats.record('redshift', sql_for_stats, query_time, rows=_row_count(cursor))
             if not silent:
                 app.logger.debug(f'Redshift query returned status {result} in {query_time} seconds:\n{sql_for_log}\n{params or ""}')
     except psycopg2.Error as e:
+        query_stats.record('redshift', sql_for_stats, datetime.now().timestamp() - ts, error=True)
+        if raise_transient and is_transient_error(e):
+            raise TransientQueryError(e) from e
         error_str = str(e)
         if e.pgcode:
             error_str += f'{e.pgcode}: {e.pgerror}\n'
@@ -273,6 +547,32 @@ def _execute_streaming(sql, cursor, **kwargs):
         params = kwargs.pop('params', None)
         sql = psycopg2.sql.SQL(sql).format(**kwargs)
     # Don't log sensitive credentials in the SQL.
-    sql_for_log = re.sub(r"CREDENTIALS '[^']+'", "CREDENTIALS '<credentials>'", str(sql))
-    cursor.execute(sql, params)
-    app.logger.debug(f'Redshift query (cursor {cursor.name} streaming results:\n{sql_for_log}\n{params or ""}')
+    sql_for_log = _redact_credentials(str(sql))
+    try:
+        cursor.execute(sql, params)
+    except psycopg2.Error as e:
+        _handle_psycopg2_error(e)
+        raise
+    app.logger.debug(f'Redshift query (cursor {cursor.name}) streaming results:\n{sql_for_log}\n{params or ""}')
+
+
+def _call_with_retries(attempt, sql, enabled=True):
+    def _on_retry(error, retry, delay):
+        query_stats.record_retry('redshift', _redact_credentials(str(sql)), error.pgcode)
+        app.logger.warning(f'Transient Redshift error ({error.pgcode}: {error}); retry {retry} in {delay:.1f} seconds.')
+    return call_with_retries(
+        attempt,
+        max_retries=app.config['REDSHIFT_RETRY_MAX_ATTEMPTS'] if enabled else 0,
+        base_delay=app.config['REDSHIFT_RETRY_BASE_DELAY'],
+        max_delay=app.config['REDSHIFT_RETRY_MAX_DELAY'],
+        on_retry=_on_retry,
+    )
+
+
+def _redact_credentials(sql):
+    return re.sub(r"CREDENTIALS '[^']+'", "CREDENTIALS '<credentials>'", sql)
+
+
+def _row_count(cursor):
+    # Statements that do not affect rows, such as DDL, report a rowcount of -1.
+    return cursor.rowcount if cursor.rowcount >= 0 else None
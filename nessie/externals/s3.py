@@ -23,23 +23,43 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+import csv
 from gzip import GzipFile
 import io
 import json
+import queue
+import random
 import socket
 import tempfile
+import threading
+import time
 from zipfile import ZipFile
+import zlib
 
-import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, ConnectionError
 from botocore.vendored.requests.packages.urllib3.exceptions import TimeoutError
 from flask import current_app as app
-from nessie.lib import metadata
+from nessie.externals import aws
+from nessie.lib import metadata, s3_index
+import pandas
 import requests
-import smart_open
 
 """Client code to run file operations against S3."""
 
+# Compressed bytes read at a time from gzipped CSV files; each block's complete lines are parsed as one batch.
+CSV_BLOCK_SIZE = 1024 * 1024
+
+# Connect and read timeouts, in seconds, and read size in bytes for files synced from URLs.
+URL_SYNC_TIMEOUT = (10, 60)
+URL_SYNC_READ_SIZE = 1024 * 1024
+
+# Pages of up to 1000 keys listed ahead of the consumer for each concurrently listed partition of a key range.
+LIST_PREFETCH_PAGES = 2
+
 
 def build_s3_url(key):
     bucket = app.config['LOCH_S3_BUCKET']
@@ -47,23 +67,53 @@ def build_s3_url(key):
 
 
 def copy(source_bucket, source_key, dest_bucket, dest_key):
-    client = get_client()
-    source = {
-        'Bucket': source_bucket,
-        'Key': source_key,
-    }
     try:
-        return client.copy_object(
-            Bucket=dest_bucket,
-            Key=dest_key,
-            CopySource=source,
-            ServerSideEncryption=app.config['LOCH_S3_ENCRYPTION'],
-        )
+        return _copy_object(get_client(), source_bucket, source_key, dest_bucket, dest_key)
     except (ClientError, ConnectionError, ValueError) as e:
         app.logger.error(f'Error on S3 object copy: ({source_bucket}/{source_key} to {dest_bucket}/{dest_key}, error={e}')
         return False
 
 
+def copy_objects(copies, max_workers=None):
+    """Copy objects concurrently, given an iterable of (source_bucket, source_key, dest_bucket, dest_key) tuples.
+
+    Copies run on up to max_workers (by default LOCH_S3_COPY_MAX_WORKERS) threads, and each is attempted up to
+    LOCH_S3_COPY_MAX_ATTEMPTS times unless it fails with a client error such as a missing source object. Returns a dict
+    listing the 'copied' tuples and the 'failed' tuples, each failure followed by its error message.
+    """
+    if max_workers is None:
+        max_workers = app.config['LOCH_S3_COPY_MAX_WORKERS']
+    client = get_client()
+    app_obj = app._get_current_object()
+    report = {'copied': [], 'failed': []}
+
+    def _copy(item):
+        with app_obj.app_context():
+            return _copy_with_retries(client, *item)
+
+    def _collect(done):
+        for future in done:
+            item = pending.pop(future)
+            error = future.result()
+            if error:
+                app.logger.error(f'Error on S3 object copy: ({item[0]}/{item[1]} to {item[2]}/{item[3]}, error={error}')
+                report['failed'].append((*item, error))
+            else:
+                report['copied'].append(item)
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep a bounded number of copies in flight, so that a lazily generated list of copies is never held in memory.
+        for item in copies:
+            if len(pending) >= 2 * max_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+            pending[executor.submit(_copy, tuple(item))] = tuple(item)
+        _collect(wait(pending).done)
+    app.logger.info(f"S3 bulk copy complete: {len(report['copied'])} copied, {len(report['failed'])} failed")
+    return report
+
+
 def delete_objects(keys, bucket=None):
     client = get_client()
     if not bucket:
@@ -80,7 +130,7 @@ def delete_objects(keys, bucket=None):
 
 def delete_objects_with_prefix(prefix, whitelist=[]):
     keys_to_delete = []
-    existing_keys = get_keys_with_prefix(prefix)
+    existing_keys = s3_index.get_keys_with_prefix(prefix)
     if existing_keys is None:
         app.logger.error('Error listing keys, aborting job.')
         return False
@@ -94,55 +144,51 @@ def delete_objects_with_prefix(prefix, whitelist=[]):
     if not keys_to_delete:
         return True
     if delete_objects(keys_to_delete):
+        s3_index.remove_keys(keys_to_delete)
         metadata.delete_canvas_snapshots(keys_to_delete)
         return True
     else:
         return False
 
 
-def get_sts_credentials():
-    sts_client = boto3.client('sts')
-    role_arn = app.config['AWS_APP_ROLE_ARN']
-    assumed_role_object = sts_client.assume_role(
-        RoleArn=role_arn,
-        RoleSessionName='AssumeAppRoleSession',
-        DurationSeconds=900,
-    )
-    return assumed_role_object['Credentials']
-
-
 def get_session():
-    credentials = get_sts_credentials()
-    return boto3.Session(
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretAccessKey'],
-        aws_session_token=credentials['SessionToken'],
-    )
+    return aws.get_session()
 
 
 def get_client():
-    session = get_session()
-    return session.client('s3', region_name=app.config['LOCH_S3_REGION'])
+    return aws.get_client('s3', region_name=app.config['LOCH_S3_REGION'])
 
 
 def get_keys_with_prefix(prefix, full_objects=False, bucket=None):
-    client = get_client()
     if not bucket:
         bucket = app.config['LOCH_S3_BUCKET']
-    objects = []
-    paginator = client.get_paginator('list_objects')
-    page_iterator = paginator.paginate(Bucket=bucket, Prefix=prefix)
     try:
-        for page in page_iterator:
-            if 'Contents' in page:
-                if full_objects:
-                    objects += page['Contents']
-                else:
-                    objects += [o.get('Key') for o in page['Contents']]
+        return list(iter_keys(prefix, full_objects=full_objects, bucket=bucket))
     except (ClientError, ConnectionError, ValueError) as e:
         app.logger.error(f'Error listing S3 keys with prefix: bucket={bucket}, prefix={prefix}, error={e}')
         return None
-    return objects
+
+
+def iter_keys(prefix, full_objects=False, bucket=None, split_after=None, max_workers=None):
+    """Yield keys (or, if full_objects is set, object summaries) matching a prefix, in order, one page at a time.
+
+    Unlike get_keys_with_prefix, errors are raised rather than logged. Given a list of split_after keys, the key
+    range is split into consecutive partitions ending at each split key (inclusive), which are listed concurrently on
+    up to max_workers (by default LOCH_S3_LIST_MAX_WORKERS) threads. Each partition lists at most a few pages ahead of
+    the consumer, and keys are still yielded in order.
+    """
+    if not bucket:
+        bucket = app.config['LOCH_S3_BUCKET']
+    client = get_client()
+    if not split_after:
+        pages = _list_pages(client, bucket, prefix)
+    else:
+        pages = _list_partitions(client, bucket, prefix, sorted(split_after), max_workers or app.config['LOCH_S3_LIST_MAX_WORKERS'])
+    for page in pages:
+        if full_objects:
+            yield from page
+        else:
+            yield from (o['Key'] for o in page)
 
 
 def get_object_json(s3_key):
@@ -152,27 +198,25 @@ def get_object_json(s3_key):
 
 
 def get_object_compressed_text_reader(key):
-    """Read a .zip file as text; a blend of get_object_text and get_unzipped_text_reader."""
-    client = get_client()
+    """Open a .zip file for reading, fetching its central directory and members as they are read."""
     bucket = app.config['LOCH_S3_BUCKET']
+    reader = None
     try:
-        _object = client.get_object(Bucket=bucket, Key=key)
-        return ZipFile(io.BytesIO(_object['Body'].read()), mode='r')
+        reader = io.BufferedReader(RangedReader(key, bucket=bucket))
+        return _ClosingZipFile(reader, mode='r')
     except (ClientError, ConnectionError, ValueError) as e:
+        if reader:
+            reader.close()
         app.logger.error(f'Error retrieving S3 object text: bucket={bucket}, key={key}, error={e}')
         return None
 
 
 def get_object_text(key):
-    client = get_client()
     bucket = app.config['LOCH_S3_BUCKET']
     try:
-        _object = client.get_object(Bucket=bucket, Key=key)
-        contents = _object.get('Body')
-        if not contents:
-            app.logger.error(f'Failed to get S3 object contents: bucket={bucket}, key={key})')
-            return None
-        return contents.read().decode('utf-8')
+        # Objects larger than a single chunk are fetched in concurrent ranged requests.
+        with RangedReader(key, bucket=bucket) as reader:
+            return reader.read().decode('utf-8')
     except (ClientError, ConnectionError, ValueError) as e:
         app.logger.error(f'Error retrieving S3 object text: bucket={bucket}, key={key}, error={e}')
         return None
@@ -192,24 +236,28 @@ def get_unzipped_text_reader(key):
 
 
 def get_retriable_csv_stream(columns, key, retries=1):
-    for attempt in range(retries):
-        try:
-            data = get_unzipped_text_reader(key)
-            for line in data:
-                yield dict(zip(columns, [(int(f) if f.isdigit() else None) for f in line.strip().split(',')]))
-        except (ClientError, ConnectionError, socket.error, TimeoutError) as e:
-            if attempt + 1 < retries:
-                app.logger.error(f'CSV stream attempt {attempt + 1} of {retries} failed, will retry: {e}')
-            else:
-                app.logger.error(f'CSV stream attempt {retries} of {retries} failed, aborting')
-                raise e
-        else:
-            break
+    """Yield rows of a gzipped CSV file as dicts of integer fields, with None for any field not a non-negative integer.
+
+    Up to retries attempts are made to read the file; a retry resumes from the last fully consumed block.
+    """
+    for batch in _iter_csv_columns(columns, key, retries):
+        for row in zip(*batch):
+            yield dict(zip(columns, row))
+
+
+def iter_csv_batches(columns, key, retries=1):
+    """Yield a gzipped CSV file as DataFrames, one per block of the file, with fields parsed as in get_retriable_csv_stream.
+
+    Columns containing any field that is not an integer are of object dtype, with None in those fields.
+    """
+    for batch in _iter_csv_columns(columns, key, retries):
+        yield pandas.DataFrame(dict(zip(columns, batch)), columns=columns)
 
 
-def object_exists(key):
+def object_exists(key, bucket=None):
     client = get_client()
-    bucket = app.config['LOCH_S3_BUCKET']
+    if not bucket:
+        bucket = app.config['LOCH_S3_BUCKET']
     try:
         client.head_object(Bucket=bucket, Key=key)
         return True
@@ -236,10 +284,66 @@ def upload_data(data, s3_key, bucket=None):
     return True
 
 
+def upload_objects(uploads, bucket=None, max_workers=None, on_upload=None):
+    """Upload objects concurrently, given an iterable of (s3_key, data) pairs.
+
+    Uploads run on up to max_workers (by default LOCH_S3_UPLOAD_MAX_WORKERS) threads. The iterable is consumed lazily,
+    so that at most 2 * max_workers objects are held in memory at once. If given, on_upload is called on the calling
+    thread as each upload finishes, with its key and any error message. Returns counts of 'uploaded' and 'failed' objects.
+    """
+    if bucket is None:
+        bucket = app.config['LOCH_S3_BUCKET']
+    if max_workers is None:
+        max_workers = app.config['LOCH_S3_UPLOAD_MAX_WORKERS']
+    client = get_client()
+    encryption = app.config['LOCH_S3_ENCRYPTION']
+    report = {'uploaded': 0, 'failed': 0}
+
+    def _upload(s3_key, data):
+        try:
+            client.put_object(Bucket=bucket, Key=s3_key, Body=data, ServerSideEncryption=encryption)
+        except (ClientError, ConnectionError, ValueError) as e:
+            return str(e)
+
+    def _collect(done):
+        for future in done:
+            s3_key = pending.pop(future)
+            error = future.result()
+            if error:
+                app.logger.error(f'Error on S3 upload: bucket={bucket}, key={s3_key}, error={error}')
+                report['failed'] += 1
+            else:
+                report['uploaded'] += 1
+            if on_upload:
+                on_upload(s3_key, error)
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for s3_key, data in uploads:
+            if len(pending) >= 2 * max_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+            pending[executor.submit(_upload, s3_key, data)] = s3_key
+        _collect(wait(pending).done)
+    app.logger.info(f"S3 bulk upload complete: {report['uploaded']} uploaded, {report['failed']} failed")
+    return report
+
+
 def upload_file(file, s3_key, bucket=None):
+    """Upload a binary file, in parallel parts if it is larger than LOCH_S3_MULTIPART_PART_SIZE."""
+    if bucket is None:
+        bucket = app.config['LOCH_S3_BUCKET']
     # Be kind; rewind
     file.seek(0)
-    return upload_data(file, s3_key, bucket)
+    try:
+        with MultipartUpload(s3_key, bucket=bucket) as upload:
+            for chunk in iter(lambda: file.read(upload.part_size), b''):
+                upload.write(chunk)
+    except (ClientError, ConnectionError, ValueError) as e:
+        app.logger.error(f'Error on S3 upload: bucket={bucket}, key={s3_key}, error={e}')
+        return False
+    app.logger.info(f'S3 upload complete: bucket={bucket}, key={s3_key}')
+    return True
 
 
 def upload_json(obj, s3_key, bucket=None):
@@ -250,35 +354,318 @@ def upload_json(obj, s3_key, bucket=None):
         return upload_file(f, s3_key, bucket)
 
 
-def upload_from_url(url, s3_key, on_stream_opened=None):
+class MultipartUpload:
+    """Writable file-like object uploading to S3 in parts, on background threads, as data is written.
+
+    Use as a context manager: the upload completes when the block exits normally and is aborted if the block raises.
+    Writes block while max_workers parts are in flight, so at most max_workers + 1 parts are held in memory. Data
+    amounting to less than one part is sent in a single request on completion. Upload errors are raised from write,
+    complete or the exiting with statement.
+    """
+
+    def __init__(self, s3_key, bucket=None, part_size=None, max_workers=None, extra_args=None):
+        self.bucket = bucket or app.config['LOCH_S3_BUCKET']
+        self.key = s3_key
+        self.extra_args = extra_args or {'ServerSideEncryption': app.config['LOCH_S3_ENCRYPTION']}
+        self.part_size = part_size or app.config['LOCH_S3_MULTIPART_PART_SIZE']
+        self.max_workers = max_workers or app.config['LOCH_S3_MULTIPART_MAX_WORKERS']
+        self.bytes_written = 0
+        self.part_count = 0
+        self._client = get_client()
+        self._buffer = bytearray()
+        self._executor = None
+        self._upload_id = None
+        self._parts = []
+        self._pending = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            try:
+                self.complete()
+            except BaseException:
+                self.abort()
+                raise
+        else:
+            self.abort()
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def complete(self):
+        if self._upload_id is None:
+            self._client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self.extra_args)
+        else:
+            if self._buffer:
+                self._submit_part(bytes(self._buffer))
+            self._collect_parts(wait(self._pending).done)
+            self._client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': sorted(self._parts, key=lambda p: p['PartNumber'])},
+            )
+            self._executor.shutdown()
+        self._buffer = bytearray()
+
+    def abort(self):
+        if self._executor:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown()
+        if self._upload_id:
+            try:
+                self._client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except (ClientError, ConnectionError) as e:
+                app.logger.error(f'Error aborting S3 multipart upload: bucket={self.bucket}, key={self.key}, error={e}')
+            self._upload_id = None
+        self._buffer = bytearray()
+
+    def _collect_parts(self, done):
+        for future in done:
+            self._pending.discard(future)
+            self._parts.append(future.result())
+
+    def _submit_part(self, data):
+        if self._upload_id is None:
+            response = self._client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.extra_args)
+            self._upload_id = response['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        if len(self._pending) >= self.max_workers:
+            self._collect_parts(wait(self._pending, return_when=FIRST_COMPLETED).done)
+        self.part_count += 1
+        self._pending.add(self._executor.submit(self._upload_part, self.part_count, data))
+
+    def _upload_part(self, part_number, data):
+        response = self._client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+
+class ShardedUpload:
+    """Writable file-like object dealing lines over gzipped shards, uploaded under a manifest for Redshift COPY.
+
+    Complete lines are dealt round-robin to shard_count shards, each compressed and uploaded as it is written. On exit,
+    a manifest listing every shard is uploaded to manifest_key, so that a single COPY ... GZIP MANIFEST loads the
+    shards in parallel across cluster slices. Shards are aborted, and no manifest written, if the block raises.
+    """
+
+    def __init__(self, s3_key, shard_count, bucket=None):
+        self.bucket = bucket or app.config['LOCH_S3_BUCKET']
+        self.manifest_key = f'{s3_key}.manifest'
+        self.shard_keys = [f'{s3_key}.{index:04d}.gz' for index in range(shard_count)]
+        self.row_count = 0
+        self._partial_line = b''
+        self._shards = []
+        self._stack = ExitStack()
+
+    def __enter__(self):
+        with ExitStack() as stack:
+            for key in self.shard_keys:
+                # Shards upload one part at a time, since the shards themselves upload in parallel.
+                upload = stack.enter_context(MultipartUpload(key, bucket=self.bucket, max_workers=1))
+                self._shards.append(stack.enter_context(GzipFile(fileobj=upload, mode='wb')))
+            self._stack = stack.pop_all()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self._partial_line:
+            self.write(b'\n')
+        # Closing each gzip stream writes its trailer before its upload completes.
+        self._stack.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            manifest = {'entries': [{'url': f's3://{self.bucket}/{key}', 'mandatory': True} for key in self.shard_keys]}
+            get_client().put_object(
+                Bucket=self.bucket,
+                Key=self.manifest_key,
+                Body=json.dumps(manifest).encode(),
+                ServerSideEncryption=app.config['LOCH_S3_ENCRYPTION'],
+            )
+
+    def write(self, data):
+        lines = (self._partial_line + data).split(b'\n')
+        self._partial_line = lines.pop()
+        shard_count = len(self._shards)
+        for line in lines:
+            self._shards[self.row_count % shard_count].write(line + b'\n')
+            self.row_count += 1
+        return len(data)
+
+
+class _ClosingZipFile(ZipFile):
+    """ZipFile which, unlike its parent, closes the file object it was given when it is itself closed."""
+
+    def __init__(self, file, **kwargs):
+        super().__init__(file, **kwargs)
+        self._source = file
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source.close()
+
+
+class RangedReader(io.RawIOBase):
+    """Seekable, read-only file object over an S3 object, fetched in ranged GETs of chunk_size bytes.
+
+    Reads fetch only the chunks they touch, so a ZipFile can read its central directory and then individual members
+    without downloading the whole archive. Once reads run sequentially, up to max_workers chunks ahead are fetched
+    concurrently. Only those and a few recently read chunks are held in memory. Fetch errors are raised from read.
+    """
+
+    def __init__(self, key, bucket=None, chunk_size=None, max_workers=None):
+        self.bucket = bucket or app.config['LOCH_S3_BUCKET']
+        self.key = key
+        self.chunk_size = chunk_size or app.config['LOCH_S3_RANGE_CHUNK_SIZE']
+        self.max_workers = max_workers or app.config['LOCH_S3_RANGE_MAX_WORKERS']
+        self._client = get_client()
+        self._executor = None
+        self._position = 0
+        self._last_index = 0
+        self._chunks = OrderedDict()
+        # The first chunk is fetched up front, since its response gives the size of the object.
+        first_chunk = self._fetch_chunk(0)
+        self._chunks[0] = Future()
+        self._chunks[0].set_result(first_chunk)
+
+    @property
+    def chunk_count(self):
+        return -(-self.size // self.chunk_size)
+
+    def close(self):
+        if self._executor:
+            for future in self._chunks.values():
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._chunks.clear()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def readall(self):
+        chunks = []
+        while self._position < self.size:
+            index, offset = divmod(self._position, self.chunk_size)
+            chunk = self._get_chunk(index)
+            chunks.append(chunk[offset:] if offset else chunk)
+            self._position += len(chunk) - offset
+        return b''.join(chunks)
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        index, offset = divmod(self._position, self.chunk_size)
+        chunk = self._get_chunk(index)
+        length = min(len(buffer), len(chunk) - offset)
+        buffer[:length] = chunk[offset:offset + length]
+        self._position += length
+        return length
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+        self._position = offset
+        return offset
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def _fetch_chunk(self, index):
+        start = index * self.chunk_size
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{start + self.chunk_size - 1}')
+        except ClientError as e:
+            # An empty object has no satisfiable range.
+            if index == 0 and e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                self.size = 0
+                return b''
+            raise
+        if index == 0:
+            content_range = response.get('ContentRange')
+            self.size = int(content_range.split('/')[-1]) if content_range else response['ContentLength']
+        return response['Body'].read()
+
+    def _get_chunk(self, index):
+        # Read ahead only when reads run sequentially; ZipFile's jumps between headers need just the chunk at hand.
+        sequential = index in (self._last_index, self._last_index + 1)
+        self._last_index = index
+        last_index = min(index + self.max_workers, self.chunk_count - 1) if sequential else index
+        for i in range(index, last_index + 1):
+            if i not in self._chunks:
+                if not self._executor:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                self._chunks[i] = self._executor.submit(self._fetch_chunk, i)
+        self._chunks.move_to_end(index)
+        # Keep fetches ahead of this chunk, and otherwise only the most recently read chunks.
+        for i in list(self._chunks):
+            if len(self._chunks) <= 2 * self.max_workers + 1:
+                break
+            if not (index <= i <= last_index):
+                self._chunks.pop(i).cancel()
+        return self._chunks[index].result()
+
+
+def upload_from_url(url, s3_key, on_stream_opened=None, resume=None, on_parts_uploaded=None):
+    """Copy a file from a URL to S3, as a multipart upload of LOCH_S3_URL_SYNC_PART_SIZE parts.
+
+    If the source honors range requests, parts are fetched in ranged GETs and uploaded concurrently on up to
+    LOCH_S3_URL_SYNC_MAX_WORKERS threads, each retried up to LOCH_S3_URL_SYNC_MAX_ATTEMPTS times. A failed multipart
+    upload is left in place, so that a later call given resume=(upload_id, part_numbers) fetches only the parts S3
+    does not already have. If given, on_parts_uploaded is called with the upload id and the sorted numbers of the
+    completed parts as each part completes. Sources without range support are streamed in a single pass. Downloads
+    are held to LOCH_S3_URL_SYNC_MAX_BYTES_PER_SECOND across all syncs on this host, if set.
+    """
     bucket = app.config['LOCH_S3_BUCKET']
-    s3_url = build_s3_url(s3_key)
-    with requests.get(url, stream=True) as response:
-        if response.status_code != 200:
+    extra_args = {'ServerSideEncryption': app.config['LOCH_S3_ENCRYPTION']}
+    if s3_key.endswith('.gz'):
+        extra_args.update({
+            'ContentEncoding': 'gzip',
+            'ContentType': 'text/plain',
+        })
+    # A one-byte range request reveals both the size of the file and whether ranges are supported.
+    with requests.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=URL_SYNC_TIMEOUT) as response:
+        if response.status_code not in (200, 206):
             app.logger.error(
                 f'Received unexpected status code, aborting S3 upload '
                 f'(status={response.status_code}, body={response.text}, key={s3_key} url={url})')
-            raise ConnectionError(f'Response {response.status_code}: {response.text}')
-        if on_stream_opened:
-            on_stream_opened(response.headers)
+            raise requests.ConnectionError(f'Response {response.status_code}: {response.text}')
         try:
-            s3_upload_args = {'ServerSideEncryption': app.config['LOCH_S3_ENCRYPTION']}
-            if s3_url.endswith('.gz'):
-                s3_upload_args.update({
-                    'ContentEncoding': 'gzip',
-                    'ContentType': 'text/plain',
-                })
-            session = get_session()
-            # smart_open needs to be told to ignore the .gz extension, or it will smartly attempt to double-compress it.
-            with smart_open.open(
-                s3_url,
-                'wb',
-                ignore_ext=True,
-                transport_params=dict(session=session, multipart_upload_kwargs=s3_upload_args),
-            ) as s3_out:
-                for chunk in response.iter_content(chunk_size=1024):
-                    s3_out.write(chunk)
-        except (ClientError, ConnectionError, ValueError) as e:
+            if response.status_code == 206:
+                size = int(response.headers['Content-Range'].split('/')[-1])
+                if on_stream_opened:
+                    on_stream_opened({**response.headers, 'Content-Length': str(size)})
+                response.close()
+                _upload_url_in_parts(url, s3_key, bucket, size, extra_args, resume, on_parts_uploaded)
+            else:
+                if on_stream_opened:
+                    on_stream_opened(response.headers)
+                with MultipartUpload(s3_key, bucket=bucket, part_size=app.config['LOCH_S3_URL_SYNC_PART_SIZE'], extra_args=extra_args) as upload:
+                    for chunk in response.iter_content(chunk_size=URL_SYNC_READ_SIZE):
+                        _get_bandwidth_limiter().consume(len(chunk))
+                        upload.write(chunk)
+        except (ClientError, ConnectionError, ValueError, requests.RequestException) as e:
             app.logger.error(f'Error on S3 upload: source_url={url}, bucket={bucket}, key={s3_key}, error={e}')
             raise e
     s3_response = get_client().head_object(Bucket=bucket, Key=s3_key)
@@ -290,3 +677,284 @@ def upload_from_url(url, s3_key, on_stream_opened=None):
 def upload_tsv_rows(rows, s3_key):
     data = b'\n'.join(rows)
     return upload_data(data, s3_key)
+
+
+def upload_tsv_shards(rows, s3_key, shard_count):
+    """Upload encoded TSV rows as gzipped shards under a manifest (see ShardedUpload), returning the manifest key."""
+    bucket = app.config['LOCH_S3_BUCKET']
+    try:
+        with ShardedUpload(s3_key, shard_count) as upload:
+            for row in rows:
+                upload.write(row + b'\n')
+    except (ClientError, ConnectionError, ValueError) as e:
+        app.logger.error(f'Error on S3 upload: bucket={bucket}, key={s3_key}, error={e}')
+        return None
+    app.logger.info(f'S3 upload complete: bucket={bucket}, key={upload.manifest_key} ({upload.row_count} rows, {shard_count} shards)')
+    return upload.manifest_key
+
+
+def _iter_csv_columns(columns, key, retries):
+    for block in _iter_gzip_line_blocks(key, retries):
+        frame = pandas.read_csv(
+            io.BytesIO(block),
+            header=None,
+            names=columns,
+            index_col=False,
+            dtype=str,
+            na_filter=False,
+            quoting=csv.QUOTE_NONE,
+        )
+        batch = []
+        for column in columns:
+            fields = frame[column].str.strip()
+            is_integer = fields.str.isdigit().to_numpy()
+            values = fields.where(is_integer, '0').to_numpy().astype('int64')
+            if not is_integer.all():
+                values = values.astype(object)
+                values[~is_integer] = None
+            batch.append(values)
+        yield batch
+
+
+def _iter_gzip_line_blocks(key, retries):
+    """Yield the complete lines decompressed from each block of a gzipped object.
+
+    After a read error, the next of up to retries attempts resumes with a ranged request from the end of the last block
+    yielded, since the decompressor and any partial line are only updated once a block has been read in full.
+    """
+    client = get_client()
+    bucket = app.config['LOCH_S3_BUCKET']
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    offset = 0
+    partial_line = b''
+    for attempt in range(retries):
+        try:
+            response = client.get_object(Bucket=bucket, Key=key, Range=f'bytes={offset}-') if offset else client.get_object(Bucket=bucket, Key=key)
+            while True:
+                compressed = response['Body'].read(CSV_BLOCK_SIZE)
+                if not compressed:
+                    break
+                data = decompressor.decompress(compressed)
+                # Concatenated gzip members are each decompressed in turn.
+                while decompressor.unused_data:
+                    unused_data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    data += decompressor.decompress(unused_data)
+                offset += len(compressed)
+                lines, newline, partial_line = (partial_line + data).rpartition(b'\n')
+                if newline:
+                    yield lines + newline
+            if partial_line.strip():
+                yield partial_line
+            return
+        except (ClientError, ConnectionError, socket.error, TimeoutError) as e:
+            if attempt + 1 < retries:
+                app.logger.error(f'CSV stream attempt {attempt + 1} of {retries} failed, will resume from byte {offset}: {e}')
+            else:
+                app.logger.error(f'CSV stream attempt {retries} of {retries} failed, aborting')
+                raise e
+
+
+def _list_pages(client, bucket, prefix, start_after=None, end_at=None):
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    for page in client.get_paginator('list_objects_v2').paginate(**kwargs):
+        objects = page.get('Contents', [])
+        if end_at is not None and objects and objects[-1]['Key'] > end_at:
+            yield [o for o in objects if o['Key'] <= end_at]
+            return
+        yield objects
+
+
+def _list_partitions(client, bucket, prefix, split_after, max_workers):
+    bounds = list(zip([None] + split_after, split_after + [None]))
+    queues = [queue.Queue(maxsize=LIST_PREFETCH_PAGES) for _ in bounds]
+    stop = threading.Event()
+    # Partitions are submitted in order, so the partition being consumed has always started and never waits on a
+    # later partition for a worker.
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for q, (start_after, end_at) in zip(queues, bounds):
+            executor.submit(_produce_pages, q, stop, _list_pages(client, bucket, prefix, start_after, end_at))
+        for q in queues:
+            while True:
+                page, error = q.get()
+                if error:
+                    raise error
+                if page is None:
+                    break
+                yield page
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+def _produce_pages(q, stop, pages):
+    def _put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    try:
+        for page in pages:
+            if stop.is_set():
+                return
+            _put((page, None))
+        _put((None, None))
+    except Exception as e:
+        _put((None, e))
+
+
+class _BandwidthLimiter:
+    """Token bucket shared by the threads of a process, holding throughput to rate bytes per second on average."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._allowance = rate
+        self._last_checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, byte_count):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last_checked) * self.rate)
+            self._last_checked = now
+            self._allowance -= byte_count
+            delay = -self._allowance / self.rate if self._allowance < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+_bandwidth_limiter = None
+
+
+def _get_bandwidth_limiter():
+    global _bandwidth_limiter
+    rate = app.config['LOCH_S3_URL_SYNC_MAX_BYTES_PER_SECOND']
+    if _bandwidth_limiter is None or _bandwidth_limiter.rate != rate:
+        _bandwidth_limiter = _BandwidthLimiter(rate)
+    return _bandwidth_limiter
+
+
+def _fetch_url_range(url, start, end):
+    limiter = _get_bandwidth_limiter()
+    data = bytearray()
+    with requests.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=URL_SYNC_TIMEOUT) as response:
+        if response.status_code != 206:
+            raise requests.ConnectionError(f'Response {response.status_code} to range request for bytes {start}-{end}')
+        for chunk in response.iter_content(chunk_size=URL_SYNC_READ_SIZE):
+            limiter.consume(len(chunk))
+            data += chunk
+    if len(data) != end - start + 1:
+        raise requests.ConnectionError(f'Received {len(data)} of {end - start + 1} bytes in range {start}-{end}')
+    return bytes(data)
+
+
+def _resume_multipart_upload(client, bucket, s3_key, resume, part_size):
+    upload_id, part_numbers = resume
+    try:
+        listed = client.list_parts(Bucket=bucket, Key=s3_key, UploadId=upload_id, MaxParts=10000).get('Parts', [])
+    except ClientError as e:
+        app.logger.warning(f'Cannot resume S3 multipart upload, will start over: key={s3_key}, upload_id={upload_id}, error={e}')
+        return None, {}
+    # S3's own record of uploaded parts may run ahead of our last recorded part numbers.
+    parts = {p['PartNumber']: {'ETag': p['ETag'], 'PartNumber': p['PartNumber']} for p in listed if p['Size'] == part_size}
+    app.logger.info(f'Resuming S3 multipart upload with {len(parts)} parts uploaded ({len(part_numbers)} recorded): key={s3_key}')
+    return upload_id, parts
+
+
+def _transfer_url_part(client, url, bucket, s3_key, upload_id, part_number, part_size, size):
+    start = (part_number - 1) * part_size
+    end = min(start + part_size, size) - 1
+    max_attempts = app.config['LOCH_S3_URL_SYNC_MAX_ATTEMPTS']
+    for attempt in range(1, max_attempts + 1):
+        try:
+            data = _fetch_url_range(url, start, end)
+            response = client.upload_part(Bucket=bucket, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=data)
+            return {'ETag': response['ETag'], 'PartNumber': part_number}
+        except (ClientError, ConnectionError, requests.RequestException) as e:
+            if attempt == max_attempts:
+                raise
+            app.logger.warning(f'Part {part_number} of {s3_key} failed on attempt {attempt}, will retry: {e}')
+
+
+def _upload_url_in_parts(url, s3_key, bucket, size, extra_args, resume, on_parts_uploaded):
+    client = get_client()
+    part_size = app.config['LOCH_S3_URL_SYNC_PART_SIZE']
+    part_count = max(1, -(-size // part_size))
+    if part_count == 1:
+        data = _fetch_url_range(url, 0, size - 1) if size else b''
+        client.put_object(Bucket=bucket, Key=s3_key, Body=data, **extra_args)
+        return
+    upload_id, parts = _resume_multipart_upload(client, bucket, s3_key, resume, part_size) if resume else (None, {})
+    if upload_id is None:
+        upload_id = client.create_multipart_upload(Bucket=bucket, Key=s3_key, **extra_args)['UploadId']
+    app_obj = app._get_current_object()
+
+    def _transfer(part_number):
+        with app_obj.app_context():
+            return _transfer_url_part(client, url, bucket, s3_key, upload_id, part_number, part_size, size)
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=app.config['LOCH_S3_URL_SYNC_MAX_WORKERS']) as executor:
+        try:
+            for part_number in range(1, part_count + 1):
+                if part_number not in parts:
+                    pending[executor.submit(_transfer, part_number)] = part_number
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    part = future.result()
+                    del pending[future]
+                    parts[part['PartNumber']] = part
+                if on_parts_uploaded:
+                    on_parts_uploaded(upload_id, sorted(parts))
+        finally:
+            # The upload itself is not aborted, so that parts already uploaded can be reused by a later attempt.
+            for future in pending:
+                future.cancel()
+    client.complete_multipart_upload(
+        Bucket=bucket,
+        Key=s3_key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [parts[n] for n in sorted(parts)]},
+    )
+
+
+def _copy_object(client, source_bucket, source_key, dest_bucket, dest_key):
+    source = {
+        'Bucket': source_bucket,
+        'Key': source_key,
+    }
+    extra_args = {'ServerSideEncryption': app.config['LOCH_S3_ENCRYPTION']}
+    try:
+        return client.copy_object(Bucket=dest_bucket, Key=dest_key, CopySource=source, **extra_args)
+    except ClientError as e:
+        # A single CopyObject request is limited to source objects of 5 GB; larger objects must be copied in parts.
+        if 'copy source is larger than the maximum allowable size' not in str(e):
+            raise
+    part_size = app.config['LOCH_S3_COPY_PART_SIZE']
+    config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size, use_threads=False)
+    client.copy(source, dest_bucket, dest_key, ExtraArgs=extra_args, Config=config)
+    return client.head_object(Bucket=dest_bucket, Key=dest_key)
+
+
+def _copy_with_retries(client, source_bucket, source_key, dest_bucket, dest_key):
+    """Return None on success, or the error message of the last failed attempt."""
+    max_attempts = app.config['LOCH_S3_COPY_MAX_ATTEMPTS']
+    for attempt in range(1, max_attempts + 1):
+        try:
+            _copy_object(client, source_bucket, source_key, dest_bucket, dest_key)
+            return None
+        except (ClientError, ConnectionError, ValueError) as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') if isinstance(e, ClientError) else None
+            # Client errors other than throttling will not succeed on retry.
+            if attempt == max_attempts or (status and status < 500 and status != 429):
+                return str(e)
+            app.logger.warning(f'S3 copy attempt {attempt} of {max_attempts} failed, will retry: {source_bucket}/{source_key}, error={e}')
+            time.sleep(random.uniform(0, 2 ** attempt))
@@ -34,6 +34,7 @@ from nessie.externals import redshift
 from nessie.jobs.queue import get_job_queue
 from nessie.lib.berkeley import send_system_error_email
 from nessie.lib.metadata import create_background_job_status, update_background_job_status
+from nessie.lib.query_stats import job_context
 from nessie.models.util import advisory_lock
 
 """Parent class for background jobs."""
@@ -99,7 +100,7 @@ class BackgroundJob(object):
 
     def run_wrapped(self, **kwargs):
         lock_id = kwargs.pop('lock_id', None)
-        with advisory_lock(lock_id):
+        with advisory_lock(lock_id), job_context(self.job_id):
             if self.status_logging_enabled:
                 create_background_job_status(self.job_id)
             try:
@@ -28,6 +28,7 @@ from datetime import datetime, timedelta
 from flask import current_app as app
 from nessie.externals import calnet, rds, redshift, s3
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError, verify_external_schema
+from nessie.lib import s3_index
 from nessie.lib.util import encoded_tsv_row, get_s3_calnet_daily_path, get_s3_sis_sysadm_daily_path, resolve_sql_template, resolve_sql_template_string
 
 """Logic for Advisor schema creation job."""
@@ -56,7 +57,7 @@ class CreateAdvisorSchema(BackgroundJob):
         redshift.drop_external_schema(self.external_schema)
 
         s3_sis_daily = get_s3_sis_sysadm_daily_path()
-        if not s3.get_keys_with_prefix(s3_sis_daily):
+        if not s3_index.get_keys_with_prefix(s3_sis_daily):
             s3_sis_daily = _get_yesterdays_advisor_data()
         s3_path = '/'.join([f"s3://{app.config['LOCH_S3_BUCKET']}", s3_sis_daily, 'advisors'])
 
@@ -80,7 +81,7 @@ class CreateAdvisorSchema(BackgroundJob):
 
 def _get_yesterdays_advisor_data():
     s3_sis_daily = get_s3_sis_sysadm_daily_path(datetime.now() - timedelta(days=1))
-    if not s3.get_keys_with_prefix(s3_sis_daily):
+    if not s3_index.get_keys_with_prefix(s3_sis_daily):
         raise BackgroundJobError('No timely SIS S3 advisor data found')
 
     app.logger.info('Falling back to SIS S3 daily advisor data for yesterday')
@@ -114,7 +115,7 @@ def _import_calnet_attributes(advisor_ids):
 
     s3_key = f'{get_s3_calnet_daily_path()}/advisors/advisors.tsv'
     app.logger.info(f'Will stash {len(advisor_rows)} feeds in S3: {s3_key}')
-    if not s3.upload_tsv_rows(advisor_rows, s3_key):
+    if not s3.upload_tsv_shards(advisor_rows, s3_key, redshift.get_copy_shard_count()):
         raise BackgroundJobError('Error on S3 upload: aborting job.')
 
     app.logger.info('Will copy S3 feeds into Redshift...')
@@ -122,9 +123,11 @@ def _import_calnet_attributes(advisor_ids):
         """
         TRUNCATE {redshift_schema_advisor_internal}.advisor_attributes;
         COPY {redshift_schema_advisor_internal}.advisor_attributes
-            FROM '{loch_s3_calnet_data_path}/advisors/advisors.tsv'
+            FROM '{loch_s3_calnet_data_path}/advisors/advisors.tsv.manifest'
             IAM_ROLE '{redshift_iam_role}'
-            DELIMITER '\\t';
+            DELIMITER '\\t'
+            GZIP
+            MANIFEST;
         """,
     )
     was_successful = redshift.execute(query)
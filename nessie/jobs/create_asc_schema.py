@@ -36,8 +36,9 @@ class CreateAscSchema(BackgroundJob):
     def run(self):
         app.logger.info('Starting ASC schema creation job...')
         app.logger.info('Executing SQL...')
+        # Every statement in the template can be repeated harmlessly, so transient failures are retried.
         resolved_ddl = resolve_sql_template('create_asc_schema.template.sql')
-        if redshift.execute_ddl_script(resolved_ddl):
+        if redshift.execute_ddl_script(resolved_ddl, retry_safe=True):
             app.logger.info(f"Schema '{app.config['REDSHIFT_SCHEMA_ASC']}' found or created.")
         else:
             raise BackgroundJobError('ASC schema creation failed.')
@@ -26,9 +26,9 @@ ENHANCEMENTS, OR MODIFICATIONS.
 from datetime import datetime, timedelta
 
 from flask import current_app as app
-from nessie.externals import redshift, s3
+from nessie.externals import redshift
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError, verify_external_schema
-from nessie.lib import berkeley
+from nessie.lib import berkeley, s3_index
 from nessie.lib.util import get_s3_canvas_daily_path, resolve_sql_template
 
 """Logic for Canvas schema creation job."""
@@ -40,9 +40,9 @@ class CreateCanvasSchema(BackgroundJob):
         app.logger.info('Starting Canvas schema creation job...')
 
         canvas_path = get_s3_canvas_daily_path()
-        if not s3.get_keys_with_prefix(canvas_path):
+        if not s3_index.get_keys_with_prefix(canvas_path):
             canvas_path = get_s3_canvas_daily_path(datetime.now() - timedelta(days=1))
-            if not s3.get_keys_with_prefix(canvas_path):
+            if not s3_index.get_keys_with_prefix(canvas_path):
                 raise BackgroundJobError('No timely Canvas data found, aborting')
             else:
                 app.logger.info('Falling back to yesterday\'s Canvas data')
@@ -60,6 +60,7 @@ class CreateCoeSchema(BackgroundJob):
             raise BackgroundJobError('COE external schema creation failed.')
         coe_rows = redshift.fetch(
             'SELECT * FROM {schema}.students ORDER by sid',
+            row_type='dictrow',
             schema=internal_schema_identifier,
         )
 
@@ -91,16 +92,18 @@ class CreateCoeSchema(BackgroundJob):
 
         s3_key = f'{get_s3_coe_daily_path()}/coe_profiles.tsv'
         app.logger.info(f'Will stash {len(profile_rows)} feeds in S3: {s3_key}')
-        if not s3.upload_tsv_rows(profile_rows, s3_key):
+        if not s3.upload_tsv_shards(profile_rows, s3_key, redshift.get_copy_shard_count()):
             raise BackgroundJobError('Error on S3 upload: aborting job.')
 
         app.logger.info('Will copy S3 feeds into Redshift...')
         query = resolve_sql_template_string(
             """
             COPY {redshift_schema_coe}.student_profiles
-                FROM '{loch_s3_coe_data_path}/coe_profiles.tsv'
+                FROM '{loch_s3_coe_data_path}/coe_profiles.tsv.manifest'
                 IAM_ROLE '{redshift_iam_role}'
-                DELIMITER '\\t';
+                DELIMITER '\\t'
+                GZIP
+                MANIFEST;
             """,
         )
         if not redshift.execute(query):
@@ -126,9 +129,10 @@ class CreateCoeSchema(BackgroundJob):
                 'sat1read', 'sat1math', 'sat2math', 'in_met', 'grad_term', 'grad_year',
                 'probation', 'status',
             ]
-            result = transaction.insert_bulk(
-                f'INSERT INTO {rds_schema}.students ({", ".join(columns)}) VALUES %s',
-                [tuple([r[c] for c in columns]) for r in coe_rows],
+            result = transaction.copy_rows(
+                f'{rds_schema}.students',
+                columns,
+                (tuple([r[c] for c in columns]) for r in coe_rows),
             )
             if not result:
                 return False
@@ -23,27 +23,35 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from decimal import Decimal
-from itertools import groupby, islice, repeat
+from itertools import groupby, islice
 import json
+from multiprocessing import current_process
 from operator import itemgetter
+import os
 import pickle
-from tempfile import TemporaryFile
+import shutil
+from tempfile import TemporaryDirectory
 from threading import current_thread
 
 from flask import current_app as app
-from nessie.externals import redshift, s3
+from nessie.externals import redshift
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
 from nessie.lib.berkeley import career_code_to_name, current_term_id, term_info_for_sis_term_id, term_name_for_sis_id
 from nessie.lib.queries import stream_edl_degrees, stream_edl_demographics, stream_edl_holds, stream_edl_plans,\
     stream_edl_profile_terms, stream_edl_profiles, stream_edl_registrations
-from nessie.lib.util import get_s3_edl_daily_path, resolve_sql_template, write_to_tsv_file
+from nessie.lib.streams import merge_join, open_streams
+from nessie.lib.util import forked_process_pool, get_s3_edl_daily_path, resolve_sql_template, write_to_tsv_file
 from nessie.merged.student_demographics import GENDER_CODE_MAP, merge_from_details, UNDERREPRESENTED_GROUPS
+from nessie.models.student_schema_manager import sharded_staging_upload
 
 """Logic for EDL SIS schema creation job."""
 
+TARGET_FILE_READ_SIZE = 1024 * 1024
+
 
 class CreateEdlSchema(BackgroundJob):
 
@@ -78,7 +86,7 @@ class CreateEdlSchema(BackgroundJob):
     def generate_degree_progress_feeds(self):
         app.logger.info('Staging degree progress feeds...')
         rows = redshift.fetch(f'SELECT * FROM {self.internal_schema}.student_degree_progress_index ORDER by sid')
-        with TemporaryFile() as feeds:
+        with _stream_to_staging('student_degree_progress') as feeds:
             for sid, rows_for_student in groupby(rows, itemgetter('sid')):
                 rows_for_student = list(rows_for_student)
                 report_date = rows_for_student[0].get('report_date')
@@ -91,7 +99,6 @@ class CreateEdlSchema(BackgroundJob):
                     },
                 }
                 write_to_tsv_file(feeds, [sid, json.dumps(feed)])
-            _upload_file_to_staging('student_degree_progress', feeds)
 
 
 class ConcurrentFeedBuilder(object):
@@ -103,31 +110,50 @@ class ConcurrentFeedBuilder(object):
     filename = None
 
     def build(self):
-        source_files = []
-        with self.fetch_source_feeds() as source_feed_generator:
-            while True:
-                results = False
-                source_file = TemporaryFile()
+        # Batches are dispatched to workers as soon as they are pickled, and finished batches stream into the staging
+        # upload in dispatch order, so that fetching, transforming and uploading overlap. Pending batches wait on disk;
+        # bounding their number keeps the fetch from running far ahead of the workers.
+        worker_count = self.get_worker_count()
+        executor, app_arg = self.get_executor(worker_count)
+        with TemporaryDirectory() as work_dir, _stream_to_staging(self.filename) as all_feeds:
+            with executor:
+                pending = deque()
+                with self.fetch_source_feeds() as source_feed_generator:
+                    for source_path in self._write_source_batches(source_feed_generator, work_dir):
+                        if len(pending) >= 2 * worker_count:
+                            _stream_target_file(pending.popleft().result(), all_feeds)
+                        pending.append(executor.submit(_build_target_file, self, source_path, app_arg))
+                while pending:
+                    _stream_target_file(pending.popleft().result(), all_feeds)
+
+    def get_worker_count(self):
+        if app.config['EDL_SCHEMA_EXECUTOR'] == 'process':
+            return app.config['EDL_SCHEMA_MAX_PROCESSES'] or os.cpu_count()
+        else:
+            return self.max_threads
+
+    def get_executor(self, worker_count):
+        # Feed assembly is pure-Python work that holds the GIL, so where forking is safe batches are fanned out to processes.
+        # Workers are forked here, before source streams start prefetch threads whose held locks a fork would copy.
+        if app.config['EDL_SCHEMA_EXECUTOR'] == 'process':
+            return forked_process_pool(worker_count), None
+        else:
+            return ThreadPoolExecutor(max_workers=worker_count), app._get_current_object()
+
+    def _write_source_batches(self, source_feed_generator, work_dir):
+        batch_index = 0
+        while True:
+            source_path = os.path.join(work_dir, f'{self.filename}_{batch_index}.pickle')
+            results = False
+            with open(source_path, 'wb') as source_file:
                 for source_feed in islice(source_feed_generator, self.batch_size):
                     pickle.dump(source_feed, source_file)
                     results = True
-                if not results:
-                    break
-                source_files.append(source_file)
-
-        target_files = []
-        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
-            app_obj = app._get_current_object()
-            for result in executor.map(self.build_target_feeds, repeat(app_obj), source_files):
-                target_files.append(result)
-
-        with TemporaryFile() as all_feeds:
-            for t in target_files:
-                t.seek(0)
-                for line in t:
-                    all_feeds.write(line)
-                t.close()
-            _upload_file_to_staging(self.filename, all_feeds)
+            if not results:
+                os.remove(source_path)
+                break
+            yield source_path
+            batch_index += 1
 
     # Subclasses implement.
     @contextmanager
@@ -135,7 +161,7 @@ class ConcurrentFeedBuilder(object):
         yield
 
     # Subclasses implement.
-    def build_target_feeds(self, app_arg, source_file):
+    def build_target_feeds(self, source_file, target_file):
         pass
 
     def get_pickled_feeds(self, f):
@@ -166,41 +192,38 @@ class DemographicsFeedBuilder(ConcurrentFeedBuilder):
         finally:
             stream.close()
 
-    def build_target_feeds(self, app_arg, source_file):
-        with app_arg.app_context():
-            app_arg.logger.debug(f'{current_thread().name} will process demographics feeds chunk')
-            target_file = TemporaryFile()
-            index = None
-
-            for sid, rows, index in self.get_pickled_feeds(source_file):
-                gender = None
-                visa = None
-                nationalities = set()
-                ethnic_map = {}
-                for r in rows:
-                    gender = r['gender']
-                    if r['visa_type']:
-                        visa = {'status': r['visa_status'], 'type': r['visa_type']}
-                    if r['citizenship_country']:
-                        nationalities.add(r['citizenship_country'])
-                    if r['ethnic_group']:
-                        if r['ethnic_group'] not in ethnic_map:
-                            ethnic_map[r['ethnic_group']] = set()
-                        ethnic_map[r['ethnic_group']].add(r['ethnicity'])
-                feed = {
-                    'gender': GENDER_CODE_MAP.get(gender, None),
-                    'ethnicities': self._simplified_ethnicities(ethnic_map),
-                    'nationalities': sorted(nationalities),
-                    'underrepresented': not UNDERREPRESENTED_GROUPS.isdisjoint(ethnic_map.keys()),
-                    'visa': visa,
-                }
-                write_to_tsv_file(target_file, [sid, json.dumps(feed)])
+    def build_target_feeds(self, source_file, target_file):
+        app.logger.debug(f'{_worker_name()} will process demographics feeds chunk')
+        index = None
+
+        for sid, rows, index in self.get_pickled_feeds(source_file):
+            gender = None
+            visa = None
+            nationalities = set()
+            ethnic_map = {}
+            for r in rows:
+                gender = r['gender']
+                if r['visa_type']:
+                    visa = {'status': r['visa_status'], 'type': r['visa_type']}
+                if r['citizenship_country']:
+                    nationalities.add(r['citizenship_country'])
+                if r['ethnic_group']:
+                    if r['ethnic_group'] not in ethnic_map:
+                        ethnic_map[r['ethnic_group']] = set()
+                    ethnic_map[r['ethnic_group']].add(r['ethnicity'])
+            feed = {
+                'gender': GENDER_CODE_MAP.get(gender, None),
+                'ethnicities': self._simplified_ethnicities(ethnic_map),
+                'nationalities': sorted(nationalities),
+                'underrepresented': not UNDERREPRESENTED_GROUPS.isdisjoint(ethnic_map.keys()),
+                'visa': visa,
+            }
+            write_to_tsv_file(target_file, [sid, json.dumps(feed)])
 
-            if index is None:
-                app_arg.logger.warn(f'{current_thread().name} wrote no demographics feeds, returning empty tempfile')
-            else:
-                app_arg.logger.debug(f'{current_thread().name} wrote {index + 1} demographics feeds, returning TSV tempfile')
-            return target_file
+        if index is None:
+            app.logger.warn(f'{_worker_name()} wrote no demographics feeds, returning empty TSV file')
+        else:
+            app.logger.debug(f'{_worker_name()} wrote {index + 1} demographics feeds, returning TSV file')
 
     @staticmethod
     def _simplified_ethnicities(ethnic_map):
@@ -218,88 +241,63 @@ class ProfileFeedBuilder(ConcurrentFeedBuilder):
 
     @contextmanager
     def fetch_source_feeds(self):
-        profile_stream = stream_edl_profiles()
-        supplemental_streams = {
-            'degrees': stream_edl_degrees(),
-            'holds': stream_edl_holds(),
-            'plans': stream_edl_plans(),
-            'profile_terms': stream_edl_profile_terms(),
-        }
-
-        try:
-            profile_results = groupby(profile_stream, lambda r: r['sid'])
-            supplemental_stream_results = {k: groupby(stream, lambda r: r['sid']) for k, stream in supplemental_streams.items()}
-
-            sid_tracker = {k: '' for k in supplemental_stream_results.keys()}
-            rows_tracker = {}
+        with open_streams(
+            profile=stream_edl_profiles,
+            degrees=stream_edl_degrees,
+            holds=stream_edl_holds,
+            plans=stream_edl_plans,
+            profile_terms=stream_edl_profile_terms,
+        ) as streams:
+            profile_stream = streams.pop('profile')
 
             def _fetch_source_feeds():
-                # To avoid StopIteration errors, mark the ends of streams with a value alphabetically greater than any SID.
-                stream_terminator = ('Z', [])
-
-                for sid, profile_rows in profile_results:
-                    grouped_results = {
-                        'sid': sid,
-                        'feed': {
-                            'profile': list(profile_rows),
-                        },
-                    }
-                    for k in supplemental_stream_results.keys():
-                        while sid_tracker[k] < sid:
-                            sid_tracker[k], rows_tracker[k] = next(supplemental_stream_results[k], stream_terminator)
-                        if sid_tracker[k] == sid:
-                            grouped_results['feed'][k] = list(rows_tracker[k])
-                    yield grouped_results
+                for sid, profile_rows, supplemental_rows in merge_join(profile_stream, itemgetter('sid'), streams):
+                    feed = {'profile': list(profile_rows)}
+                    for k, rows in supplemental_rows.items():
+                        feed[k] = list(rows)
+                    yield {'sid': sid, 'feed': feed}
 
             yield _fetch_source_feeds()
 
-        finally:
-            profile_stream.close()
-            for stream in supplemental_streams.values():
-                stream.close()
-
-    def build_target_feeds(self, app_arg, source_file):
-        with app_arg.app_context():
-            app_arg.logger.debug(f'{current_thread().name} will process profile feeds chunk')
-            target_file = TemporaryFile()
-            index = None
-
-            for sid, feed_components, index in self.get_pickled_feeds(source_file):
-                # We may see results from multiple academic careers. We prefer a UGRD career if present; otherwise we look
-                # for a non-Law career with the most recent entering term.
-                plans = feed_components.get('plans', [])
-                career_code = None
-                career_admit_term = ''
-                for plan_row in feed_components.get('plans', []):
-                    if plan_row['academic_career_cd'] == 'UGRD':
-                        career_code = 'UGRD'
-                        break
-                    elif plan_row['academic_career_cd'] in {'UCBX', 'GRAD'} and plan_row['current_admit_term'] > career_admit_term:
-                        career_code = plan_row['academic_career_cd']
-                        career_admit_term = plan_row['current_admit_term']
-
-                feed = {
-                    'identifiers': [
-                        {
-                            'id': sid,
-                            'type': 'student-id',
-                        },
-                    ],
-                }
+    def build_target_feeds(self, source_file, target_file):
+        app.logger.debug(f'{_worker_name()} will process profile feeds chunk')
+        index = None
+
+        for sid, feed_components, index in self.get_pickled_feeds(source_file):
+            # We may see results from multiple academic careers. We prefer a UGRD career if present; otherwise we look
+            # for a non-Law career with the most recent entering term.
+            plans = feed_components.get('plans', [])
+            career_code = None
+            career_admit_term = ''
+            for plan_row in feed_components.get('plans', []):
+                if plan_row['academic_career_cd'] == 'UGRD':
+                    career_code = 'UGRD'
+                    break
+                elif plan_row['academic_career_cd'] in {'UCBX', 'GRAD'} and plan_row['current_admit_term'] > career_admit_term:
+                    career_code = plan_row['academic_career_cd']
+                    career_admit_term = plan_row['current_admit_term']
+
+            feed = {
+                'identifiers': [
+                    {
+                        'id': sid,
+                        'type': 'student-id',
+                    },
+                ],
+            }
 
-                self._merge_profile(feed, feed_components.get('profile'))
-                self._merge_holds(feed, feed_components.get('holds'))
-                self._merge_profile_terms(feed, feed_components.get('profile_terms'), career_code)
-                self._merge_plans(feed, plans, career_code)
-                self._merge_degrees(feed, feed_components.get('degrees'))
+            self._merge_profile(feed, feed_components.get('profile'))
+            self._merge_holds(feed, feed_components.get('holds'))
+            self._merge_profile_terms(feed, feed_components.get('profile_terms'), career_code)
+            self._merge_plans(feed, plans, career_code)
+            self._merge_degrees(feed, feed_components.get('degrees'))
 
-                write_to_tsv_file(target_file, [sid, json.dumps(feed)])
+            write_to_tsv_file(target_file, [sid, json.dumps(feed)])
 
-            if index is None:
-                app_arg.logger.warn(f'{current_thread().name} wrote no profile feeds, returning empty tempfile')
-            else:
-                app_arg.logger.debug(f'{current_thread().name} wrote {index + 1} profile feeds, returning TSV tempfile')
-            return target_file
+        if index is None:
+            app.logger.warn(f'{_worker_name()} wrote no profile feeds, returning empty TSV file')
+        else:
+            app.logger.debug(f'{_worker_name()} wrote {index + 1} profile feeds, returning TSV file')
 
     def _merge_profile(self, feed, profile_rows):
         if not profile_rows or not len(profile_rows):
@@ -605,23 +603,20 @@ class RegistrationsFeedBuilder(ConcurrentFeedBuilder):
         finally:
             stream.close()
 
-    def build_target_feeds(self, app_arg, source_file):
-        with app_arg.app_context():
-            app_arg.logger.debug(f'{current_thread().name} will process registration feeds chunk')
-            target_file = TemporaryFile()
-            index = None
+    def build_target_feeds(self, source_file, target_file):
+        app.logger.debug(f'{_worker_name()} will process registration feeds chunk')
+        index = None
 
-            for sid, rows, index in self.get_pickled_feeds(source_file):
-                last_registration = self._find_last_registration(rows)
-                if last_registration:
-                    feed = self._generate_feed(last_registration)
-                    write_to_tsv_file(target_file, [sid, json.dumps(feed)])
+        for sid, rows, index in self.get_pickled_feeds(source_file):
+            last_registration = self._find_last_registration(rows)
+            if last_registration:
+                feed = self._generate_feed(last_registration)
+                write_to_tsv_file(target_file, [sid, json.dumps(feed)])
 
-            if index is None:
-                app_arg.logger.warn(f'{current_thread().name} wrote no registration feeds, returning empty tempfile')
-            else:
-                app_arg.logger.debug(f'{current_thread().name} wrote {index + 1} registration feeds, returning TSV tempfile')
-            return target_file
+        if index is None:
+            app.logger.warn(f'{_worker_name()} wrote no registration feeds, returning empty TSV file')
+        else:
+            app.logger.debug(f'{_worker_name()} wrote {index + 1} registration feeds, returning TSV file')
 
     def _generate_feed(self, row):
         feed = {
@@ -718,18 +713,39 @@ class RegistrationsFeedBuilder(ConcurrentFeedBuilder):
         return mappings.get(code) or code
 
 
+def _build_target_file(builder, source_path, app_arg=None):
+    target_path = f'{os.path.splitext(source_path)[0]}.tsv'
+    with (app_arg.app_context() if app_arg else nullcontext()):
+        with open(source_path, 'rb') as source_file, open(target_path, 'wb') as target_file:
+            builder.build_target_feeds(source_file, target_file)
+    os.remove(source_path)
+    return target_path
+
+
+def _stream_target_file(target_path, all_feeds):
+    with open(target_path, 'rb') as target_file:
+        shutil.copyfileobj(target_file, all_feeds, TARGET_FILE_READ_SIZE)
+    os.remove(target_path)
+
+
+def _worker_name():
+    return f'{current_process().name}/{current_thread().name}'
+
+
 def _str(v):
     return (v is not None) and (float(v) if isinstance(v, Decimal) else str(v))
 
 
-def _upload_file_to_staging(table, _file):
+@contextmanager
+def _stream_to_staging(table):
     tsv_filename = f'staging_{table}.tsv'
     s3_key = f'{get_s3_edl_daily_path()}/{tsv_filename}'
 
-    app.logger.info(f'Will stash {table} feeds in S3: {s3_key}')
-    if not s3.upload_file(_file, s3_key):
-        raise BackgroundJobError('Error on S3 upload: aborting job.')
+    app.logger.info(f'Will stream {table} feeds to S3: {s3_key}')
+    with sharded_staging_upload(s3_key) as upload:
+        yield upload
 
     app.logger.info('Will copy S3 feeds into Redshift...')
-    if not redshift.copy_tsv_from_s3(f"{app.config['REDSHIFT_SCHEMA_EDL']}.{table}", s3_key):
+    table = f"{app.config['REDSHIFT_SCHEMA_EDL']}.{table}"
+    if not redshift.copy_tsv_from_s3(table, upload.manifest_key, manifest=True, gzip=True):
         raise BackgroundJobError('Error on Redshift copy: aborting job.')
@@ -47,11 +47,15 @@ class CreateOUASchema(BackgroundJob):
         keys = s3.get_keys_with_prefix(oua_slate_sftp_path, full_objects=False, bucket=s3_protected_bucket)
 
         if len(keys) > 0:
+            copies = []
             for source_key in keys:
                 if source_key.endswith('.csv'):
                     destination_key = source_key.replace(oua_slate_sftp_path, oua_daily_dest_path)
-                    if not s3.copy(s3_protected_bucket, source_key, s3_protected_bucket, destination_key):
-                        raise BackgroundJobError(f'Copy from SFTP location {source_key} to daily OUA destination {destination_key} failed.')
+                    copies.append((s3_protected_bucket, source_key, s3_protected_bucket, destination_key))
+            report = s3.copy_objects(copies)
+            if report['failed']:
+                (_, source_key, _, destination_key, _) = report['failed'][0]
+                raise BackgroundJobError(f'Copy from SFTP location {source_key} to daily OUA destination {destination_key} failed.')
             external_schema = app.config['REDSHIFT_SCHEMA_OUA']
             redshift.drop_external_schema(external_schema)
             resolved_ddl = resolve_sql_template('create_oua_schema_template.sql')
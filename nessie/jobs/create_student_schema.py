@@ -36,8 +36,9 @@ class CreateStudentSchema(BackgroundJob):
     def run(self):
         app.logger.info('Starting student schema creation job...')
         app.logger.info('Executing SQL...')
+        # Every statement in the template can be repeated harmlessly, so transient failures are retried.
         resolved_ddl = resolve_sql_template('create_student_schema.template.sql')
-        if redshift.execute_ddl_script(resolved_ddl):
+        if redshift.execute_ddl_script(resolved_ddl, retry_safe=True):
             app.logger.info(f"Schema '{app.config['REDSHIFT_SCHEMA_STUDENT']}' found or created.")
         else:
             raise BackgroundJobError('Student schema creation failed.')
@@ -45,7 +46,7 @@ class CreateStudentSchema(BackgroundJob):
             'create_student_schema.template.sql',
             redshift_schema_student=app.config['REDSHIFT_SCHEMA_STUDENT'] + '_staging',
         )
-        if redshift.execute_ddl_script(resolved_ddl_staging):
+        if redshift.execute_ddl_script(resolved_ddl_staging, retry_safe=True):
             app.logger.info(f"Schema '{app.config['REDSHIFT_SCHEMA_STUDENT']}_staging' found or created.")
         else:
             raise BackgroundJobError('Student staging schema creation failed.')
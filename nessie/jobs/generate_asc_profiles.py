@@ -83,7 +83,7 @@ class GenerateAscProfiles(BackgroundJob):
 
         s3_key = f'{get_s3_asc_daily_path()}/athletics_profiles.tsv'
         app.logger.info(f'Will stash {len(profile_rows)} feeds in S3: {s3_key}')
-        if not s3.upload_tsv_rows(profile_rows, s3_key):
+        if not s3.upload_tsv_shards(profile_rows, s3_key, redshift.get_copy_shard_count()):
             raise BackgroundJobError('Error on S3 upload: aborting job.')
 
         app.logger.info('Will copy S3 feeds into Redshift...')
@@ -91,9 +91,11 @@ class GenerateAscProfiles(BackgroundJob):
             """
             TRUNCATE {redshift_schema_asc}.student_profiles;
             COPY {redshift_schema_asc}.student_profiles
-                FROM '{loch_s3_asc_data_path}/athletics_profiles.tsv'
+                FROM '{loch_s3_asc_data_path}/athletics_profiles.tsv.manifest'
                 IAM_ROLE '{redshift_iam_role}'
-                DELIMITER '\\t';
+                DELIMITER '\\t'
+                GZIP
+                MANIFEST;
             """,
         )
         if not redshift.execute(query):
@@ -125,9 +127,10 @@ class GenerateAscProfiles(BackgroundJob):
             if not transaction.execute(f'TRUNCATE {rds_schema}.students'):
                 return False
             columns = ['sid', 'active', 'intensive', 'status_asc', 'group_code', 'group_name', 'team_code', 'team_name']
-            result = transaction.insert_bulk(
-                f'INSERT INTO {rds_schema}.students ({", ".join(columns)}) VALUES %s',
-                [tuple([r[c] for c in columns]) for r in asc_rows],
+            result = transaction.copy_rows(
+                f'{rds_schema}.students',
+                columns,
+                (tuple([r[c] for c in columns]) for r in asc_rows),
             )
             if not result:
                 return False
@@ -23,7 +23,7 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
-from itertools import groupby
+from functools import partial
 import tempfile
 
 from flask import current_app as app
@@ -32,6 +32,7 @@ from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
 from nessie.lib import queries
 from nessie.lib.analytics import generate_analytics_feeds_for_course
 from nessie.lib.berkeley import reverse_term_ids
+from nessie.lib.streams import open_streams, SortedGroups
 from nessie.lib.util import hashed_datestamp, resolve_sql_template
 from nessie.models.student_schema_manager import refresh_from_staging, truncate_staging_table, write_file_to_staging
 
@@ -69,49 +70,28 @@ class GenerateBoacAnalytics(BackgroundJob):
 
     def generate_analytics_feeds(self, term_id):
         with tempfile.TemporaryFile() as output_file:
-            try:
-                canvas_sites_stream = queries.stream_canvas_sites(term_id)
-                canvas_enrollments_stream = queries.stream_canvas_enrollments(term_id)
-                assignment_submissions_stream = queries.stream_canvas_assignment_submissions(term_id)
-
-                enrollments_by_course_id = groupby(canvas_enrollments_stream, lambda r: r['canvas_course_id'])
-                submissions_by_course_id = groupby(assignment_submissions_stream, lambda r: r['canvas_course_id'])
-                enr_tracker = {'course_id': 0, 'stream': []}
-                sub_tracker = {'course_id': 0, 'stream': []}
+            with open_streams(
+                canvas_sites=partial(queries.stream_canvas_sites, term_id),
+                enrollments=partial(queries.stream_canvas_enrollment_frames, term_id),
+                submissions=partial(queries.stream_canvas_assignment_submissions, term_id),
+            ) as streams:
+                enrollments_by_course_id = SortedGroups(streams['enrollments'])
+                submissions_by_course_id = SortedGroups(streams['submissions'], key=lambda r: r['canvas_course_id'])
 
                 membership_count = 0
 
-                for canvas_site_row in canvas_sites_stream:
+                for canvas_site_row in streams['canvas_sites']:
                     course_site_id = canvas_site_row['canvas_course_id']
                     app.logger.info(f'Generating analytics: course site {course_site_id}')
 
-                    while enr_tracker['course_id'] < course_site_id:
-                        enr_tracker['course_id'], enr_tracker['stream'] = next(enrollments_by_course_id, (course_site_id, []))
-                    if enr_tracker['course_id'] == course_site_id:
-                        site_enrollments_stream = enr_tracker['stream']
-                    else:
-                        site_enrollments_stream = []
-
-                    while sub_tracker['course_id'] < course_site_id:
-                        sub_tracker['course_id'], sub_tracker['stream'] = next(submissions_by_course_id, (course_site_id, []))
-                    if sub_tracker['course_id'] == course_site_id:
-                        site_submissions_stream = sub_tracker['stream']
-                    else:
-                        site_submissions_stream = []
-
                     membership_count += generate_analytics_feeds_for_course(
                         output_file,
                         term_id,
                         canvas_site_row,
-                        site_enrollments_stream,
-                        site_submissions_stream,
+                        enrollments_by_course_id.get(course_site_id),
+                        submissions_by_course_id.get(course_site_id, []),
                     )
 
-            finally:
-                canvas_sites_stream.close()
-                canvas_enrollments_stream.close()
-                assignment_submissions_stream.close()
-
             table_name = 'student_canvas_site_memberships'
 
             with redshift.transaction() as transaction:
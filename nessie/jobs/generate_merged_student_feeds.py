@@ -23,24 +23,43 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
-from contextlib import ExitStack
-from itertools import groupby
+from collections import deque
+from contextlib import contextmanager, ExitStack
+from functools import partial
+import hashlib
+from itertools import groupby, islice
 import json
 import operator
+import os
 import tempfile
 
 from flask import current_app as app
 from nessie.externals import rds, redshift
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
-from nessie.lib import berkeley, queries
-from nessie.lib.util import encoded_tsv_row, resolve_sql_template, write_to_tsv_file
+from nessie.lib import berkeley, metadata, queries
+from nessie.lib.streams import Descending, merge_join, open_streams, SortedGroups
+from nessie.lib.util import encoded_tsv_row, forked_process_pool, resolve_sql_template, write_to_tsv_file
 from nessie.merged.sis_profile import parse_merged_sis_profile
 from nessie.merged.student_demographics import add_demographics_rows
 from nessie.merged.student_terms import append_drops, append_term_gpa, empty_term_feed, merge_canvas_site_memberships, merge_enrollment
-from nessie.models.student_schema_manager import refresh_all_from_staging, refresh_from_staging, truncate_staging_table, write_file_to_staging
+from nessie.models.student_schema_manager import refresh_all_from_staging, refresh_from_staging, stream_to_staging, truncate_staging_table, \
+    write_shards_to_staging
 
 """Logic for merged student profile and term generation."""
 
+PROFILE_TABLES = [
+    'student_profiles', 'student_profile_index', 'student_majors', 'student_holds',
+    'demographics', 'ethnicities', 'intended_majors', 'minors', 'visas',
+]
+
+# Part of every fingerprint of source rows. Bump to regenerate all feeds on the next incremental run, as when the logic
+# merging source rows into feeds changes.
+FINGERPRINT_VERSION = 1
+FINGERPRINT_MODULUS = 2 ** 128
+
+# Set in each worker process before it generates batches of student profiles.
+_profile_batch_job = None
+
 
 class GenerateMergedStudentFeeds(BackgroundJob):
 
@@ -48,8 +67,10 @@ class GenerateMergedStudentFeeds(BackgroundJob):
     rds_dblink_to_redshift = app.config['REDSHIFT_DATABASE'] + '_redshift'
     student_schema = queries.student_schema()
 
-    def run(self):
+    def run(self, incremental=None):
         app.logger.info('Starting merged profile generation job.')
+        # Incremental runs regenerate feeds only for students whose source rows have changed since their last generation.
+        self.incremental = app.config['MERGED_FEEDS_INCREMENTAL'] if incremental is None else incremental
 
         app.logger.info('Cleaning up old data...')
         redshift.execute('VACUUM; ANALYZE;')
@@ -66,11 +87,11 @@ class GenerateMergedStudentFeeds(BackgroundJob):
         self.successes = []
         self.failures = []
 
-        all_student_profile_elements = queries.get_all_student_profile_elements()
-        profile_tables = self.generate_student_profile_tables(all_student_profile_elements)
+        profile_tables = self.generate_student_profile_tables()
         if not profile_tables:
             raise BackgroundJobError('Failed to generate student profile tables.')
         refresh_all_from_staging(profile_tables)
+        metadata.update_merged_feed_fingerprints('profile', self.profile_fingerprints, replace_all=not self.incremental)
 
         self.update_redshift_academic_standing()
         self.update_rds_profile_indexes()
@@ -81,46 +102,110 @@ class GenerateMergedStudentFeeds(BackgroundJob):
         row_count = self.generate_student_enrollments_table()
         if row_count:
             result += f' Generated merged enrollment terms ({row_count} feeds.)'
-        else:
+        elif not self.incremental:
             raise BackgroundJobError('Failed to generate student enrollment tables.')
 
-        self.refresh_rds_enrollment_terms()
+        if row_count:
+            self.refresh_rds_enrollment_terms()
         truncate_staging_table('student_enrollment_terms')
+        metadata.update_merged_feed_fingerprints('enrollment_terms', self.enrollment_fingerprints, replace_all=not self.incremental)
 
         return result
 
-    def generate_student_profile_tables(self, all_student_feed_elements):
-        tables = [
-            'student_profiles', 'student_profile_index', 'student_majors', 'student_holds',
-            'demographics', 'ethnicities', 'intended_majors', 'minors', 'visas',
-        ]
-        for table in tables:
+    def generate_student_profile_tables(self):
+        for table in PROFILE_TABLES:
             truncate_staging_table(table)
 
-        all_student_advisor_mappings = self.map_advisors_to_students()
-        if not all_student_feed_elements:
-            app.logger.error('No profile feeds returned, aborting job.')
-            return False
-        count = len(all_student_feed_elements)
-        app.logger.info(f'Will generate feeds for {count} students.')
+        # Batches of consecutive students are generated in worker processes as soon as they are read from the stream,
+        # each batch writing its own file for every table. The staging upload then reads each table's batch files in turn.
+        worker_count = app.config['STUDENT_PROFILE_MAX_PROCESSES'] or os.cpu_count()
+        batch_size = app.config['STUDENT_PROFILE_BATCH_SIZE']
+        feed_counts = {table: 0 for table in PROFILE_TABLES}
+        batch_count = 0
+        previous_fingerprints = metadata.get_merged_feed_fingerprints('profile') if self.incremental else {}
+        self.profile_fingerprints = {}
+        self.student_count = 0
+        with tempfile.TemporaryDirectory() as work_dir:
+            with ExitStack() as stack:
+                # Workers are forked before the source streams start their prefetch threads.
+                executor = None
+                if worker_count > 1:
+                    app.logger.info(f'Will generate feeds in {worker_count} worker processes.')
+                    executor = stack.enter_context(forked_process_pool(worker_count, initializer=_set_profile_batch_job, initargs=(self,)))
+                pending = deque()
+                profile_elements = self._changed_profile_elements(
+                    stack.enter_context(self.fetch_student_profile_elements()),
+                    previous_fingerprints,
+                )
+                for batch in iter(lambda: list(islice(profile_elements, batch_size)), []):
+                    if not executor:
+                        self._merge_batch_result(self.generate_student_profile_batch(batch, work_dir, batch_count), feed_counts)
+                    else:
+                        if len(pending) >= 2 * worker_count:
+                            self._merge_batch_result(pending.popleft().result(), feed_counts)
+                        pending.append(executor.submit(_generate_student_profile_batch, batch, work_dir, batch_count))
+                    batch_count += 1
+                while pending:
+                    self._merge_batch_result(pending.popleft().result(), feed_counts)
+
+            if not self.student_count:
+                app.logger.error('No profile feeds returned, aborting job.')
+                return False
+            app.logger.info(f'Generated feeds for {len(self.profile_fingerprints)} of {self.student_count} students in {batch_count} batches.')
+            for table in PROFILE_TABLES:
+                # Incremental runs may generate no rows at all for some tables, which then have nothing to refresh.
+                if feed_counts[table] or not self.incremental:
+                    batch_paths = [_profile_batch_path(work_dir, table, batch_index) for batch_index in range(batch_count)]
+                    write_shards_to_staging(table, batch_paths, feed_counts[table])
+        return PROFILE_TABLES
+
+    def _changed_profile_elements(self, profile_elements, previous_fingerprints):
+        # Merged profiles also depend on the current term.
+        current_term_id = berkeley.current_term_id()
+        for feed_elements, advisors in profile_elements:
+            self.student_count += 1
+            sid = feed_elements['sid']
+            fingerprint = _fingerprint(current_term_id, feed_elements, advisors)
+            if previous_fingerprints.get(sid) != fingerprint:
+                self.profile_fingerprints[sid] = fingerprint
+                yield feed_elements, advisors
+
+    @contextmanager
+    def fetch_student_profile_elements(self):
+        # Profile elements and advisor mappings are both streamed in SID order, and merged as they arrive.
+        with open_streams(
+            profiles=queries.stream_all_student_profile_elements,
+            advisors=queries.stream_advisee_advisor_mappings,
+        ) as streams:
+            advisors = SortedGroups(streams['advisors'], operator.itemgetter('student_sid'))
+
+            def _fetch_student_profile_elements():
+                for sid, profile_rows, matches in merge_join(streams['profiles'], operator.itemgetter('sid'), {'advisors': advisors}):
+                    advisor_rows = [dict(row) for row in matches.get('advisors', [])]
+                    for feed_elements in profile_rows:
+                        yield dict(feed_elements), advisor_rows
+
+            yield _fetch_student_profile_elements()
+
+    def generate_student_profile_batch(self, batch, work_dir, batch_index):
+        successes = []
+        failures = []
         with ExitStack() as stack:
-            feed_files = {table: stack.enter_context(tempfile.TemporaryFile()) for table in tables}
-            feed_counts = {table: 0 for table in tables}
-            for index, feed_elements in enumerate(all_student_feed_elements):
-                sid = feed_elements['sid']
-                if self.generate_student_profile_feed(
-                    feed_elements,
-                    all_student_advisor_mappings.get(sid, []),
-                    feed_files,
-                    feed_counts,
-                ):
-                    self.successes.append(sid)
+            feed_files = {table: stack.enter_context(open(_profile_batch_path(work_dir, table, batch_index), 'wb')) for table in PROFILE_TABLES}
+            feed_counts = {table: 0 for table in PROFILE_TABLES}
+            for feed_elements, advisors in batch:
+                if self.generate_student_profile_feed(feed_elements, advisors, feed_files, feed_counts):
+                    successes.append(feed_elements['sid'])
                 else:
-                    self.failures.append(sid)
-            for table in tables:
-                if feed_files[table]:
-                    write_file_to_staging(table, feed_files[table], feed_counts[table])
-        return tables
+                    failures.append(feed_elements['sid'])
+        return feed_counts, successes, failures
+
+    def _merge_batch_result(self, batch_result, feed_counts):
+        batch_counts, batch_successes, batch_failures = batch_result
+        for table in PROFILE_TABLES:
+            feed_counts[table] += batch_counts[table]
+        self.successes.extend(batch_successes)
+        self.failures.extend(batch_failures)
 
     def generate_student_profile_feed(self, feed_elements, advisors, feed_files, feed_counts):
         sid = feed_elements['sid']
@@ -255,12 +340,6 @@ class GenerateMergedStudentFeeds(BackgroundJob):
         else:
             return level
 
-    def map_advisors_to_students(self):
-        advisors_by_student_id = {}
-        for sid, rows in groupby(queries.get_advisee_advisor_mappings(), operator.itemgetter('student_sid')):
-            advisors_by_student_id[sid] = list(rows)
-        return advisors_by_student_id
-
     def update_redshift_academic_standing(self):
         redshift.execute(
             f"""TRUNCATE {self.student_schema}.academic_standing;
@@ -279,7 +358,25 @@ class GenerateMergedStudentFeeds(BackgroundJob):
     def generate_student_enrollments_table(self):
         table_name = 'student_enrollment_terms'
         truncate_staging_table(table_name)
-        row_count = self.generate_term_feeds(table_name)
+        sids = None
+        self.enrollment_fingerprints = self.fingerprint_enrollment_sources()
+        if not self.enrollment_fingerprints:
+            raise BackgroundJobError('Failed to generate student enrollment tables: no enrollment source rows found.')
+        if self.incremental:
+            previous_fingerprints = metadata.get_merged_feed_fingerprints('enrollment_terms')
+            self.enrollment_fingerprints = {
+                sid: fingerprint for sid, fingerprint in self.enrollment_fingerprints.items() if previous_fingerprints.get(sid) != fingerprint
+            }
+            sids = list(self.enrollment_fingerprints.keys())
+            app.logger.info(f'{len(sids)} students have changed enrollment term sources.')
+            if not sids:
+                return 0
+            # Past a point, as on a first run or after a term rollover, filtering source queries by SID costs more than
+            # regenerating every feed.
+            if not previous_fingerprints or len(sids) > app.config['MERGED_FEEDS_INCREMENTAL_MAX_STUDENTS']:
+                app.logger.info('Will regenerate enrollment term feeds for all students.')
+                sids = None
+        row_count = self.generate_term_feeds(table_name, sids=sids)
         if row_count:
             with redshift.transaction() as transaction:
                 refresh_from_staging(
@@ -290,27 +387,41 @@ class GenerateMergedStudentFeeds(BackgroundJob):
         app.logger.info(f'Enrollment term feed generation complete ({row_count} feeds).')
         return row_count
 
-    def generate_term_feeds(self, table_name):
-        enrollment_stream = queries.stream_sis_enrollments()
-        term_gpa_stream = queries.stream_term_gpas()
-        canvas_site_stream = queries.stream_canvas_memberships()
-
-        term_gpa_tracker = {'term_id': '9999', 'sid': '', 'term_gpas': []}
-        canvas_site_tracker = {'term_id': '9999', 'sid': '', 'sites': []}
-
+    def fingerprint_enrollment_sources(self):
+        # A full pass over the source rows is much cheaper than generating, uploading and copying every feed. Source rows
+        # are not fully ordered within a student, so per-row digests are summed rather than hashed in stream order.
+        digests = {}
+        with open_streams(
+            enrollments=queries.stream_sis_enrollments,
+            term_gpas=queries.stream_term_gpas,
+            canvas_sites=queries.stream_canvas_memberships,
+        ) as streams:
+            for name in ['enrollments', 'term_gpas', 'canvas_sites']:
+                for row in streams[name]:
+                    row_digest = int(_fingerprint(name, list(row.values())), 16)
+                    digests[row['sid']] = (digests.get(row['sid'], 0) + row_digest) % FINGERPRINT_MODULUS
+        return {sid: f'{digest:032x}' for sid, digest in digests.items()}
+
+    def generate_term_feeds(self, table_name, sids=None):
         row_count = 0
 
-        try:
-            term_gpa_results = groupby(term_gpa_stream, lambda r: (str(r['term_id']), r['sid']))
-            canvas_site_results = groupby(canvas_site_stream, lambda r: (str(r['term_id']), r['sid']))
+        with open_streams(
+            enrollments=partial(queries.stream_sis_enrollments, sids=sids),
+            term_gpas=partial(queries.stream_term_gpas, sids=sids),
+            canvas_sites=queries.stream_canvas_memberships,
+        ) as streams:
+            # All three streams are ordered by term_id descending, then by SID.
+            term_gpa_results = SortedGroups(streams['term_gpas'], key=_term_sid_key)
+            canvas_site_results = SortedGroups(streams['canvas_sites'], key=_term_sid_key)
 
-            for term_id, term_enrollments_grp in groupby(enrollment_stream, operator.itemgetter('sis_term_id')):
+            for term_id, term_enrollments_grp in groupby(streams['enrollments'], operator.itemgetter('sis_term_id')):
                 term_id = str(term_id)
                 term_name = berkeley.term_name_for_sis_id(term_id)
                 app.logger.info(f'Generating enrollment feeds for term {term_id}...')
                 term_row_count = 0
 
-                with tempfile.TemporaryFile() as feed_file:
+                # Feeds are uploaded while they are generated, and copied into the staging table once complete.
+                with stream_to_staging(table_name, term_id=term_id) as feed_file:
                     for sid, enrollments_grp in groupby(term_enrollments_grp, operator.itemgetter('sid')):
                         term_feed = None
                         for is_dropped, enrollments_subgroup in groupby(enrollments_grp, operator.itemgetter('dropped')):
@@ -321,29 +432,17 @@ class GenerateMergedStudentFeeds(BackgroundJob):
                                     term_feed = empty_term_feed(term_id, term_name)
                                 append_drops(term_feed, enrollments_subgroup)
 
-                        while term_gpa_tracker['term_id'] > term_id or (term_gpa_tracker['term_id'] == term_id and term_gpa_tracker['sid'] < sid):
-                            (term_gpa_tracker['term_id'], term_gpa_tracker['sid']), term_gpa_tracker['term_gpas'] =\
-                                next(term_gpa_results, ((term_id, sid), []))
-                        if term_gpa_tracker['term_id'] == term_id and term_gpa_tracker['sid'] == sid:
-                            append_term_gpa(term_feed, term_gpa_tracker['term_gpas'])
+                        term_gpas = term_gpa_results.get((Descending(term_id), sid))
+                        if term_gpas is not None:
+                            append_term_gpa(term_feed, term_gpas)
 
-                        while canvas_site_tracker['term_id'] > term_id or\
-                                (canvas_site_tracker['term_id'] == term_id and canvas_site_tracker['sid'] < sid):
-                            (canvas_site_tracker['term_id'], canvas_site_tracker['sid']), canvas_site_tracker['sites'] =\
-                                next(canvas_site_results, ((term_id, sid), []))
-                        if canvas_site_tracker['term_id'] == term_id and canvas_site_tracker['sid'] == sid:
-                            merge_canvas_site_memberships(term_feed, canvas_site_tracker['sites'])
+                        canvas_sites = canvas_site_results.get((Descending(term_id), sid))
+                        if canvas_sites is not None:
+                            merge_canvas_site_memberships(term_feed, canvas_sites)
 
                         feed_file.write(encoded_tsv_row([sid, term_id, json.dumps(term_feed)]) + b'\n')
                         term_row_count += 1
-
-                    if term_row_count:
-                        write_file_to_staging(table_name, feed_file, term_row_count, term_id=term_id)
-                        row_count += term_row_count
-
-        finally:
-            enrollment_stream.close()
-            term_gpa_stream.close()
+                row_count += term_row_count
 
         return row_count
 
@@ -425,3 +524,24 @@ class GenerateMergedStudentFeeds(BackgroundJob):
             AND t1.term_id = t2.term_id
             AND enr->>'gradingBasis' = 'EPN';""",
         )
+
+
+def _term_sid_key(row):
+    return Descending(str(row['term_id'])), row['sid']
+
+
+def _fingerprint(*elements):
+    return hashlib.md5(json.dumps([FINGERPRINT_VERSION, *elements], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _generate_student_profile_batch(batch, work_dir, batch_index):
+    return _profile_batch_job.generate_student_profile_batch(batch, work_dir, batch_index)
+
+
+def _profile_batch_path(work_dir, table, batch_index):
+    return os.path.join(work_dir, f'{table}.{batch_index}.tsv')
+
+
+def _set_profile_batch_job(job):
+    global _profile_batch_job
+    _profile_batch_job = job
@@ -107,7 +107,8 @@ class ImportAscAthletes(BackgroundJob):
                     app.logger.error(f'ASC import: Unmapped asc_code {asc_code} has ActiveYN for sid={sid}')
 
         s3_key = f'{get_s3_asc_daily_path()}/asc_api_raw_response_{sync_date}.tsv'
-        if not s3.upload_tsv_rows(rows, s3_key):
+        manifest_key = s3.upload_tsv_shards(rows, s3_key, redshift.get_copy_shard_count())
+        if not manifest_key:
             raise BackgroundJobError('Error on S3 upload: aborting job.')
 
         app.logger.info('Copy data in S3 file to Redshift...')
@@ -117,10 +118,12 @@ class ImportAscAthletes(BackgroundJob):
             COPY {redshift_schema_asc}.students
                 FROM 's3://{s3_bucket}/{s3_key}'
                 IAM_ROLE '{redshift_iam_role}'
-                DELIMITER '\\t';
+                DELIMITER '\\t'
+                GZIP
+                MANIFEST;
             """,
             s3_bucket=app.config['LOCH_S3_BUCKET'],
-            s3_key=s3_key,
+            s3_key=manifest_key,
         )
         if not redshift.execute(query):
             raise BackgroundJobError('Error on Redshift copy: aborting job.')
@@ -59,13 +59,18 @@ class MigrateSisAdvisingNoteAttachments(BackgroundJob):
     def copy_to_destination(self, source_prefix, dest_prefix):
         bucket = app.config['LOCH_S3_PROTECTED_BUCKET']
         objects = s3.get_keys_with_prefix(source_prefix, bucket=app.config['LOCH_S3_PROTECTED_BUCKET'])
-        for o in objects:
+        copies = []
+        for o in objects or []:
             file_name = normalize_sis_note_attachment_file_name(o)
             sid = file_name.split('_')[0]
 
             dest_key = f'{dest_prefix}/{sid}/{file_name}'
             app.logger.info(dest_key)
-            if not s3.copy(bucket, o, bucket, dest_key):
-                raise BackgroundJobError(f'Copy from source to destination {dest_key} failed.')
+            copies.append((bucket, o, bucket, dest_key))
 
-        app.logger.info(f'Copied {len(objects) if objects else 0} attachments to the destination folder.')
+        report = s3.copy_objects(copies)
+        if report['failed']:
+            failed_keys = ', '.join(dest_key for (_, _, _, dest_key, _) in report['failed'])
+            raise BackgroundJobError(f'Copy from source to destination {failed_keys} failed.')
+
+        app.logger.info(f"Copied {len(report['copied'])} attachments to the destination folder.")
@@ -26,10 +26,11 @@ ENHANCEMENTS, OR MODIFICATIONS.
 
 from datetime import datetime, timedelta
 
+from botocore.exceptions import BotoCoreError, ClientError
 from flask import current_app as app
-from nessie.externals import canvas_data, redshift, s3
+from nessie.externals import canvas_data, redshift
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
-from nessie.lib import berkeley
+from nessie.lib import berkeley, s3_index
 from nessie.lib.util import get_s3_canvas_daily_path
 import pandas as pd
 
@@ -146,16 +147,18 @@ class RefreshCanvasDataCatalog(BackgroundJob):
 
     # Gets an inventory of all the tables by tracking the S3 canvas-data daily location and run count verification to ensure migration was successful
     def verify_external_data_catalog(self):
-        s3_client = s3.get_client()
-        bucket = app.config['LOCH_S3_BUCKET']
         external_schema = app.config['REDSHIFT_SCHEMA_CANVAS']
         prefix = self.generate_canvas_path()
         app.logger.info(f'Daily path = {prefix}')
+        # List the daily path live, since a fresh index could predate today's uploads.
+        try:
+            keys = s3_index.refresh_prefix(prefix)
+        except (BotoCoreError, ClientError, ValueError) as e:
+            raise BackgroundJobError(f'Failed to list S3 keys with prefix {prefix}: {e}. Aborting job.')
         directory_names = []
-        s3_objects = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        for object_summary in s3_objects['Contents']:
+        for key in keys:
             # parse table names from the S3 object URLs
-            directory_names.append(object_summary['Key'].split('/')[3])
+            directory_names.append(key.split('/')[3])
 
         # Get unique table names from S3 object list
         tables = sorted(list(set(directory_names)))
@@ -192,9 +195,9 @@ class RefreshCanvasDataCatalog(BackgroundJob):
 
     def generate_canvas_path(self):
         canvas_path = get_s3_canvas_daily_path()
-        if not s3.get_keys_with_prefix(canvas_path):
+        if not s3_index.get_keys_with_prefix(canvas_path):
             canvas_path = get_s3_canvas_daily_path(datetime.now() - timedelta(days=1))
-            if not s3.get_keys_with_prefix(canvas_path):
+            if not s3_index.get_keys_with_prefix(canvas_path):
                 raise BackgroundJobError('No timely Canvas data found, aborting')
             else:
                 app.logger.info('Falling back to yesterday\'s Canvas data')
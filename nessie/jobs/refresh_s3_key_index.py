@@ -0,0 +1,52 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+
+from flask import current_app as app
+from nessie.externals import s3
+from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
+from nessie.lib import s3_index
+
+"""Logic for loading the S3 key index from the latest S3 Inventory report."""
+
+
+class RefreshS3KeyIndex(BackgroundJob):
+
+    def run(self):
+        inventory_path = app.config['LOCH_S3_INVENTORY_PATH']
+        if not inventory_path:
+            raise BackgroundJobError('No S3 inventory path configured.')
+        app.logger.info(f'Starting S3 key index refresh from inventory reports under {inventory_path}...')
+        manifest_keys = s3.get_keys_with_prefix(inventory_path)
+        if manifest_keys is None:
+            raise BackgroundJobError('Error listing S3 inventory reports.')
+        # Reports are delivered under timestamped paths, e.g. '.../2022-03-01T01-00Z/manifest.json'.
+        manifest_keys = sorted(k for k in manifest_keys if k.endswith('/manifest.json'))
+        if not manifest_keys:
+            raise BackgroundJobError(f'No S3 inventory report found under {inventory_path}.')
+        key_count = s3_index.load_inventory(manifest_keys[-1])
+        if key_count is None:
+            raise BackgroundJobError(f'Failed to load S3 inventory report {manifest_keys[-1]}.')
+        return f'S3 key index refreshed with {key_count} keys from {manifest_keys[-1]}.'
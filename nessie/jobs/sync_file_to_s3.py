@@ -23,11 +23,14 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+import json
+
 from botocore.exceptions import ClientError, ConnectionError
 from flask import current_app as app
 from nessie.externals import s3
 from nessie.jobs.background_job import BackgroundJob
-from nessie.lib.metadata import create_canvas_snapshot, update_canvas_sync_status
+from nessie.lib.metadata import create_canvas_snapshot, get_resumable_canvas_sync, update_canvas_sync_status
+import requests
 
 """Logic for file sync to S3."""
 
@@ -52,13 +55,24 @@ class SyncFileToS3(BackgroundJob):
                 def update_streaming_status(headers):
                     update_canvas_sync_status(canvas_sync_job_id, key, 'streaming', source_size=headers.get('Content-Length'))
 
-                response = s3.upload_from_url(url, key, on_stream_opened=update_streaming_status)
+                def update_uploaded_parts(upload_id, part_numbers):
+                    update_canvas_sync_status(canvas_sync_job_id, key, 'streaming', upload_id=upload_id, uploaded_parts=json.dumps(part_numbers))
+
+                # Pick up any multipart upload left unfinished by an earlier sync of the same file.
+                resume = canvas_sync_job_id and get_resumable_canvas_sync(key)
+                response = s3.upload_from_url(
+                    url,
+                    key,
+                    on_stream_opened=update_streaming_status,
+                    resume=resume or None,
+                    on_parts_uploaded=update_uploaded_parts if canvas_sync_job_id else None,
+                )
                 if response and canvas_sync_job_id:
                     destination_size = response.get('ContentLength')
                     update_canvas_sync_status(canvas_sync_job_id, key, 'complete', destination_size=destination_size)
                     create_canvas_snapshot(key, size=destination_size)
                 return True
-            except (ClientError, ConnectionError, ValueError) as e:
+            except (ClientError, ConnectionError, ValueError, requests.RequestException) as e:
                 if canvas_sync_job_id:
                     update_canvas_sync_status(canvas_sync_job_id, key, 'error', details=str(e))
                 return False
@@ -23,8 +23,6 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
-import tempfile
-
 from flask import current_app as app
 from nessie.externals import s3
 from nessie.jobs.background_job import BackgroundJob
@@ -53,46 +51,54 @@ class TransformPiazzaApiData(BackgroundJob):
             app.logger.info(message)
             return message
         app.logger.info(f'Will transform {len(objects)} objects from {s3_source} and put results to {s3_dest}.')
-        objects_updated = 0
-        new_objects = 0
-        objects_in_error = 0
-        total_objects = 0
+        # New and existing files are told apart by a single listing of the destination, not a request per file.
+        existing_keys = set(s3.iter_keys(s3_dest))
+        counts = {'new': 0, 'updated': 0, 'error': 0, 'total': 0}
+
+        def _on_upload(s3_object, error):
+            if error:
+                counts['error'] += 1
+                return
+            counts['updated' if s3_object in existing_keys else 'new'] += 1
+            existing_keys.add(s3_object)
+            counts['total'] += 1
+            # update job queue every 1000 files...
+            if counts['total'] % 1000 == 0:
+                message = f"{s3_object}, {counts['total']} so far; " \
+                          + f"{counts['new']} new files; " \
+                          + f"{counts['updated']} existing files. {counts['error']} files in error" \
+                          + f'({len(objects)} objects in all)'
+                update_background_job_status(job_id, 'transforming', details=message)
+
         for o in objects:
             file_name = o.split('/')[-1]
             app.logger.debug(f'processing {file_name}')
             # file_name is like 'daily_2020-08-14.zip'
             piazza_zip_file = s3.get_object_compressed_text_reader(o)
-            for subfile in piazza_zip_file.namelist():
-                if '.json' in subfile:
-                    try:
-                        json_file = subfile.split('/')[-1]
-                        course_id = subfile.split('/')[-2]
-                        file_type = json_file.split('_')[0]
-                        record = piazza_zip_file.read(subfile)
-                        with tempfile.TemporaryFile() as result:
-                            s3_object = f'{s3_dest}/{file_type}/{course_id}/{json_file}'
-                            if s3.object_exists(s3_object):
-                                objects_updated += 1
-                            else:
-                                new_objects += 1
-                            result.write(record)
-                            s3.upload_file(result, s3_object)
-                            total_objects += 1
-                        # update job queue every 1000 files...
-                        if total_objects % 1000 == 0:
-                            message = f'{subfile}, {total_objects} so far; ' \
-                                      + f'{new_objects} new files; ' \
-                                      + f'{objects_updated} existing files. {objects_in_error} files in error' \
-                                      + f'({len(objects)} objects in all)'
-                            update_background_job_status(job_id, 'transforming', details=message)
-                    except Exception as e:
-                        app.logger.error(f'could not extract {subfile}')
-                        app.logger.error(e)
-                        objects_in_error += 1
-                else:
-                    # not a json file, so we skip it
-                    continue
-        message = f'Transformed {len(objects)} input files; created {new_objects} new objects; '\
-                  + f'updated {objects_updated} existing objects. {objects_in_error} objects in error'
+            if not piazza_zip_file:
+                counts['error'] += 1
+                continue
+            with piazza_zip_file:
+                s3.upload_objects(self.extract_records(piazza_zip_file, s3_dest, counts), on_upload=_on_upload)
+
+        message = f"Transformed {len(objects)} input files; created {counts['new']} new objects; "\
+                  + f"updated {counts['updated']} existing objects. {counts['error']} objects in error"
         app.logger.info(message)
         return message
+
+    def extract_records(self, piazza_zip_file, s3_dest, counts):
+        # Members are read lazily, as the upload pool makes room for them.
+        for subfile in piazza_zip_file.namelist():
+            if '.json' in subfile:
+                try:
+                    json_file = subfile.split('/')[-1]
+                    course_id = subfile.split('/')[-2]
+                    file_type = json_file.split('_')[0]
+                    yield f'{s3_dest}/{file_type}/{course_id}/{json_file}', piazza_zip_file.read(subfile)
+                except Exception as e:
+                    app.logger.error(f'could not extract {subfile}')
+                    app.logger.error(e)
+                    counts['error'] += 1
+            else:
+                # not a json file, so we skip it
+                continue
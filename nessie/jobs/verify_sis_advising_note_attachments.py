@@ -27,6 +27,8 @@ ENHANCEMENTS, OR MODIFICATIONS.
 from flask import current_app as app
 from nessie.externals import redshift, s3
 from nessie.jobs.background_job import BackgroundJob, BackgroundJobError
+from nessie.lib import s3_index
+from nessie.lib.streams import sorted_difference
 from nessie.lib.util import get_s3_sis_attachment_path, normalize_sis_note_attachment_file_name
 
 
@@ -36,15 +38,11 @@ from nessie.lib.util import get_s3_sis_attachment_path, normalize_sis_note_attac
 class VerifySisAdvisingNoteAttachments(BackgroundJob):
 
     def run(self, datestamp=None):
-        s3_attachment_sync_failures = []
-        missing_s3_attachments = []
         app.logger.info('Starting SIS Advising Note attachments validation job...')
 
         dest_prefix = app.config['LOCH_S3_ADVISING_NOTE_ATTACHMENT_DEST_PATH']
 
-        for source_prefix in self.source_paths(datestamp):
-            app.logger.info(f'Will validate files from {source_prefix}.')
-            s3_attachment_sync_failures.extend(self.verify_attachment_migration(source_prefix, dest_prefix))
+        s3_attachment_sync_failures = self.verify_attachment_migration(self.source_paths(datestamp), dest_prefix)
 
         missing_s3_attachments = self.find_missing_notes_view_attachments(dest_prefix)
 
@@ -64,29 +62,39 @@ class VerifySisAdvisingNoteAttachments(BackgroundJob):
             return get_s3_sis_attachment_path(datestamp)
         return [app.config['LOCH_S3_ADVISING_NOTE_ATTACHMENT_SOURCE_PATH']]
 
-    def verify_attachment_migration(self, source_prefix, dest_prefix):
-        s3_attachment_sync_failures = []
+    def verify_attachment_migration(self, source_prefixes, dest_prefix):
+        # Destination keys expected for each source key, compared in a single sorted merge against a listing of the
+        # destination, which is never held in memory.
         bucket = app.config['LOCH_S3_PROTECTED_BUCKET']
+        source_keys_by_dest_key = {}
+        for source_prefix in source_prefixes:
+            app.logger.info(f'Will validate files from {source_prefix}.')
+            for source_key in s3.iter_keys(source_prefix, bucket=bucket):
+                file_name = normalize_sis_note_attachment_file_name(source_key)
+                sid = file_name.split('_')[0]
+                source_keys_by_dest_key.setdefault(f'{dest_prefix}/{sid}/{file_name}', []).append(source_key)
 
-        source_attachments = sorted(s3.get_keys_with_prefix(source_prefix, False, bucket))
-        dest_attachments = sorted(s3.get_keys_with_prefix(dest_prefix, False, bucket))
-
-        for source_key in source_attachments:
-            file_name = normalize_sis_note_attachment_file_name(source_key)
-            sid = file_name.split('_')[0]
-            dest_key = f'{dest_prefix}/{sid}/{file_name}'
-
-            if dest_key not in dest_attachments:
-                s3_attachment_sync_failures.append(source_key)
+        dest_keys = self.iter_dest_keys(dest_prefix)
+        missing_dest_keys = sorted_difference(sorted(source_keys_by_dest_key), dest_keys)
+        failed_source_keys = {k for dest_key in missing_dest_keys for k in source_keys_by_dest_key[dest_key]}
 
-        if s3_attachment_sync_failures:
-            app.logger.error(f'Total number of failed attachment syncs from {source_prefix} is {len(s3_attachment_sync_failures)} \
-              \n {s3_attachment_sync_failures}.')
-        else:
-            app.logger.info(f'No attachment sync failures found from {source_prefix}.')
+        s3_attachment_sync_failures = []
+        for source_prefix in source_prefixes:
+            failures = sorted(k for k in failed_source_keys if k.startswith(source_prefix))
+            if failures:
+                app.logger.error(f'Total number of failed attachment syncs from {source_prefix} is {len(failures)} \
+              \n {failures}.')
+            else:
+                app.logger.info(f'No attachment sync failures found from {source_prefix}.')
+            s3_attachment_sync_failures.extend(failures)
 
         return s3_attachment_sync_failures
 
+    def iter_dest_keys(self, dest_prefix):
+        # Destination keys are grouped by SID, so the listing can be split by leading digit and run in parallel.
+        split_after = [f'{dest_prefix}/{digit}' for digit in '123456789']
+        return s3.iter_keys(dest_prefix, bucket=app.config['LOCH_S3_PROTECTED_BUCKET'], split_after=split_after)
+
     def get_all_notes_attachments(self):
         results = redshift.fetch(f"""
             SELECT DISTINCT sis_file_name FROM {app.config['REDSHIFT_SCHEMA_EDL']}.advising_note_attachments""")
@@ -95,19 +103,9 @@ class VerifySisAdvisingNoteAttachments(BackgroundJob):
 
     def find_missing_notes_view_attachments(self, dest_prefix):
         # Checks for attachments in SIS view that are not on S3.
-        missing_s3_attachments = []
-        sis_attachments_files_names = []
-        bucket = app.config['LOCH_S3_PROTECTED_BUCKET']
-        sis_notes_view_attachments = sorted(self.get_all_notes_attachments())
-        sis_s3_attachments = sorted(s3.get_keys_with_prefix(dest_prefix, False, bucket))
-
-        for dest_key in sis_s3_attachments:
-            file_name = dest_key.split('/')[-1]
-            sis_attachments_files_names.append(file_name)
-
-        for file_name in sis_notes_view_attachments:
-            if file_name not in sis_attachments_files_names:
-                missing_s3_attachments.append(file_name)
+        expected_keys = [f"{dest_prefix}/{name.split('_')[0]}/{name}" for name in self.get_all_notes_attachments()]
+        missing_keys = s3_index.find_missing_keys(expected_keys, dest_prefix, bucket=app.config['LOCH_S3_PROTECTED_BUCKET'])
+        missing_s3_attachments = sorted(key.split('/')[-1] for key in missing_keys)
 
         if missing_s3_attachments:
             app.logger.error(f'Attachments missing on S3 when compared against SIS notes views: {len(missing_s3_attachments)} \
@@ -36,7 +36,8 @@ import pandas
 from scipy.stats import percentileofscore
 
 
-def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, site_enrollments_stream, site_submissions_stream):
+def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, site_enrollments, site_submissions_stream):
+    """Write analytics feeds for one course site, given a DataFrame of its enrollments and a stream of its submission rows."""
     count = 0
 
     course_id = canvas_site_row.get('canvas_course_id')
@@ -46,11 +47,10 @@ def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, s
     else:
         sis_sections = set()
 
-    enrollments = copy_for_pandas(site_enrollments_stream)
-    if not enrollments:
+    if site_enrollments is None or site_enrollments.empty:
         return 0
 
-    df = pandas.DataFrame(enrollments, columns=['canvas_user_id', 'current_score', 'last_activity_at'])
+    df = site_enrollments[['canvas_user_id', 'current_score', 'last_activity_at']].copy()
     metrics = ['current_score', 'last_activity_at']
     course_distributions = get_distributions_for_metric(df, metrics)
     course_analytics = {metric: analytics_for_course(course_distributions, metric) for metric in metrics}
@@ -58,11 +58,11 @@ def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, s
     submissions_by_user_id = groupby(site_submissions_stream, operator.itemgetter('reference_user_id'))
     submission_tracker = {'user_id': 0, 'submissions': []}
 
-    for enrollment in enrollments:
-        user_id = enrollment['canvas_user_id']
+    for enrollment in site_enrollments.itertuples(index=False):
+        user_id = enrollment.canvas_user_id
         df_enrollment = df.loc[df['canvas_user_id'].values == user_id]
 
-        analytics_feed = _generate_analytics_feed(df_enrollment, course_analytics, course_distributions, len(enrollments))
+        analytics_feed = _generate_analytics_feed(df_enrollment, course_analytics, course_distributions, len(site_enrollments))
 
         while submission_tracker['user_id'] < user_id:
             submission_tracker['user_id'], submission_tracker['submissions'] = next(submissions_by_user_id, (user_id, []))
@@ -80,14 +80,14 @@ def generate_analytics_feeds_for_course(output_file, term_id, canvas_site_row, s
             'analytics': analytics_feed,
         }
 
-        enrolled_sections = enrollment.get('sis_section_ids')
+        enrolled_sections = enrollment.sis_section_ids
         if enrolled_sections:
             enrolled_sections = ','.join(sorted(sis_sections.intersection([s for s in enrolled_sections.split(',')])))
 
         write_to_tsv_file(
             output_file,
             [
-                enrollment['sid'],
+                enrollment.sid,
                 term_id,
                 enrolled_sections,
                 json.dumps(canvas_site_feed),
@@ -25,44 +25,410 @@ ENHANCEMENTS, OR MODIFICATIONS.
 
 from contextlib import contextmanager
 from datetime import datetime
+import os
+import queue
+import random
+import threading
+import time
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 import psycopg2.sql
 
 
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Idle connections beyond min_size are closed once they have sat unused for idle_timeout seconds. A connection
+    that has been idle for longer than health_check_interval seconds is checked with a trivial query before it is
+    handed out. Each thread is handed back the connection it most recently returned whenever that connection is
+    still idle, so that worker threads in a thread pool tend to keep their own sessions.
+    """
+
+    def __init__(
+        self,
+        name=None,
+        min_size=0,
+        max_size=10,
+        idle_timeout=300,
+        health_check_interval=60,
+        checkout_timeout=60,
+        **connection_args,
+    ):
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.connection_args = connection_args
+        self.stats = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0,
+            'connections_evicted': 0,
+            'failed_health_checks': 0,
+            'waits': 0,
+        }
+        self._condition = threading.Condition()
+        # List of (connection, time returned) tuples, most recently returned last.
+        self._idle = []
+        self._in_use = 0
+        self._local = threading.local()
+
+    def getconn(self):
+        while True:
+            connection, idle_since = self._checkout()
+            if connection is None:
+                return self._connect()
+            if self._is_healthy(connection, idle_since):
+                return connection
+            self._discard(connection, in_use=True)
+
+    def putconn(self, connection, discard=False):
+        if not discard and not connection.closed:
+            status = connection.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Don't hand the next borrower an open or aborted transaction.
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or connection.closed:
+            self._discard(connection, in_use=True)
+            return
+        with self._condition:
+            self._in_use -= 1
+            self._idle.append((connection, time.monotonic()))
+            self._local.connection = connection
+            self._evict_idle()
+            self._condition.notify()
+
+    def closeall(self):
+        with self._condition:
+            for connection, idle_since in self._idle:
+                connection.close()
+            self._idle = []
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'name': self.name,
+                **self.stats,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_size': self.max_size,
+                'min_size': self.min_size,
+            }
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._condition:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    preferred = getattr(self._local, 'connection', None)
+                    index = next((i for i, (c, _) in enumerate(self._idle) if c is preferred), len(self._idle) - 1)
+                    connection, idle_since = self._idle.pop(index)
+                    self._in_use += 1
+                    self.stats['checkouts'] += 1
+                    return connection, idle_since
+                if self._in_use < self.max_size:
+                    # Reserve a slot; the new connection is opened outside the lock.
+                    self._in_use += 1
+                    self.stats['checkouts'] += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(f'No connection available within {self.checkout_timeout} seconds (max_size={self.max_size})')
+                self.stats['waits'] += 1
+                self._condition.wait(remaining)
+
+    def _connect(self):
+        try:
+            connection = _connect(**self.connection_args)
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.stats['connections_created'] += 1
+        return connection
+
+    def _discard(self, connection, in_use=False):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            if in_use:
+                self._in_use -= 1
+            self.stats['connections_discarded'] += 1
+            self._condition.notify()
+
+    def _evict_idle(self):
+        # Caller must hold the lock. The least recently returned connections are at the head of the list.
+        now = time.monotonic()
+        while len(self._idle) > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            connection, idle_since = self._idle.pop(0)
+            connection.close()
+            self.stats['connections_evicted'] += 1
+
+    def _is_healthy(self, connection, idle_since):
+        if connection.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            with self._condition:
+                self.stats['failed_health_checks'] += 1
+            return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(**kwargs):
+    """Return the process-wide pool for a given set of pool options and connection arguments, creating it if needed."""
+    # Connections inherited across a fork share sockets with the parent process and must never be reused.
+    key = (os.getpid(), tuple(sorted(kwargs.items())))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(**kwargs)
+        return _pools[key]
+
+
+def get_pool_stats():
+    """Return usage counters for every connection pool opened by this process."""
+    with _pools_lock:
+        pools = [pool for (pid, options), pool in _pools.items() if pid == os.getpid()]
+    return [pool.get_stats() for pool in pools]
+
+
 @contextmanager
-def get_psycopg_cursor(operation='read', autocommit=True, **kwargs):
+def get_psycopg_cursor(operation='read', autocommit=True, pool=None, cursor_factory=None, **kwargs):
     connection = None
     cursor = None
-    if operation == 'write':
-        cursor_factory = None
-    else:
+    if not cursor_factory and operation != 'write':
         cursor_factory = psycopg2.extras.DictCursor
     try:
-        if kwargs.get('uri'):
-            connection = psycopg2.connect(kwargs['uri'])
+        if pool:
+            connection = pool.getconn()
         else:
-            connection = psycopg2.connect(**kwargs)
-        # Autocommit is required for EXTERNAL TABLE creation and deletion.
-        if autocommit:
-            connection.autocommit = True
+            connection = _connect(**kwargs)
+        # Autocommit is required for EXTERNAL TABLE creation and deletion. Pooled connections may have been
+        # left in either mode by their last borrower.
+        if autocommit or pool:
+            connection.autocommit = autocommit
         cursor_args = {'cursor_factory': cursor_factory}
-        yield connection.cursor(**cursor_args)
+        cursor = connection.cursor(**cursor_args)
+        yield cursor
     finally:
         if cursor is not None:
             cursor.close()
         if connection is not None:
-            connection.close()
+            if pool:
+                pool.putconn(connection)
+            else:
+                connection.close()
 
 
-def get_psycopg_cursor_streaming(**kwargs):
-    if kwargs.get('uri'):
-        connection = psycopg2.connect(kwargs['uri'])
-    else:
-        connection = psycopg2.connect(**kwargs)
+def get_psycopg_cursor_streaming(cursor_factory=psycopg2.extras.DictCursor, **kwargs):
+    connection = _connect(**kwargs)
     # Result streaming requires a server-side cursor with a name.
     return connection.cursor(
-        cursor_factory=psycopg2.extras.DictCursor,
+        cursor_factory=cursor_factory,
         name=f'nessie_cursor_{datetime.now().timestamp()}',
     )
+
+
+class ResultStream:
+    """Iterable over the rows of a server-side cursor, which owns the cursor and its dedicated connection.
+
+    Rows are fetched itersize at a time. If prefetch is greater than zero, a background thread fetches up to that many
+    batches ahead of the consumer, overlapping network round trips with row processing; the bounded queue keeps a slow
+    consumer from buffering the whole result set. Closing the stream, explicitly or on exit from a with block, stops the
+    prefetch thread and closes both cursor and connection.
+    """
+
+    def __init__(self, cursor, itersize=1000, prefetch=0, on_close=None):
+        self.cursor = cursor
+        self.itersize = itersize
+        self.prefetch = prefetch
+        self.on_close = on_close
+        self.closed = False
+        self.stats = {
+            'batches': 0,
+            'rows': 0,
+            'fetch_seconds': 0.0,
+            'wait_seconds': 0.0,
+        }
+        self._batches = None
+        self._queue = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def batches(self):
+        """Yield lists of up to itersize rows until the result set is exhausted."""
+        if self._batches is None:
+            self._batches = self._iter_prefetched() if self.prefetch > 0 else self._iter_direct()
+        return self._batches
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop.set()
+        if self._thread:
+            # Unblock a producer waiting on a full queue before waiting for it to finish its current fetch.
+            _drain(self._queue)
+            self._thread.join()
+        try:
+            self.cursor.close()
+        except psycopg2.Error:
+            pass
+        finally:
+            self.cursor.connection.close()
+        if self.on_close:
+            self.on_close(self)
+
+    def _fetch_batch(self):
+        start = time.monotonic()
+        rows = self.cursor.fetchmany(self.itersize)
+        self.stats['fetch_seconds'] += time.monotonic() - start
+        if rows:
+            self.stats['batches'] += 1
+            self.stats['rows'] += len(rows)
+        return rows
+
+    def _iter_direct(self):
+        while not self.closed:
+            rows = self._fetch_batch()
+            if not rows:
+                return
+            yield rows
+
+    def _iter_prefetched(self):
+        self._queue = queue.Queue(maxsize=self.prefetch)
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+        while not self.closed:
+            start = time.monotonic()
+            rows, error = self._queue.get()
+            self.stats['wait_seconds'] += time.monotonic() - start
+            if error:
+                raise error
+            if not rows:
+                return
+            yield rows
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set():
+                rows = self._fetch_batch()
+                self._put((rows, None))
+                if not rows:
+                    return
+        except Exception as e:
+            self._put((None, e))
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+# Error codes for failures that may not recur if the statement is retried. Redshift reports serializable isolation
+# violations (its error 1023) as serialization failures.
+TRANSIENT_PGCODES = {
+    '40001',  # serialization_failure
+    '40P01',  # deadlock_detected
+    '53300',  # too_many_connections
+    '57P01',  # admin_shutdown
+    '57P02',  # crash_shutdown
+    '57P03',  # cannot_connect_now
+}
+
+
+class TransientQueryError(Exception):
+    """Wraps a psycopg2 error classified as transient, to be retried by call_with_retries."""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+        self.pgcode = error.pgcode
+
+
+def is_transient_error(error):
+    """Classify a psycopg2 error as transient (connection loss, serialization conflict, WLM timeout) or permanent."""
+    message = str(error)
+    if error.pgcode:
+        if error.pgcode in TRANSIENT_PGCODES or error.pgcode.startswith('08'):
+            return True
+        # Queries cancelled by a Redshift WLM queue timeout, as opposed to a statement timeout or an explicit cancel.
+        if error.pgcode == '57014' and 'WLM' in message:
+            return True
+        return 'Serializable isolation violation' in message
+    # Errors raised by libpq itself, such as a dropped connection, carry no error code.
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+def call_with_retries(attempt, max_retries, base_delay, max_delay, on_retry=None):
+    """Call attempt(raise_transient) until it returns, retrying with jittered exponential backoff.
+
+    While retries remain, attempt is called with raise_transient=True and should raise TransientQueryError on transient
+    failures; the final attempt is called with raise_transient=False and should handle all errors itself. Before each
+    retry, on_retry is called with the TransientQueryError, the retry number and the delay in seconds.
+    """
+    for retry in range(1, max_retries + 1):
+        try:
+            return attempt(raise_transient=True)
+        except TransientQueryError as e:
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (retry - 1)))
+            if on_retry:
+                on_retry(e, retry, delay)
+            time.sleep(delay)
+    return attempt(raise_transient=False)
+
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _connect(**kwargs):
+    if kwargs.get('uri'):
+        return psycopg2.connect(kwargs['uri'])
+    else:
+        return psycopg2.connect(**kwargs)
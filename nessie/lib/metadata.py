@@ -24,6 +24,8 @@ ENHANCEMENTS, OR MODIFICATIONS.
 """
 
 from datetime import datetime
+from itertools import chain
+import json
 import os
 
 from flask import current_app as app
@@ -66,7 +68,7 @@ def update_canvas_sync_status(job_id, key, status, **kwargs):
     sql = f"""UPDATE {_rds_schema()}.canvas_sync_job_status
              SET destination_url=%s, status=%s, updated_at=current_timestamp"""
     params = [destination_url, status]
-    for key in ['details', 'source_size', 'destination_size']:
+    for key in ['details', 'source_size', 'destination_size', 'upload_id', 'uploaded_parts']:
         if kwargs.get(key):
             sql += f', {key}=%s'
             params.append(kwargs[key])
@@ -79,6 +81,16 @@ def update_canvas_sync_status(job_id, key, status, **kwargs):
     )
 
 
+def get_resumable_canvas_sync(key):
+    """Return the multipart upload id and uploaded part numbers of the latest unfinished sync of a key, if any."""
+    sql = f"""SELECT upload_id, uploaded_parts FROM {_rds_schema()}.canvas_sync_job_status
+             WHERE destination_url = %s AND upload_id IS NOT NULL AND status NOT IN ('complete', 'duplicate')
+             ORDER BY updated_at DESC LIMIT 1"""
+    result = rds.fetch(sql, params=[s3.build_s3_url(key)])
+    if result:
+        return result[0]['upload_id'], json.loads(result[0]['uploaded_parts'] or '[]')
+
+
 def create_canvas_snapshot(key, size):
     canvas_table, filename = key.split('/')[-2:]
     url = s3.build_s3_url(key)
@@ -143,23 +155,47 @@ def update_background_job_status(job_id, status, details=None):
     )
 
 
+def get_merged_feed_fingerprints(feed_type):
+    sql = f'SELECT sid, fingerprint FROM {_rds_schema()}.merged_feed_fingerprints WHERE feed_type = %s'
+    rows = rds.fetch(sql, params=(feed_type,), log_query=False)
+    return {row['sid']: row['fingerprint'] for row in rows or []}
+
+
+def update_merged_feed_fingerprints(feed_type, fingerprints, replace_all=False):
+    """Store fingerprints by SID for one feed type, replacing those for the same students or, if replace_all, all."""
+    table = f'{_rds_schema()}.merged_feed_fingerprints'
+    now = datetime.utcnow().isoformat()
+    with rds.transaction() as transaction:
+        if replace_all:
+            deleted = transaction.execute(f'DELETE FROM {table} WHERE feed_type = %s', params=(feed_type,))
+        else:
+            deleted = transaction.execute(
+                f'DELETE FROM {table} WHERE feed_type = %s AND sid = ANY(%s)',
+                params=(feed_type, list(fingerprints.keys())),
+                log_query=False,
+            )
+        rows = ((sid, feed_type, fingerprint, now) for sid, fingerprint in fingerprints.items())
+        if deleted and transaction.copy_rows(table, ['sid', 'feed_type', 'fingerprint', 'updated_at'], rows):
+            transaction.commit()
+            return True
+        else:
+            transaction.rollback()
+            app.logger.error(f'Error saving {feed_type} feed fingerprints to RDS.')
+            return False
+
+
 def update_registration_import_status(successes, failures):
     rds.execute(
         f'DELETE FROM {_rds_schema()}.registration_import_status WHERE sid = ANY(%s)',
         params=(successes + failures, ),
     )
     now = datetime.utcnow().isoformat()
-    success_records = [tuple([sid, 'success', now]) for sid in successes]
-    failure_records = [tuple([sid, 'failure', now]) for sid in failures]
-    rows = success_records + failure_records
+    rows = chain(
+        ((sid, 'success', now) for sid in successes),
+        ((sid, 'failure', now) for sid in failures),
+    )
     with rds.transaction() as transaction:
-        result = transaction.insert_bulk(
-            f"""INSERT INTO {_rds_schema()}.registration_import_status
-                (sid, status, updated_at)
-                VALUES %s
-            """,
-            rows,
-        )
+        result = transaction.copy_rows(f'{_rds_schema()}.registration_import_status', ['sid', 'status', 'updated_at'], rows)
         if result:
             transaction.commit()
         else:
@@ -173,18 +209,13 @@ def update_photo_import_status(successes, failures, photo_not_found):
         params=(successes + failures + photo_not_found, ),
     )
     now = datetime.utcnow().isoformat()
-    success_records = [tuple([sid, 'success', now]) for sid in successes]
-    failure_records = [tuple([sid, 'failure', now]) for sid in failures]
-    photo_not_found_records = [tuple([sid, 'photo_not_found', now]) for sid in photo_not_found]
-    rows = success_records + failure_records + photo_not_found_records
+    rows = chain(
+        ((sid, 'success', now) for sid in successes),
+        ((sid, 'failure', now) for sid in failures),
+        ((sid, 'photo_not_found', now) for sid in photo_not_found),
+    )
     with rds.transaction() as transaction:
-        result = transaction.insert_bulk(
-            f"""INSERT INTO {_rds_schema()}.photo_import_status
-                (sid, status, updated_at)
-                VALUES %s
-            """,
-            rows,
-        )
+        result = transaction.copy_rows(f'{_rds_schema()}.photo_import_status', ['sid', 'status', 'updated_at'], rows)
         if result:
             transaction.commit()
         else:
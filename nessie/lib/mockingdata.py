@@ -40,10 +40,15 @@ A test function can temporarily substitute custom mock behavior with the registe
 
 
 class MockRows:
-    """A callable object which uses a CSV file or list of strings to mimic data rows from a non-ORM SQL query."""
+    """A callable object which uses a CSV file or list of strings to mimic data rows from a non-ORM SQL query.
 
-    def __init__(self, csv_in):
+    If group_by is set, rows are instead returned as (key, DataFrame) tuples, one per value of that column in ascending
+    order, as from redshift.fetch_dataframes.
+    """
+
+    def __init__(self, csv_in, group_by=None):
         self.csv_in = csv_in
+        self.group_by = group_by
 
     def __call__(self, *args):
         if self.csv_in is None:
@@ -59,6 +64,9 @@ class MockRows:
         # Be kind, rewind.
         if hasattr(self.csv_in, 'seek'):
             self.csv_in.seek(0)
+        if self.group_by:
+            frame = pandas.DataFrame(result)
+            return [(key, group.reset_index(drop=True)) for key, group in frame.groupby(self.group_by, sort=True)]
         return result
 
 
@@ -112,7 +120,7 @@ def mocking(request_func):
     return register_mock_for_request_func
 
 
-def fixture(pattern):
+def fixture(pattern, group_by=None):
     """Alternative to @mockable, @mocking, and response_from_fixture.
 
     The @fixture decorator with a template pattern can be used as a shorthand. Wrapping a function like so:
@@ -134,7 +142,7 @@ def fixture(pattern):
     def fixture_wrapper(func):
         def register_fixture(*args, **kw):
             evaluated_pattern = fill_pattern_from_args(pattern, func, *args, **kw)
-            return response_from_fixture(evaluated_pattern)
+            return response_from_fixture(evaluated_pattern, group_by)
 
         mockable_wrapper = mockable(func)
         mocking(func)(register_fixture)
@@ -143,7 +151,7 @@ def fixture(pattern):
     return fixture_wrapper
 
 
-def response_from_fixture(pattern):
+def response_from_fixture(pattern, group_by=None):
     """Generate a mock response from a fixture filename.
 
     The CSV-parsed fixture data will replace the original function's response. None will be returned
@@ -157,7 +165,7 @@ def response_from_fixture(pattern):
     """
     fixture_path = f'{_get_fixtures_path()}/{pattern}'
     if os.path.isfile(fixture_path):
-        return MockRows(fixture_path)
+        return MockRows(fixture_path, group_by)
     else:
         return MockRows(None)
 
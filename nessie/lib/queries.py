@@ -92,7 +92,7 @@ def get_active_student_ids():
     return redshift.fetch(sql)
 
 
-def get_advisee_advisor_mappings():
+def stream_advisee_advisor_mappings():
     sql = f"""SELECT DISTINCT
             advs.student_sid AS student_sid,
             advs.advisor_type AS advisor_role,
@@ -110,11 +110,11 @@ def get_advisee_advisor_mappings():
           ON advs.advisor_sid = aa.csid
         ORDER BY advs.student_sid, advs.advisor_type, advs.academic_plan, aa.first_name, aa.last_name
         """
-    return redshift.fetch(sql)
+    return redshift.fetch(sql, stream_results=True)
 
 
 @fixture('query_all_student_profile_feeds.csv')
-def get_all_student_profile_elements():
+def stream_all_student_profile_elements():
     sql = f"""SELECT DISTINCT attrs.sid, attrs.ldap_uid,
             us.canvas_id AS canvas_user_id, us.name AS canvas_user_name,
             sis.feed AS sis_profile_feed,
@@ -159,7 +159,7 @@ def get_all_student_profile_elements():
             ON reg.sid = attrs.sid
         ORDER BY attrs.sid
         """
-    return redshift.fetch(sql)
+    return redshift.fetch(sql, stream_results=True)
 
 
 def get_sids_with_photos():
@@ -192,8 +192,9 @@ def stream_canvas_sites(term_id):
     return redshift.fetch(sql, stream_results=True)
 
 
-@fixture('query_enrollments_in_advisee_canvas_sites_{term_id}.csv')
-def stream_canvas_enrollments(term_id):
+@fixture('query_enrollments_in_advisee_canvas_sites_{term_id}.csv', group_by='canvas_course_id')
+def stream_canvas_enrollment_frames(term_id):
+    """Stream Canvas enrollments as one DataFrame per course site, ordered by canvas_course_id."""
     sql = f"""SELECT DISTINCT
                 ce.course_id as canvas_course_id,
                 ce.canvas_user_id,
@@ -212,7 +213,7 @@ def stream_canvas_enrollments(term_id):
               WHERE ce.term_id='{term_id}'
               ORDER BY ce.course_id, ce.canvas_user_id
         """
-    return redshift.fetch(sql, stream_results=True)
+    return redshift.fetch_dataframes(sql, group_by='canvas_course_id')
 
 
 @fixture('query_advisee_submissions_comparisons_{term_id}.csv')
@@ -0,0 +1,223 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+import hashlib
+import re
+import threading
+
+from flask import current_app as app
+
+"""Statement-level instrumentation for Redshift and RDS queries."""
+
+# Upper bounds, in seconds, of the duration histogram buckets reported for each statement fingerprint.
+HISTOGRAM_BUCKETS = [0.01, 0.1, 1, 10, 60, 300, 900, float('inf')]
+
+_FINGERPRINT_SUBSTITUTIONS = [
+    (re.compile(r'--[^\n]*'), ''),
+    (re.compile(r'/\*.*?\*/', re.DOTALL), ''),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\$(\w*)\$.*?\$\1\$', re.DOTALL), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+_lock = threading.Lock()
+_local = threading.local()
+_active_job_ids = []
+_statement_stats = OrderedDict()
+_job_stats = OrderedDict()
+_retry_counts = {}
+
+
+def normalize_sql(sql):
+    """Reduce SQL to a form shared by every execution of the same statement, with literals replaced by '?'."""
+    for pattern, replacement in _FINGERPRINT_SUBSTITUTIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.md5(normalized_sql.encode()).hexdigest()[:16]
+
+
+@contextmanager
+def job_context(job_id):
+    """Attribute statements executed within the block to a background job, and to any job enclosing it."""
+    stack = _job_id_stack()
+    stack.append(job_id)
+    with _lock:
+        _active_job_ids.append(job_id)
+    try:
+        yield
+    finally:
+        stack.pop()
+        with _lock:
+            _active_job_ids.remove(job_id)
+
+
+def current_job_ids():
+    """Return ids of jobs to which the current thread's statements are attributed, outermost first.
+
+    Worker threads started by a job do not inherit its context, and fall back to every job running in the process;
+    ordinarily only one job or job chain runs at a time.
+    """
+    stack = _job_id_stack()
+    if stack:
+        return list(stack)
+    with _lock:
+        return list(_active_job_ids)
+
+
+def record(source, sql, duration, rows=None, num_bytes=None, error=False):
+    """Record one statement execution, logging it as a slow query if it ran longer than SLOW_QUERY_THRESHOLD_SECONDS."""
+    normalized = normalize_sql(sql)
+    key = (source, fingerprint(normalized))
+    job_ids = current_job_ids()
+    with _lock:
+        stats = _statement_stats.pop(key, None)
+        if stats is None:
+            stats = {
+                'source': source,
+                'fingerprint': key[1],
+                'sql': normalized[:app.config['QUERY_STATS_SQL_LENGTH']],
+                'count': 0,
+                'errors': 0,
+                'retries': 0,
+                'total_seconds': 0.0,
+                'max_seconds': 0.0,
+                'rows': 0,
+                'bytes': 0,
+                'recent_durations': deque(maxlen=app.config['QUERY_STATS_WINDOW']),
+            }
+        # Re-inserting keeps the most recently executed statements at the end, so that the least recent are evicted.
+        _statement_stats[key] = stats
+        stats['count'] += 1
+        stats['errors'] += 1 if error else 0
+        stats['total_seconds'] += duration
+        stats['max_seconds'] = max(stats['max_seconds'], duration)
+        stats['rows'] += rows or 0
+        stats['bytes'] += num_bytes or 0
+        stats['recent_durations'].append(duration)
+        while len(_statement_stats) > app.config['QUERY_STATS_MAX_STATEMENTS']:
+            _statement_stats.popitem(last=False)
+
+        for job_id in job_ids:
+            if job_id not in _job_stats:
+                _job_stats[job_id] = {}
+                while len(_job_stats) > app.config['QUERY_STATS_MAX_JOBS']:
+                    _job_stats.popitem(last=False)
+            job_statement = _job_stats[job_id].setdefault(key, {'count': 0, 'total_seconds': 0.0, 'rows': 0})
+            job_statement['count'] += 1
+            job_statement['total_seconds'] += duration
+            job_statement['rows'] += rows or 0
+
+    threshold = app.config['SLOW_QUERY_THRESHOLD_SECONDS']
+    if threshold is not None and duration >= threshold:
+        app.logger.warning(
+            f"Slow {source} query {key[1]} ran {duration:.3f} seconds, {rows if rows is not None else 'unknown'} rows "
+            f"(jobs: {', '.join(job_ids) or 'none'}):\n{normalized}",
+        )
+
+
+def record_retry(source, sql, pgcode=None):
+    """Count a retry of a statement after a transient error, by statement and by error code."""
+    key = (source, fingerprint(normalize_sql(sql)))
+    with _lock:
+        if key in _statement_stats:
+            _statement_stats[key]['retries'] += 1
+        retry_key = (source, pgcode)
+        _retry_counts[retry_key] = _retry_counts.get(retry_key, 0) + 1
+
+
+def get_retry_counts():
+    with _lock:
+        return [{'source': source, 'pgcode': pgcode, 'count': count} for (source, pgcode), count in _retry_counts.items()]
+
+
+def get_query_stats(job_id=None):
+    """Return aggregate statistics per statement fingerprint, in descending order of total time.
+
+    If a job id is given, only statements attributed to that job are included, and their counts, total times and row
+    counts are those of the job alone.
+    """
+    with _lock:
+        if job_id:
+            job_statements = dict(_job_stats.get(job_id, {}))
+        else:
+            job_statements = None
+        results = []
+        for key, stats in _statement_stats.items():
+            if job_statements is not None and key not in job_statements:
+                continue
+            durations = sorted(stats['recent_durations'])
+            result = {k: v for k, v in stats.items() if k != 'recent_durations'}
+            result.update(_summarize_durations(durations))
+            if job_statements is not None:
+                result.update(job_statements[key])
+            results.append(result)
+    results.sort(key=lambda r: r['total_seconds'], reverse=True)
+    return results
+
+
+def get_job_ids():
+    with _lock:
+        return list(_job_stats.keys())
+
+
+def reset():
+    with _lock:
+        _statement_stats.clear()
+        _job_stats.clear()
+        _retry_counts.clear()
+
+
+def _job_id_stack():
+    if not hasattr(_local, 'job_ids'):
+        _local.job_ids = []
+    return _local.job_ids
+
+
+def _summarize_durations(durations):
+    """Summarize a sorted window of recent durations as percentiles and histogram bucket counts."""
+    def _percentile(p):
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, int(p * len(durations)))]
+    histogram = []
+    index = 0
+    for upper_bound in HISTOGRAM_BUCKETS:
+        count = 0
+        while index < len(durations) and durations[index] <= upper_bound:
+            count += 1
+            index += 1
+        histogram.append(count)
+    return {
+        'p50_seconds': _percentile(0.5),
+        'p95_seconds': _percentile(0.95),
+        'histogram': histogram,
+    }
@@ -0,0 +1,192 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+import csv
+from datetime import datetime, timedelta
+from gzip import GzipFile
+import io
+import json
+from urllib.parse import unquote_plus
+
+from botocore.exceptions import BotoCoreError, ClientError
+from flask import current_app as app
+from nessie.externals import rds, s3
+
+"""A key index of S3 buckets in RDS metadata, consulted in place of repeated LIST requests.
+
+The index records which prefixes of a bucket it covers and when each was last refreshed, either from a live listing of
+the prefix or from an S3 Inventory report. Lookups under a prefix refreshed within LOCH_S3_KEY_INDEX_TTL seconds are
+answered from the index; anything else is listed live and the index refreshed on the way. Since even a fresh index can
+predate an upload, a lookup that comes up empty is always confirmed against S3 before it is believed.
+"""
+
+
+def get_keys_with_prefix(prefix, bucket=None, max_age=None):
+    """Return keys matching a prefix, or None on a listing error, like s3.get_keys_with_prefix."""
+    bucket = bucket or app.config['LOCH_S3_BUCKET']
+    try:
+        if _is_fresh(bucket, prefix, max_age):
+            keys = _fetch_indexed_keys(bucket, prefix)
+            if keys:
+                return keys
+        return refresh_prefix(prefix, bucket=bucket)
+    except (BotoCoreError, ClientError, ValueError) as e:
+        app.logger.error(f'Error listing S3 keys with prefix: bucket={bucket}, prefix={prefix}, error={e}')
+        return None
+
+
+def find_missing_keys(keys, prefix, bucket=None, max_age=None):
+    """Return those of the given keys, all under the given prefix, that do not exist in S3.
+
+    Keys found in a fresh index are taken as present, and the rest are confirmed individually. If the prefix is not
+    freshly indexed, it is listed once and the index refreshed. Listing errors are raised.
+    """
+    bucket = bucket or app.config['LOCH_S3_BUCKET']
+    if not _is_fresh(bucket, prefix, max_age):
+        existing_keys = set(refresh_prefix(prefix, bucket=bucket))
+        return [k for k in keys if k not in existing_keys]
+    rows = rds.fetch(
+        f'SELECT key FROM {_table()} WHERE bucket = %s AND key = ANY(%s)',
+        params=(bucket, list(keys)),
+        log_query=False,
+    )
+    if rows is None:
+        existing_keys = set(s3.iter_keys(prefix, bucket=bucket))
+        return [k for k in keys if k not in existing_keys]
+    indexed_keys = {r['key'] for r in rows}
+    return [k for k in keys if k not in indexed_keys and not s3.object_exists(k, bucket=bucket)]
+
+
+def refresh_prefix(prefix, bucket=None):
+    """List a prefix live, replace its entries in the index and return its keys. Listing errors are raised."""
+    bucket = bucket or app.config['LOCH_S3_BUCKET']
+    refreshed_at = datetime.utcnow()
+    objects = list(s3.iter_keys(prefix, full_objects=True, bucket=bucket))
+    rows = ((bucket, o['Key'], o['Size'], o['LastModified']) for o in objects)
+    _replace_entries(bucket, prefix, rows, refreshed_at)
+    return [o['Key'] for o in objects]
+
+
+def load_inventory(manifest_key, bucket=None):
+    """Replace the index of an inventoried bucket with the contents of an S3 Inventory report in CSV format.
+
+    The manifest and report files are read from the given bucket, by default LOCH_S3_BUCKET. The bucket's entries are
+    dated to the creation of the report, and so age out of the index like any other listing. Returns the number of
+    keys indexed, or None if the index could not be updated; S3 errors are raised.
+    """
+    bucket = bucket or app.config['LOCH_S3_BUCKET']
+    client = s3.get_client()
+    manifest = json.loads(client.get_object(Bucket=bucket, Key=manifest_key)['Body'].read())
+    if manifest.get('fileFormat') != 'CSV':
+        raise ValueError(f"Unsupported S3 inventory format: {manifest.get('fileFormat')}")
+    source_bucket = manifest['sourceBucket']
+    columns = [c.strip() for c in manifest['fileSchema'].split(',')]
+    created_at = datetime.utcfromtimestamp(int(manifest['creationTimestamp']) / 1000)
+    counter = {'keys': 0}
+
+    def _rows():
+        for file in manifest['files']:
+            body = client.get_object(Bucket=bucket, Key=file['key'])['Body']
+            with io.TextIOWrapper(GzipFile(None, 'rb', fileobj=body), encoding='utf-8', newline='') as reader:
+                for values in csv.reader(reader):
+                    entry = dict(zip(columns, values))
+                    # Versioned buckets report every version; only current, live objects belong in the index.
+                    if entry.get('IsLatest', 'true') != 'true' or entry.get('IsDeleteMarker', 'false') == 'true':
+                        continue
+                    counter['keys'] += 1
+                    yield (source_bucket, unquote_plus(entry['Key']), entry.get('Size') or None, entry.get('LastModifiedDate') or None)
+
+    if not _replace_entries(source_bucket, '', _rows(), created_at):
+        return None
+    app.logger.info(f'Indexed {counter["keys"]} keys in bucket {source_bucket} from S3 inventory {manifest_key}.')
+    return counter['keys']
+
+
+def remove_keys(keys, bucket=None):
+    """Drop deleted keys from the index."""
+    if keys:
+        return rds.execute(
+            f'DELETE FROM {_table()} WHERE bucket = %s AND key = ANY(%s)',
+            params=(bucket or app.config['LOCH_S3_BUCKET'], list(keys)),
+            log_query=False,
+        )
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fetch_indexed_keys(bucket, prefix):
+    # Order by byte value, as S3 listings do.
+    rows = rds.fetch(
+        f'SELECT key FROM {_table()} WHERE bucket = %s AND key LIKE %s ORDER BY key COLLATE "C"',
+        params=(bucket, _escape_like(prefix) + '%'),
+        log_query=False,
+    )
+    return rows and [r['key'] for r in rows]
+
+
+def _is_fresh(bucket, prefix, max_age=None):
+    ttl = app.config['LOCH_S3_KEY_INDEX_TTL'] if max_age is None else max_age
+    rows = rds.fetch(
+        f"""SELECT 1 FROM {_prefixes_table()}
+            WHERE bucket = %s AND left(%s, length(prefix)) = prefix AND refreshed_at > %s LIMIT 1""",
+        params=(bucket, prefix, datetime.utcnow() - timedelta(seconds=ttl)),
+        log_query=False,
+    )
+    return bool(rows)
+
+
+def _replace_entries(bucket, prefix, rows, refreshed_at):
+    like_prefix = _escape_like(prefix) + '%'
+    with rds.transaction() as transaction:
+        result = (
+            transaction.execute(f'DELETE FROM {_table()} WHERE bucket = %s AND key LIKE %s', params=(bucket, like_prefix), log_query=False)
+            and transaction.copy_rows(_table(), ['bucket', 'key', 'size', 'last_modified'], rows)
+            # Narrower prefixes are now covered by this one.
+            and transaction.execute(
+                f'DELETE FROM {_prefixes_table()} WHERE bucket = %s AND prefix LIKE %s',
+                params=(bucket, like_prefix),
+            )
+            and transaction.execute(
+                f'INSERT INTO {_prefixes_table()} (bucket, prefix, refreshed_at) VALUES (%s, %s, %s)',
+                params=(bucket, prefix, refreshed_at),
+            )
+        )
+        if result:
+            transaction.commit()
+            return True
+        else:
+            transaction.rollback()
+            app.logger.warning(f'Failed to update S3 key index: bucket={bucket}, prefix={prefix}')
+            return False
+
+
+def _prefixes_table():
+    return f"{app.config['RDS_SCHEMA_METADATA']}.s3_key_index_prefixes"
+
+
+def _table():
+    return f"{app.config['RDS_SCHEMA_METADATA']}.s3_key_index"
@@ -0,0 +1,263 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+import re
+
+"""Parsing and dependency analysis for multi-statement SQL scripts."""
+
+_IDENTIFIER = r'(?:"[^"]+"|[\w$]+)(?:\s*\.\s*(?:"[^"]+"|[\w$]+))*'
+
+# Statements matching these patterns write to the captured table.
+_TABLE_WRITE_PATTERNS = [
+    re.compile(
+        rf'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:EXTERNAL\s+|MATERIALIZED\s+)?(?:TABLE|VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?({_IDENTIFIER})',
+        re.IGNORECASE,
+    ),
+    re.compile(rf'^INSERT\s+INTO\s+({_IDENTIFIER})', re.IGNORECASE),
+    re.compile(rf'^UPDATE\s+({_IDENTIFIER})', re.IGNORECASE),
+    re.compile(rf'^DELETE\s+FROM\s+({_IDENTIFIER})', re.IGNORECASE),
+    re.compile(rf'^TRUNCATE\s+(?:TABLE\s+)?({_IDENTIFIER})', re.IGNORECASE),
+    re.compile(rf'^COPY\s+({_IDENTIFIER})', re.IGNORECASE),
+    re.compile(rf'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+.*?\bON\s+({_IDENTIFIER})', re.IGNORECASE | re.DOTALL),
+    re.compile(rf'^GRANT\s+.*?\bON\s+(?:TABLE\s+|FUNCTION\s+)?(?!SCHEMA\b|ALL\b|DATABASE\b)({_IDENTIFIER})', re.IGNORECASE | re.DOTALL),
+    re.compile(rf'^ALTER\s+TABLE\s+({_IDENTIFIER})(?![\s\S]*\bRENAME\b)', re.IGNORECASE),
+    re.compile(rf'^(?:CREATE\s+(?:OR\s+REPLACE\s+)?|DROP\s+)FUNCTION\s+(?:IF\s+EXISTS\s+)?({_IDENTIFIER})', re.IGNORECASE),
+]
+
+# Statements matching these patterns drop one or more comma-separated tables.
+_TABLE_DROP_PATTERN = re.compile(
+    rf'^DROP\s+(?:EXTERNAL\s+|MATERIALIZED\s+)?(?:TABLE|VIEW)\s+(?:IF\s+EXISTS\s+)?({_IDENTIFIER}(?:\s*,\s*{_IDENTIFIER})*)',
+    re.IGNORECASE,
+)
+
+# Statements matching these patterns affect everything in the captured schema.
+_SCHEMA_WRITE_PATTERNS = [
+    re.compile(rf'^(?:CREATE|DROP)\s+(?:EXTERNAL\s+)?SCHEMA\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?({_IDENTIFIER})', re.IGNORECASE),
+    re.compile(rf'^GRANT\s+.*?\bON\s+(?:ALL\s+TABLES\s+IN\s+)?SCHEMA\s+({_IDENTIFIER})', re.IGNORECASE | re.DOTALL),
+    re.compile(rf'^ALTER\s+DEFAULT\s+PRIVILEGES\s+IN\s+SCHEMA\s+({_IDENTIFIER})', re.IGNORECASE),
+]
+
+# Statements that change session state cannot be spread across connections.
+_SESSION_PATTERN = re.compile(r'^(?:SET|RESET)\b|^CREATE\s+(?:LOCAL\s+)?(?:TEMP|TEMPORARY)\b', re.IGNORECASE)
+
+_SELECT_PATTERN = re.compile(r'^(?:SELECT|WITH)\b', re.IGNORECASE)
+_FROM_PATTERN = re.compile(rf'\b(?:FROM|JOIN)\s+({_IDENTIFIER})', re.IGNORECASE)
+_QUALIFIED_NAME_PATTERN = re.compile(r'(?<![\w$.])((?:"[^"]+"|[\w$]+)\s*\.\s*(?:"[^"]+"|[\w$]+))(?![\w$])')
+_DOLLAR_QUOTE_PATTERN = re.compile(r'\$(?:[A-Za-z_]\w*)?\$')
+
+_TRANSACTION_START_PATTERN = re.compile(r'^(?:BEGIN|START\s+TRANSACTION)\b', re.IGNORECASE)
+_TRANSACTION_END_PATTERN = re.compile(r'^(?:COMMIT|END|ROLLBACK|ABORT)\b', re.IGNORECASE)
+
+
+def split_statements(sql):
+    """Split a SQL script on semicolons, ignoring semicolons inside quotes, dollar quotes and comments.
+
+    Statements are returned stripped of surrounding whitespace; statements consisting only of comments are dropped.
+    """
+    statements = []
+    start = 0
+    for index in _statement_boundaries(sql):
+        statements.append(sql[start:index])
+        start = index + 1
+    statements.append(sql[start:])
+    return [s.strip() for s in statements if strip_comments_and_literals(s).strip()]
+
+
+def strip_comments_and_literals(sql):
+    """Blank out comments and the contents of string literals, preserving identifiers and keywords."""
+    chunks = []
+    position = 0
+    for start, end, kind in _scan(sql):
+        if kind == 'identifier':
+            continue
+        chunks.append(sql[position:start])
+        chunks.append("''" if kind == 'literal' else ' ')
+        position = end
+    chunks.append(sql[position:])
+    return ''.join(chunks)
+
+
+def group_transactions(statements):
+    """Group statements into execution units, keeping each explicit transaction block together in a single unit."""
+    units = []
+    transaction = None
+    for statement in statements:
+        code = strip_comments_and_literals(statement).strip()
+        if transaction is not None:
+            transaction.append(statement)
+            if _TRANSACTION_END_PATTERN.match(code):
+                units.append(transaction)
+                transaction = None
+        elif _TRANSACTION_START_PATTERN.match(code):
+            transaction = [statement]
+        else:
+            units.append([statement])
+    if transaction is not None:
+        units.append(transaction)
+    return units
+
+
+def statement_dependencies(statement):
+    """Return the sets of resources read and written by a statement, or None if its effects cannot be determined.
+
+    Resources are lowercased table names as written, and schema names prefixed with 'schema:'. A reference to a
+    schema-qualified table also counts as a read of its schema. Reads are overestimated: every qualified name in the
+    statement is treated as a possible table.
+    """
+    code = strip_comments_and_literals(statement).strip()
+    reads = set()
+    writes = set()
+    for pattern in _SCHEMA_WRITE_PATTERNS:
+        match = pattern.match(code)
+        if match:
+            writes.add(f'schema:{_normalize_name(match.group(1))}')
+            return reads, writes
+    drop_match = _TABLE_DROP_PATTERN.match(code)
+    if drop_match:
+        writes.update(_normalize_name(name) for name in drop_match.group(1).split(','))
+    else:
+        for pattern in _TABLE_WRITE_PATTERNS:
+            match = pattern.match(code)
+            if match:
+                writes.add(_normalize_name(match.group(1)))
+                break
+        else:
+            if not _SELECT_PATTERN.match(code):
+                return None
+    reads.update(_normalize_name(name) for name in _FROM_PATTERN.findall(code))
+    reads.update(_normalize_name(name) for name in _QUALIFIED_NAME_PATTERN.findall(code))
+    for name in reads | writes:
+        if '.' in name:
+            reads.add(f"schema:{name.rsplit('.', 1)[0]}")
+    return reads - writes, writes
+
+
+def dependency_graph(units):
+    """For each execution unit, return the set of indexes of earlier units that must complete before it may start.
+
+    A unit depends on an earlier unit if either writes a resource the other reads or writes. Units whose effects cannot
+    be determined depend on, and are depended on by, every other unit.
+    """
+    dependencies = []
+    for unit in units:
+        unit_dependencies = [statement_dependencies(s) for s in unit if not _is_transaction_control(s)]
+        if any(d is None for d in unit_dependencies):
+            dependencies.append(None)
+        else:
+            dependencies.append((
+                set().union(*(reads for reads, writes in unit_dependencies)),
+                set().union(*(writes for reads, writes in unit_dependencies)),
+            ))
+    predecessors = []
+    for index, current in enumerate(dependencies):
+        unit_predecessors = set()
+        for earlier_index in range(index):
+            earlier = dependencies[earlier_index]
+            if current is None or earlier is None:
+                unit_predecessors.add(earlier_index)
+            elif (earlier[1] & (current[0] | current[1])) or (earlier[0] & current[1]):
+                unit_predecessors.add(earlier_index)
+        predecessors.append(unit_predecessors)
+    return predecessors
+
+
+def requires_single_session(statements):
+    """Return True if any statement changes session state, such as a SET or a temporary table."""
+    return any(_SESSION_PATTERN.match(strip_comments_and_literals(s).strip()) for s in statements)
+
+
+def _is_transaction_control(statement):
+    code = strip_comments_and_literals(statement).strip()
+    return bool(_TRANSACTION_START_PATTERN.match(code) or _TRANSACTION_END_PATTERN.match(code))
+
+
+def _normalize_name(name):
+    return re.sub(r'\s+', '', name).lower()
+
+
+def _statement_boundaries(sql):
+    skipped = iter(_scan(sql))
+    next_skipped = next(skipped, None)
+    index = 0
+    while True:
+        index = sql.find(';', index)
+        if index < 0:
+            return
+        while next_skipped and next_skipped[1] <= index:
+            next_skipped = next(skipped, None)
+        if next_skipped and next_skipped[0] <= index:
+            index = next_skipped[1]
+            continue
+        yield index
+        index += 1
+
+
+def _scan(sql):
+    """Yield (start, end, kind) spans of comments, string literals, quoted identifiers and dollar-quoted bodies."""
+    index = 0
+    length = len(sql)
+    while index < length:
+        char = sql[index]
+        if sql.startswith('--', index):
+            end = sql.find('\n', index)
+            end = length if end < 0 else end
+            yield index, end, 'comment'
+            index = end
+        elif sql.startswith('/*', index):
+            end = sql.find('*/', index + 2)
+            end = length if end < 0 else end + 2
+            yield index, end, 'comment'
+            index = end
+        elif char == "'":
+            end = index + 1
+            while end < length:
+                if sql[end] == "'" and sql.startswith("''", end):
+                    end += 2
+                elif sql[end] == "'":
+                    break
+                elif sql[end] == '\\':
+                    end += 2
+                else:
+                    end += 1
+            end = min(end + 1, length)
+            yield index, end, 'literal'
+            index = end
+        elif char == '"':
+            end = sql.find('"', index + 1)
+            end = length if end < 0 else end + 1
+            yield index, end, 'identifier'
+            index = end
+        elif char == '$':
+            match = _DOLLAR_QUOTE_PATTERN.match(sql, index)
+            if match and (index == 0 or not (sql[index - 1].isalnum() or sql[index - 1] == '_')):
+                tag = match.group(0)
+                end = sql.find(tag, match.end())
+                end = length if end < 0 else end + len(tag)
+                yield index, end, 'literal'
+                index = end
+            else:
+                index += 1
+        else:
+            index += 1
@@ -0,0 +1,140 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from functools import total_ordering
+from itertools import groupby
+
+from flask import current_app as app
+
+"""Utilities to merge-join result streams sorted by a common key."""
+
+
+@total_ordering
+class Descending:
+    """Wrap a key component so that streams ordered DESC on it compare as ascending."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __repr__(self):
+        return f'Descending({self.value!r})'
+
+
+class SortedGroups:
+    """Look up groups of rows in a stream sorted ascending by key, advancing through the stream as keys increase.
+
+    If no key function is given, the stream must already consist of (key, group) pairs. Lookups must be made in
+    ascending key order, and each group must be consumed before the next lookup.
+    """
+
+    def __init__(self, rows, key=None):
+        self._groups = groupby(rows, key) if key else iter(rows)
+        self._current = None
+        self._exhausted = False
+
+    def get(self, key, default=None):
+        while not self._exhausted and (self._current is None or self._current[0] < key):
+            self._current = next(self._groups, None)
+            if self._current is None:
+                self._exhausted = True
+        if self._current is not None and self._current[0] == key:
+            return self._current[1]
+        return default
+
+
+def merge_join(primary, key, secondaries):
+    """Left-join any number of sorted secondary streams to a primary stream sorted by the same key.
+
+    Secondary streams are given by name, either as rows to be grouped by the key function or as SortedGroups. For
+    each group of primary rows, yield a tuple of key, primary rows, and a dict from secondary names to matching groups;
+    secondaries without a match are left out of the dict.
+    """
+    lookups = {name: (s if isinstance(s, SortedGroups) else SortedGroups(s, key)) for name, s in secondaries.items()}
+    for key_value, primary_rows in groupby(primary, key):
+        matches = {}
+        for name, lookup in lookups.items():
+            group = lookup.get(key_value)
+            if group is not None:
+                matches[name] = group
+        yield key_value, primary_rows, matches
+
+
+def sorted_difference(left, right):
+    """Yield items of the sorted stream left which do not appear in the sorted stream right, in a single pass over each.
+
+    Memory use is constant, and right is read only as far as the last item of left.
+    """
+    right = iter(right)
+    sentinel = object()
+    current = next(right, sentinel)
+    for item in left:
+        while current is not sentinel and current < item:
+            current = next(right, sentinel)
+        if current is sentinel or item != current:
+            yield item
+
+
+@contextmanager
+def open_streams(**stream_functions):
+    """Call each stream-opening function on its own thread, so that the underlying queries run concurrently.
+
+    Yields a dict of streams by name. All streams are closed on exit, including when any one of them fails to open.
+    """
+    app_obj = app._get_current_object()
+
+    def _open(stream_function):
+        with app_obj.app_context():
+            return stream_function()
+
+    with ExitStack() as stack:
+        with ThreadPoolExecutor(max_workers=len(stream_functions)) as executor:
+            futures = {name: executor.submit(_open, f) for name, f in stream_functions.items()}
+        streams = {}
+        error = None
+        for name, future in futures.items():
+            try:
+                streams[name] = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            # Mock query results in test and demo environments are plain lists.
+            if hasattr(streams[name], 'close'):
+                stack.callback(streams[name].close)
+        if error:
+            raise error
+        yield streams
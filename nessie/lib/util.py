@@ -23,14 +23,17 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, datetime, timedelta
 import hashlib
 import inspect
+from multiprocessing import get_context
+import os
 import re
 
 from dateutil.rrule import DAILY, rrule
-from flask import current_app as app
-from nessie.lib.berkeley import earliest_term_id
+from flask import current_app as app, Flask
+from nessie.lib.berkeley import cache_thread, earliest_term_id, get_config_terms
 import pytz
 
 """Generic utilities."""
@@ -54,6 +57,33 @@ def fill_pattern_from_args(pattern, func, *args, **kw):
     return pattern.format(**get_args_dict(func, *args, **kw))
 
 
+def forked_process_pool(max_workers, initializer=None, initargs=()):
+    """Return a pool of forked worker processes, each running under a lightweight app context.
+
+    Workers share no Flask state with the parent. Each holds a copy of the app config and of the config terms already
+    resolved here, so that term lookups in workers never need a database connection. All workers are forked before
+    the pool is returned, not later from a process that may by then be running other threads. If an initializer is
+    given it then runs in each worker; since workers are forked, its initargs are inherited rather than pickled.
+    """
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=get_context('fork'),
+        initializer=_init_forked_worker,
+        initargs=(dict(app.config), get_config_terms(), initializer, initargs),
+    )
+    executor.submit(os.getpid).result()
+    return executor
+
+
+def _init_forked_worker(config, config_terms, initializer, initargs):
+    worker_app = Flask(__name__.split('.')[0])
+    worker_app.config.update(config)
+    worker_app.app_context().push()
+    cache_thread.config_terms = config_terms
+    if initializer:
+        initializer(*initargs)
+
+
 def get_args_dict(func, *args, **kw):
     arg_names = inspect.getfullargspec(func)[0]
     resp = dict(zip(arg_names, args))
@@ -23,15 +23,21 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from contextlib import contextmanager
+
+from botocore.exceptions import BotoCoreError, ClientError
 from flask import current_app as app
 from nessie.externals import redshift, s3
 from nessie.jobs.background_job import BackgroundJobError
 from nessie.lib.queries import student_schema
-from nessie.lib.util import get_s3_sis_api_daily_path, resolve_sql_template_string
+from nessie.lib.util import get_s3_sis_api_daily_path
 import psycopg2.sql
 
 """Higher-level logic for staged student schema in Redshift."""
 
+# Bytes read at a time from feed files written before upload.
+FILE_CHUNK_SIZE = 1024 * 1024
+
 
 def staging_schema():
     return f'{student_schema()}_staging'
@@ -98,30 +104,82 @@ def truncate_staging_table(table):
 
 
 def upload_file_to_staging(table, term_file, row_count, term_id):
-    tsv_filename = f'staging_{table}_{term_id}.tsv' if term_id else f'staging_{table}.tsv'
-    s3_key = f'{get_s3_sis_api_daily_path()}/{tsv_filename}'
-    app.logger.info(f'Will stash {row_count} feeds in S3: {s3_key}')
+    app.logger.info(f'Will stash {row_count} feeds in S3.')
     # Be kind; rewind
     term_file.seek(0)
-    if not s3.upload_data(term_file, s3_key):
-        raise BackgroundJobError(f'Failed upload {row_count} records to s3:{s3_key}. Aborting job.')
+    with _upload_to_staging(table, term_id) as upload:
+        for chunk in iter(lambda: term_file.read(FILE_CHUNK_SIZE), b''):
+            upload.write(chunk)
+
+
+@contextmanager
+def stream_to_staging(table, term_id=None):
+    """Yield a writable file of TSV lines, uploaded to S3 as they are written, then copied to the staging table.
+
+    Feed generation thus overlaps with the upload, and the Redshift COPY starts as soon as the last shard is uploaded.
+    """
+    with _upload_to_staging(table, term_id) as upload:
+        yield upload
+    verify_table(table)
+
+
+@contextmanager
+def _upload_to_staging(table, term_id):
+    s3_key = f'{get_s3_sis_api_daily_path()}/{_staging_tsv_filename(table, term_id)}'
+    app.logger.info(f'Will stream feeds to S3: {s3_key}')
+    with sharded_staging_upload(s3_key) as upload:
+        yield upload
+    app.logger.info(f'Uploaded {upload.row_count} rows in {len(upload.shard_keys)} shards to s3:{s3_key}.')
 
     app.logger.info('Will copy S3 feeds into Redshift...')
-    query = resolve_sql_template_string(
-        """
-        COPY {staging_schema}.{table}
-            FROM '{loch_s3_sis_api_data_path}/{tsv_filename}'
-            IAM_ROLE '{redshift_iam_role}'
-            DELIMITER '\\t';
-        """,
-        staging_schema=staging_schema(),
-        table=table,
-        tsv_filename=tsv_filename,
-    )
-    if not redshift.execute(query):
+    if not redshift.copy_tsv_from_s3(f'{staging_schema()}.{table}', upload.manifest_key, manifest=True, gzip=True):
         raise BackgroundJobError('Error on Redshift copy: aborting job.')
 
 
+@contextmanager
+def sharded_staging_upload(s3_key):
+    """Yield a writable ShardedUpload to s3_key with one shard per Redshift slice, for a later COPY into staging.
+
+    S3 errors from the upload are raised as BackgroundJobError. Errors raised by the caller's own block abort the upload
+    and propagate unchanged, so that a bug in feed generation is not reported as an upload failure.
+    """
+    upload = s3.ShardedUpload(s3_key, redshift.get_copy_shard_count())
+    with _upload_errors(s3_key):
+        upload.__enter__()
+    try:
+        yield _StagingUploadWriter(upload, s3_key)
+    except BaseException as e:
+        try:
+            upload.__exit__(type(e), e, e.__traceback__)
+        except (BotoCoreError, ClientError, ValueError) as abort_error:
+            app.logger.warning(f'Failed to abort upload to s3:{s3_key}: {abort_error}')
+        raise
+    with _upload_errors(s3_key):
+        upload.__exit__(None, None, None)
+
+
+class _StagingUploadWriter:
+
+    def __init__(self, upload, s3_key):
+        self.upload = upload
+        self.s3_key = s3_key
+
+    def __getattr__(self, name):
+        return getattr(self.upload, name)
+
+    def write(self, data):
+        with _upload_errors(self.s3_key):
+            return self.upload.write(data)
+
+
+@contextmanager
+def _upload_errors(s3_key):
+    try:
+        yield
+    except (BotoCoreError, ClientError, ValueError) as e:
+        raise BackgroundJobError(f'Failed upload to s3:{s3_key}: {e}. Aborting job.')
+
+
 def verify_table(table):
     result = redshift.fetch(
         'SELECT COUNT(*) FROM {schema}.{table}',
@@ -139,3 +197,19 @@ def write_file_to_staging(table, term_file, row_count, term_id=None):
     upload_file_to_staging(table, term_file, row_count, term_id)
     verify_table(table)
     return True
+
+
+def write_shards_to_staging(table, shard_paths, row_count, term_id=None):
+    """Upload feed files written in parallel, one after another, as a single staging table load."""
+    app.logger.info(f'Will stash {row_count} feeds from {len(shard_paths)} shard files in S3.')
+    with _upload_to_staging(table, term_id) as upload:
+        for shard_path in shard_paths:
+            with open(shard_path, 'rb') as shard_file:
+                for chunk in iter(lambda: shard_file.read(FILE_CHUNK_SIZE), b''):
+                    upload.write(chunk)
+    verify_table(table)
+    return True
+
+
+def _staging_tsv_filename(table, term_id):
+    return f'staging_{table}_{term_id}.tsv' if term_id else f'staging_{table}.tsv'
@@ -86,9 +86,16 @@ CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.canvas_sync_job_status
     instance_id VARCHAR,
     created_at TIMESTAMP NOT NULL,
     updated_at TIMESTAMP NOT NULL,
+    -- The S3 multipart upload in progress, and a JSON array of its uploaded part numbers, so that a later sync
+    -- can resume it.
+    upload_id VARCHAR,
+    uploaded_parts VARCHAR,
     PRIMARY KEY (job_id, filename)
 );
 
+ALTER TABLE {rds_schema_metadata}.canvas_sync_job_status ADD COLUMN IF NOT EXISTS upload_id VARCHAR;
+ALTER TABLE {rds_schema_metadata}.canvas_sync_job_status ADD COLUMN IF NOT EXISTS uploaded_parts VARCHAR;
+
 CREATE INDEX IF NOT EXISTS canvas_sync_job_idx
 ON {rds_schema_metadata}.canvas_sync_job_status (job_id);
 
@@ -113,6 +120,16 @@ CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.registration_import_status
     updated_at TIMESTAMP NOT NULL
 );
 
+-- Digest of the source rows behind each student's merged feeds, by feed type ('profile', 'enrollment_terms').
+CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.merged_feed_fingerprints
+(
+    sid VARCHAR NOT NULL,
+    feed_type VARCHAR NOT NULL,
+    fingerprint VARCHAR NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (feed_type, sid)
+);
+
 CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.photo_import_status
 (
     sid VARCHAR NOT NULL PRIMARY KEY,
@@ -121,3 +138,24 @@ CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.photo_import_status
     updated_at TIMESTAMP NOT NULL
 );
 
+CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.s3_key_index
+(
+    bucket VARCHAR NOT NULL,
+    key VARCHAR NOT NULL,
+    size BIGINT,
+    last_modified TIMESTAMP,
+    PRIMARY KEY (bucket, key)
+);
+
+CREATE INDEX IF NOT EXISTS s3_key_index_prefix_idx
+ON {rds_schema_metadata}.s3_key_index (bucket, key varchar_pattern_ops);
+
+-- Prefixes covered by s3_key_index, and when each was last listed.
+CREATE TABLE IF NOT EXISTS {rds_schema_metadata}.s3_key_index_prefixes
+(
+    bucket VARCHAR NOT NULL,
+    prefix VARCHAR NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+);
+
@@ -96,7 +96,9 @@ def metadata_db(app):
        details VARCHAR,
        instance_id VARCHAR,
        created_at TIMESTAMP NOT NULL,
-       updated_at TIMESTAMP NOT NULL
+       updated_at TIMESTAMP NOT NULL,
+       upload_id VARCHAR,
+       uploaded_parts VARCHAR
     )""")
     rds.execute(f"""CREATE TABLE IF NOT EXISTS {rds_schema}.canvas_synced_snapshots
     (
@@ -124,12 +126,35 @@ def metadata_db(app):
        created_at TIMESTAMP NOT NULL,
        updated_at TIMESTAMP NOT NULL
     )""")
+    rds.execute(f"""CREATE TABLE IF NOT EXISTS {rds_schema}.merged_feed_fingerprints
+    (
+        sid VARCHAR NOT NULL,
+        feed_type VARCHAR NOT NULL,
+        fingerprint VARCHAR NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (feed_type, sid)
+    );""")
     rds.execute(f"""CREATE TABLE IF NOT EXISTS {rds_schema}.photo_import_status
     (
         sid VARCHAR NOT NULL PRIMARY KEY,
         status VARCHAR NOT NULL,
         updated_at TIMESTAMP NOT NULL
     );""")
+    rds.execute(f"""CREATE TABLE IF NOT EXISTS {rds_schema}.s3_key_index
+    (
+        bucket VARCHAR NOT NULL,
+        key VARCHAR NOT NULL,
+        size BIGINT,
+        last_modified TIMESTAMP,
+        PRIMARY KEY (bucket, key)
+    );""")
+    rds.execute(f"""CREATE TABLE IF NOT EXISTS {rds_schema}.s3_key_index_prefixes
+    (
+        bucket VARCHAR NOT NULL,
+        prefix VARCHAR NOT NULL,
+        refreshed_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (bucket, prefix)
+    );""")
 
 
 @pytest.fixture()
@@ -23,6 +23,8 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+from nessie.externals import rds
+from nessie.lib import query_stats
 from tests.util import credentials, get_basic_auth, post_basic_auth
 
 
@@ -51,3 +53,33 @@ class TestAdminController:
         job = next((job for job in response.json if job.get('name') == 'Generate merged student feeds'), None)
         assert job.get('path') == '/api/job/generate_merged_student_feeds'
         assert 'POST' in job.get('methods')
+
+    def test_query_stats(self, app, client):
+        """Returns statement statistics, optionally for a single job."""
+        query_stats.reset()
+        with query_stats.job_context('TestJob_1'):
+            rds.fetch('SELECT 1 AS n WHERE 2 > 1')
+        rds.fetch('SELECT 2 AS n WHERE 3 > 1')
+        response = get_basic_auth(client=client, path='/api/admin/query_stats', credentials=credentials(app))
+        assert response.status_code == 200
+        assert response.json['jobIds'] == ['TestJob_1']
+        statement = response.json['statements'][0]
+        assert statement['source'] == 'rds'
+        assert statement['sql'] == 'SELECT ? AS n WHERE ? > ?'
+        assert statement['count'] == 2
+        assert statement['rows'] == 2
+        assert sum(statement['histogram'].values()) == 2
+
+        response = get_basic_auth(client=client, path='/api/admin/query_stats?jobId=TestJob_1', credentials=credentials(app))
+        assert response.json['statements'][0]['count'] == 1
+
+    def test_connection_pools(self, app, client):
+        """Returns connection pool usage."""
+        rds.fetch('SELECT 1')
+        response = get_basic_auth(client=client, path='/api/admin/connection_pools', credentials=credentials(app))
+        assert response.status_code == 200
+        pool = next((pool for pool in response.json if pool.get('name') == 'rds'), None)
+        assert pool['checkouts'] > 0
+        assert pool['connectionsCreated'] > 0
+        assert pool['inUse'] == 0
+        assert pool['maxSize'] == app.config['RDS_POOL_MAX_SIZE']
@@ -0,0 +1,67 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from nessie.externals import aws
+from tests.util import mock_s3
+
+
+def _credentials(expires_in):
+    return {
+        'AccessKeyId': 'key',
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': datetime.now(timezone.utc) + timedelta(seconds=expires_in),
+    }
+
+
+class TestAws:
+    """Cached AWS credentials and clients."""
+
+    def test_shared_client(self, app):
+        """Assumes the app role once, sharing clients per service and region."""
+        with mock_s3(app):
+            assert aws.get_client('s3', 'us-west-2') is aws.get_client('s3', 'us-west-2')
+            assert aws.get_client('s3', 'us-west-2') is not aws.get_client('s3', 'us-east-1')
+            assert aws.get_session() is not aws.get_session()
+
+    def test_refresh_before_expiry(self, app, monkeypatch):
+        """Assumes the role again once credentials are near expiry, without rebuilding cached clients."""
+        issued = []
+
+        def _get_sts_credentials():
+            issued.append({**_credentials(expires_in=(30 if not issued else 900)), 'AccessKeyId': f'key{len(issued)}'})
+            return issued[-1]
+        monkeypatch.setattr(aws, 'get_sts_credentials', _get_sts_credentials)
+        aws.reset()
+        client = aws.get_client('dms', 'us-west-2')
+        assert len(issued) == 1
+        assert client._request_signer._credentials.get_frozen_credentials().access_key == 'key1'
+        assert len(issued) == 2
+        assert aws.get_client('dms', 'us-west-2') is client
+        assert client._request_signer._credentials.get_frozen_credentials().access_key == 'key1'
+        assert len(issued) == 2
+        aws.reset()
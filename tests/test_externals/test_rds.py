@@ -0,0 +1,77 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from datetime import datetime
+
+from nessie.externals import rds
+import pytest
+
+
+@pytest.fixture()
+def copy_table(app):
+    rds.execute('DROP TABLE IF EXISTS public.copy_rows_test')
+    rds.execute("""CREATE TABLE public.copy_rows_test
+    (
+        id INTEGER NOT NULL,
+        label VARCHAR,
+        active BOOLEAN,
+        created_at TIMESTAMP
+    )""")
+    yield 'public.copy_rows_test'
+    rds.execute('DROP TABLE IF EXISTS public.copy_rows_test')
+
+
+class TestRds:
+    """RDS client."""
+
+    @pytest.mark.parametrize('copy_format', ['text', 'csv'])
+    def test_copy_rows(self, app, copy_table, copy_format):
+        """Streams rows from a generator through COPY, round-tripping special characters, nulls and empty strings."""
+        labels = ['plain', 'tab\there', 'new\nline', 'back\\slash', 'quote "and" comma, here', None, '', '\\.', 'carriage\rreturn', '\\N']
+
+        def _rows():
+            for index, label in enumerate(labels):
+                yield (index, label, index % 2 == 0, datetime(2022, 1, 1 + index))
+
+        with rds.transaction() as transaction:
+            result = transaction.copy_rows(copy_table, ['id', 'label', 'active', 'created_at'], _rows(), copy_format=copy_format)
+            assert result == f'COPY {len(labels)}'
+            transaction.commit()
+
+        rows = rds.fetch(f'SELECT * FROM {copy_table} ORDER BY id')
+        assert [r['label'] for r in rows] == labels
+        assert [r['active'] for r in rows] == [index % 2 == 0 for index in range(len(labels))]
+        assert rows[5]['created_at'] == datetime(2022, 1, 6)
+
+    def test_copy_row_reader_chunks(self):
+        """Renders rows lazily in chunks of the requested size."""
+        reader = rds.CopyRowReader(((i, 'x' * 10) for i in range(1000)))
+        first = reader.read(100)
+        assert len(first) == 100
+        assert reader.row_count < 10
+        rest = reader.read()
+        assert reader.row_count == 1000
+        assert (first + rest).count('\n') == 1000
+        assert reader.read(100) == ''
@@ -55,6 +55,54 @@ class TestRedshift:
                 redshift.execute('SELECT 1')
                 assert 'could not translate host name "H.C. Earwicker" to address' in caplog.text
 
+    def test_fetch_row_types(self, app):
+        """Returns rows as dicts, DictRows, named tuples or plain tuples."""
+        sql = "SELECT 1 AS id, 'one' AS label UNION SELECT 2, 'two' ORDER BY id"
+        assert redshift.fetch(sql) == [{'id': 1, 'label': 'one'}, {'id': 2, 'label': 'two'}]
+
+        dictrows = redshift.fetch(sql, row_type='dictrow')
+        assert dictrows[1]['label'] == 'two'
+        assert dictrows[1].get('id') == 2
+
+        namedtuples = redshift.fetch(sql, row_type='namedtuple')
+        assert namedtuples[0].label == 'one'
+        assert namedtuples[0]._fields == ('id', 'label')
+
+        tuples = redshift.fetch(sql, row_type='tuple')
+        assert tuples == [(1, 'one'), (2, 'two')]
+        assert tuples.columns == {'id': 0, 'label': 1}
+        assert tuples.column('label') == ['one', 'two']
+
+    @pytest.mark.parametrize('prefetch', [0, 2])
+    def test_stream(self, app, prefetch):
+        """Streams rows in batches and closes the cursor's connection on exit."""
+        sql = 'SELECT generate_series(1, 25) AS n'
+        with redshift.stream(sql, itersize=10, prefetch=prefetch) as results:
+            assert [row['n'] for row in results] == list(range(1, 26))
+        assert results.stats['rows'] == 25
+        assert results.stats['batches'] == 3
+        assert results.cursor.connection.closed
+
+    def test_stream_closed_early(self, app):
+        """Stops fetching when closed before the result set is exhausted."""
+        sql = 'SELECT generate_series(1, 1000) AS n'
+        with redshift.stream(sql, itersize=10, prefetch=1) as results:
+            assert next(iter(results))['n'] == 1
+        assert results.stats['rows'] < 1000
+        assert results.cursor.connection.closed
+
+    def test_fetch_dataframes_grouped(self, app):
+        """Yields one DataFrame per group, even when a group spans batches."""
+        sql = """SELECT course_id, user_id, score FROM (VALUES
+            (1, 10, 1.5), (1, 11, NULL), (2, 12, 3.0), (2, 13, 4.0), (2, 14, 5.0), (3, 15, 6.0)
+        ) AS t (course_id, user_id, score) ORDER BY course_id, user_id"""
+        with redshift.fetch_dataframes(sql, group_by='course_id', batch_size=2) as frames:
+            groups = list(frames)
+        assert [key for key, frame in groups] == [1, 2, 3]
+        assert [frame['user_id'].tolist() for key, frame in groups] == [[10, 11], [12, 13, 14], [15]]
+        assert str(groups[1][1]['user_id'].dtype) == 'int64'
+        assert groups[0][1]['score'].isnull().tolist() == [False, True]
+
     @pytest.mark.testext
     def test_schema_creation_drop(self, app, caplog, ensure_drop_schema):
         """Can create and drop schemata on a real Redshift instance."""
@@ -71,6 +119,27 @@ class TestRedshift:
             result = redshift.execute('DROP SCHEMA {schema}', schema=schema)
             assert result == 'DROP SCHEMA'
 
+    @pytest.mark.testext
+    def test_execute_ddl_script_concurrently(self, app, ensure_drop_schema):
+        """Runs independent statements concurrently, respecting dependencies between them."""
+        schema = app.config['REDSHIFT_SCHEMA_BOAC']
+        sql = f"""
+            DROP SCHEMA IF EXISTS {schema} CASCADE;
+            CREATE SCHEMA {schema};
+            CREATE TABLE {schema}.a AS (SELECT generate_series(1, 3) AS id, 'semi;colon' AS label);
+            CREATE TABLE {schema}.b AS (SELECT generate_series(4, 5) AS id, 'b' AS label);
+            CREATE TABLE {schema}.c AS (SELECT * FROM {schema}.a UNION SELECT * FROM {schema}.b);
+            BEGIN TRANSACTION;
+            DELETE FROM {schema}.a WHERE id = 1;
+            INSERT INTO {schema}.a (SELECT 6 AS id, 'a' AS label);
+            COMMIT TRANSACTION;
+        """
+        assert redshift.execute_ddl_script(sql, max_concurrency=4) is True
+        assert redshift.fetch(f'SELECT COUNT(*) FROM {schema}.c')[0]['count'] == 5
+        assert [r['id'] for r in redshift.fetch(f'SELECT id FROM {schema}.a ORDER BY id')] == [2, 3, 6]
+
+        assert redshift.execute_ddl_script(f'SELECT * FROM {schema}.nonexistent; SELECT 1;', max_concurrency=4) is False
+
     @pytest.mark.testext
     def test_execute_ddl_script(self, app, ensure_drop_schema):
         """Executes filled SQL template files one statement at a time."""
@@ -23,11 +23,17 @@ SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
 ENHANCEMENTS, OR MODIFICATIONS.
 """
 
-from botocore.exceptions import ConnectionError
+import gzip
+import io
+import json
+from zipfile import ZipFile
+
+from botocore.exceptions import ClientError, ConnectionError
 from nessie.externals import s3
 import pytest
+import requests
 import responses
-from tests.util import capture_app_logs, mock_s3
+from tests.util import capture_app_logs, mock_s3, override_config
 
 
 @pytest.fixture
@@ -58,6 +64,187 @@ class TestS3:
             assert f'{prefix}/requests-bbb.gz' in response
             assert f'{prefix}/requests-ccc.gz' in response
 
+    def test_iter_keys_split(self, app):
+        """Lists partitions of a key range concurrently, yielding keys in order."""
+        bucket = app.config['LOCH_S3_BUCKET']
+        with mock_s3(app) as m:
+            keys = sorted([f'attachments/{sid}/{sid}_{n}.pdf' for sid in ['1234', '2345', '5678', '9012'] for n in range(3)])
+            for key in keys + ['attachments/0000/stray.pdf', 'attachments/README', 'other/5678_0.pdf']:
+                m.Object(bucket, key).put(Body=b'attachment')
+            expected = sorted(keys + ['attachments/0000/stray.pdf', 'attachments/README'])
+            assert list(s3.iter_keys('attachments/')) == expected
+            split_after = [f'attachments/{digit}' for digit in '123456789']
+            assert list(s3.iter_keys('attachments/', split_after=split_after, max_workers=3)) == expected
+            objects = list(s3.iter_keys('attachments/5', full_objects=True, split_after=['attachments/5678/5678_1.pdf']))
+            assert [o['Key'] for o in objects] == [f'attachments/5678/5678_{n}.pdf' for n in range(3)]
+            assert objects[0]['Size'] == 10
+
+    def test_copy_objects(self, app, caplog):
+        """Copies objects concurrently, reporting failures without aborting other copies."""
+        bucket = app.config['LOCH_S3_BUCKET']
+        with capture_app_logs(app), mock_s3(app) as m:
+            for i in range(10):
+                m.Object(bucket, f'source/{i}.csv').put(Body=f'data {i}'.encode())
+            copies = [(bucket, f'source/{i}.csv', bucket, f'dest/{i}.csv') for i in range(11)]
+            report = s3.copy_objects(copies, max_workers=3)
+            assert sorted(report['copied']) == sorted(copies[:10])
+            assert len(report['failed']) == 1
+            assert report['failed'][0][:4] == (bucket, 'source/10.csv', bucket, 'dest/10.csv')
+            assert 'S3 bulk copy complete: 10 copied, 1 failed' in caplog.text
+            assert m.Object(bucket, 'dest/7.csv').get()['Body'].read() == b'data 7'
+
+    def test_multipart_upload(self, app):
+        """Uploads parts as data is written, in a single request if there is less than one part."""
+        bucket = app.config['LOCH_S3_BUCKET']
+        part_size = 5 * 1024 * 1024
+        line = b'0123456789abcdef' * 64 + b'\n'
+        with mock_s3(app) as m:
+            with s3.MultipartUpload('multipart.tsv', part_size=part_size, max_workers=2) as upload:
+                for i in range(11 * 1024):
+                    upload.write(line)
+            assert upload.part_count == 3
+            body = m.Object(bucket, 'multipart.tsv').get()['Body'].read()
+            assert body == line * 11 * 1024
+
+            with s3.MultipartUpload('single.tsv', part_size=part_size) as upload:
+                upload.write(line)
+            assert upload.part_count == 0
+            assert m.Object(bucket, 'single.tsv').get()['Body'].read() == line
+
+            with pytest.raises(RuntimeError):
+                with s3.MultipartUpload('aborted.tsv', part_size=part_size) as upload:
+                    upload.write(line * 6 * 1024)
+                    raise RuntimeError('Feed generation failed')
+            assert not s3.object_exists('aborted.tsv')
+
+    def test_sharded_upload(self, app):
+        """Deals lines over gzipped shards, listed in a COPY manifest."""
+        bucket = app.config['LOCH_S3_BUCKET']
+        with mock_s3(app):
+            rows = [f'{i}\trow {i}'.encode() for i in range(7)]
+            manifest_key = s3.upload_tsv_shards(rows, 'staging/rows.tsv', shard_count=3)
+            assert manifest_key == 'staging/rows.tsv.manifest'
+            manifest = s3.get_object_json(manifest_key)
+            assert manifest['entries'] == [
+                {'url': f's3://{bucket}/staging/rows.tsv.{index:04d}.gz', 'mandatory': True} for index in range(3)
+            ]
+            shards = [s3.get_unzipped_text_reader(f'staging/rows.tsv.{index:04d}.gz').read() for index in range(3)]
+            assert shards[0] == '0\trow 0\n3\trow 3\n6\trow 6\n'
+            assert shards[2] == '2\trow 2\n5\trow 5\n'
+
+            # Lines split across writes are kept whole.
+            with s3.ShardedUpload('staging/chunks.tsv', shard_count=2) as upload:
+                upload.write(b'a\tfirst\nb\tsec')
+                upload.write(b'ond\nc\tthird')
+            assert upload.row_count == 3
+            assert s3.get_unzipped_text_reader('staging/chunks.tsv.0001.gz').read() == 'b\tsecond\n'
+
+    @responses.activate
+    def test_upload_from_url_in_ranges(self, app):
+        """Copies a file in concurrent ranged parts, resuming an interrupted upload from its completed parts."""
+        url = 'https://canvas-data.example.com/requests/part-00000.gz'
+        part_size = 5 * 1024 * 1024
+        body = bytes(range(256)) * (11 * 4096)
+        requested_ranges = []
+        failing_starts = {part_size}
+
+        def _respond(request):
+            start, end = (int(n) for n in request.headers['Range'][len('bytes='):].split('-'))
+            requested_ranges.append(start)
+            if start in failing_starts:
+                raise requests.exceptions.ConnectionError('Connection reset by peer')
+            return (206, {'Content-Range': f'bytes {start}-{end}/{len(body)}'}, body[start:end + 1])
+
+        responses.add_callback(responses.GET, url, callback=_respond)
+        recorded = []
+        with mock_s3(app), override_config(app, 'LOCH_S3_URL_SYNC_PART_SIZE', part_size):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                s3.upload_from_url(url, 'requests/part-00000.gz', on_parts_uploaded=lambda upload_id, parts: recorded.append((upload_id, parts)))
+            assert recorded[-1][1] == [1, 3]
+
+            failing_starts.clear()
+            requested_ranges.clear()
+            response = s3.upload_from_url(url, 'requests/part-00000.gz', resume=recorded[-1])
+            assert response['ContentLength'] == len(body)
+            assert requested_ranges == [0, part_size]
+            client = s3.get_client()
+            assert client.get_object(Bucket=app.config['LOCH_S3_BUCKET'], Key='requests/part-00000.gz')['Body'].read() == body
+
+    @responses.activate
+    def test_upload_from_url_retries_truncated_range(self, app):
+        """Retries a part whose range response comes back short."""
+        url = 'https://canvas-data.example.com/requests/part-00001.gz'
+        part_size = 5 * 1024 * 1024
+        body = bytes(range(256)) * (11 * 4096)
+        requested_ranges = []
+
+        def _respond(request):
+            start, end = (int(n) for n in request.headers['Range'][len('bytes='):].split('-'))
+            requested_ranges.append(start)
+            if start == part_size and requested_ranges.count(start) == 1:
+                end = start + 1023
+            return (206, {'Content-Range': f'bytes {start}-{end}/{len(body)}'}, body[start:end + 1])
+
+        responses.add_callback(responses.GET, url, callback=_respond)
+        with mock_s3(app), override_config(app, 'LOCH_S3_URL_SYNC_PART_SIZE', part_size):
+            response = s3.upload_from_url(url, 'requests/part-00001.gz')
+            assert response['ContentLength'] == len(body)
+            assert requested_ranges.count(part_size) == 2
+            client = s3.get_client()
+            assert client.get_object(Bucket=app.config['LOCH_S3_BUCKET'], Key='requests/part-00001.gz')['Body'].read() == body
+
+    def test_upload_objects(self, app):
+        """Uploads objects from a lazy iterable on a bounded pool, reporting each upload."""
+        with mock_s3(app):
+            uploads = ((f'piazza/posts/{index}.json', json.dumps({'id': index}).encode()) for index in range(25))
+            completed = []
+            report = s3.upload_objects(uploads, max_workers=3, on_upload=lambda key, error: completed.append(key))
+            assert report == {'uploaded': 25, 'failed': 0}
+            assert sorted(completed) == sorted(f'piazza/posts/{index}.json' for index in range(25))
+            assert s3.get_object_json('piazza/posts/24.json') == {'id': 24}
+
+    def test_csv_stream(self, app):
+        """Parses gzipped CSV rows to integers in batches."""
+        bucket = app.config['LOCH_S3_BUCKET']
+        text = ''.join(f'{i},{i * 1000000000007},{"-" if i % 3 else i}\n' for i in range(5000))
+        with mock_s3(app) as m3:
+            m3.Object(bucket, 'requests.csv.gz').put(Body=gzip.compress(text.encode()))
+            rows = list(s3.get_retriable_csv_stream(['id', 'user_id', 'course_id'], 'requests.csv.gz'))
+            assert len(rows) == 5000
+            assert rows[3] == {'id': 3, 'user_id': 3000000000021, 'course_id': 3}
+            assert rows[4999] == {'id': 4999, 'user_id': 4999000000034993, 'course_id': None}
+
+            batches = list(s3.iter_csv_batches(['id', 'user_id', 'course_id'], 'requests.csv.gz'))
+            assert sum(len(batch) for batch in batches) == 5000
+            assert str(batches[0]['user_id'].dtype) == 'int64'
+            assert batches[0]['course_id'].tolist()[:4] == [0, None, None, 3]
+
+    def test_ranged_reader(self, app):
+        """Reads zip archives and text in ranged requests."""
+        bucket = app.config['LOCH_S3_BUCKET']
+        archive = io.BytesIO()
+        with ZipFile(archive, mode='w') as zip_file:
+            for index in range(20):
+                zip_file.writestr(f'course_{index}/posts_{index}.json', json.dumps({'id': index, 'body': 'x' * 100 * index}))
+        with mock_s3(app) as m3:
+            m3.Object(bucket, 'piazza/daily.zip').put(Body=archive.getvalue())
+            m3.Object(bucket, 'notes.json').put(Body=json.dumps({'note': 'ünïcode ' * 1000}).encode())
+            with override_config(app, 'LOCH_S3_RANGE_CHUNK_SIZE', 1024), override_config(app, 'LOCH_S3_RANGE_MAX_WORKERS', 2):
+                zip_file = s3.get_object_compressed_text_reader('piazza/daily.zip')
+                assert len(zip_file.namelist()) == 20
+                assert json.loads(zip_file.read('course_7/posts_7.json')) == {'id': 7, 'body': 'x' * 700}
+                source = zip_file.fp
+                with zip_file:
+                    pass
+                assert source.closed
+                assert s3.get_object_json('notes.json') == {'note': 'ünïcode ' * 1000}
+
+                reader = s3.RangedReader('piazza/daily.zip')
+                reader.seek(-100, io.SEEK_END)
+                assert reader.readall() == archive.getvalue()[-100:]
+                reader.seek(1000)
+                assert reader.read(10) == archive.getvalue()[1000:1010]
+
 
 @pytest.mark.testext
 class TestS3Testext:
@@ -90,7 +277,7 @@ class TestS3Testext:
         with capture_app_logs(app):
             url = 'http://shakespeare.mit.edu/Poetry/sonnet.XLV.html'
             key = app.config['LOCH_S3_PREFIX_TESTEXT'] + '/00001/sonnet-xlv.html'
-            with pytest.raises(ValueError):
+            with pytest.raises(ClientError):
                 s3.upload_from_url(url, key)
                 assert 'Error on S3 upload' in caplog.text
                 assert 'the bucket \'not-a-bucket-nohow\' does not exist, or is forbidden for access' in caplog.text
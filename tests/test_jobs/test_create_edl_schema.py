@@ -25,9 +25,11 @@ ENHANCEMENTS, OR MODIFICATIONS.
 
 import json
 
+import mock
 from nessie.externals import redshift
 from nessie.lib.queries import edl_schema
-from tests.util import mock_s3
+import pytest
+from tests.util import mock_s3, override_config
 
 
 class TestCreateEdlSchema:
@@ -98,3 +100,40 @@ class TestCreateEdlSchema:
         assert feed['nationalities'] == ["Lao People's Democratic Rep", 'Saint Kitts and Nevis']
         assert feed['underrepresented'] is True
         assert feed['visa'] is None
+
+    def test_generate_demographics_feeds_in_processes(self, app, student_tables):
+        """Builds the same JSON feeds in worker processes as in threads."""
+        from nessie.jobs.create_edl_schema import DemographicsFeedBuilder
+        with mock_s3(app):
+            DemographicsFeedBuilder().build()
+        thread_rows = redshift.fetch(f'SELECT * FROM {edl_schema()}.student_demographics ORDER BY sid')
+        redshift.execute(f'TRUNCATE {edl_schema()}.student_demographics')
+
+        with override_config(app, 'EDL_SCHEMA_EXECUTOR', 'process'), override_config(app, 'EDL_SCHEMA_MAX_PROCESSES', 2):
+            with mock_s3(app):
+                DemographicsFeedBuilder().build()
+        process_rows = redshift.fetch(f'SELECT * FROM {edl_schema()}.student_demographics ORDER BY sid')
+
+        assert len(process_rows) == 11
+        assert [(r['sid'], json.loads(r['feed'])) for r in process_rows] == [(r['sid'], json.loads(r['feed'])) for r in thread_rows]
+
+    def test_generate_demographics_feeds_in_batches(self, app, student_tables):
+        """Streams every feed into staging when batches outnumber workers."""
+        from nessie.jobs.create_edl_schema import DemographicsFeedBuilder
+        builder = DemographicsFeedBuilder()
+        builder.batch_size = 2
+        builder.max_threads = 3
+        with mock_s3(app):
+            builder.build()
+
+        rows = redshift.fetch(f'SELECT * FROM {edl_schema()}.student_demographics')
+        assert len(rows) == 11
+        assert len({r['sid'] for r in rows}) == 11
+
+    def test_generate_demographics_feeds_error(self, app, student_tables):
+        """Passes on errors from feed generation rather than reporting them as upload failures."""
+        from nessie.jobs.create_edl_schema import DemographicsFeedBuilder
+        with mock.patch.object(DemographicsFeedBuilder, 'build_target_feeds', side_effect=ValueError('Malformed feed')):
+            with mock_s3(app):
+                with pytest.raises(ValueError, match='Malformed feed'):
+                    DemographicsFeedBuilder().build()
@@ -0,0 +1,271 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from contextlib import contextmanager
+import json
+
+from botocore.exceptions import ClientError
+import mock
+from nessie.externals import redshift
+from nessie.jobs.background_job import BackgroundJobError
+from nessie.lib import metadata, queries
+from nessie.models.student_schema_manager import staging_schema, stream_to_staging
+import pytest
+from tests.util import mock_s3, override_config
+
+FEED_SIDS = ['11667051', '2345678901']
+
+
+@pytest.fixture()
+def sis_enrollment_rows(app):
+    """Fixture enrollments for two students, ordered as stream_sis_enrollments orders them."""
+    rows = []
+    for row in queries.stream_sis_enrollments():
+        for sid in FEED_SIDS:
+            rows.append({
+                **row,
+                'sid': sid,
+                'drop_date': None,
+                'dropped': None,
+                'max_term_units_allowed': None,
+                'min_term_units_allowed': None,
+            })
+    return sorted(rows, key=lambda r: (-r['sis_term_id'], r['sid']))
+
+
+@contextmanager
+def mock_feed_sources(profile_rows, enrollment_rows):
+    """Serve source rows for merged feeds, and capture what each run writes to staging and refreshes."""
+    staged_enrollment_terms = []
+
+    def _stream_sis_enrollments(sids=None):
+        return [r for r in enrollment_rows if not sids or r['sid'] in sids]
+
+    def _refresh_from_staging(table, term_id, transaction):
+        rows = redshift.fetch(f'SELECT sid, term_id FROM {staging_schema()}.{table} ORDER BY sid, term_id')
+        staged_enrollment_terms.extend((r['sid'], r['term_id']) for r in rows)
+
+    job_module = 'nessie.jobs.generate_merged_student_feeds'
+    with mock.patch(f'{job_module}.queries.stream_all_student_profile_elements', return_value=profile_rows), \
+            mock.patch(f'{job_module}.queries.stream_advisee_advisor_mappings', return_value=[]), \
+            mock.patch(f'{job_module}.queries.stream_sis_enrollments', side_effect=_stream_sis_enrollments) as stream_sis_enrollments, \
+            mock.patch(f'{job_module}.queries.stream_term_gpas', return_value=[]), \
+            mock.patch(f'{job_module}.queries.stream_canvas_memberships', return_value=[]), \
+            mock.patch(f'{job_module}.write_shards_to_staging', return_value=True) as write_shards_to_staging, \
+            mock.patch(f'{job_module}.refresh_all_from_staging'), \
+            mock.patch(f'{job_module}.refresh_from_staging', side_effect=_refresh_from_staging), \
+            mock.patch(f'{job_module}.GenerateMergedStudentFeeds.update_redshift_academic_standing'), \
+            mock.patch(f'{job_module}.GenerateMergedStudentFeeds.update_rds_profile_indexes'), \
+            mock.patch(f'{job_module}.GenerateMergedStudentFeeds.refresh_rds_enrollment_terms') as refresh_rds_enrollment_terms:
+        yield {
+            'refresh_rds_enrollment_terms': refresh_rds_enrollment_terms,
+            'staged_enrollment_terms': staged_enrollment_terms,
+            'stream_sis_enrollments': stream_sis_enrollments,
+            'write_shards_to_staging': write_shards_to_staging,
+        }
+
+
+def _generate_feeds(incremental):
+    from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+    job = GenerateMergedStudentFeeds()
+    job.incremental = incremental
+    return job.generate_feeds()
+
+
+class TestGenerateMergedStudentFeeds:
+
+    @mock.patch('nessie.jobs.generate_merged_student_feeds.queries.stream_advisee_advisor_mappings')
+    @mock.patch('nessie.jobs.generate_merged_student_feeds.queries.stream_all_student_profile_elements')
+    def test_fetch_student_profile_elements(self, mock_profiles, mock_advisors, app):
+        """Merges streamed advisor mappings into streamed profile elements by SID."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        mock_profiles.return_value = [{'sid': '1'}, {'sid': '2'}, {'sid': '3'}]
+        mock_advisors.return_value = [
+            {'student_sid': '0', 'advisor_uid': 'a'},
+            {'student_sid': '2', 'advisor_uid': 'b'},
+            {'student_sid': '2', 'advisor_uid': 'c'},
+            {'student_sid': '3', 'advisor_uid': 'd'},
+        ]
+        with GenerateMergedStudentFeeds().fetch_student_profile_elements() as profile_elements:
+            results = [(feed_elements['sid'], [a['advisor_uid'] for a in advisors]) for feed_elements, advisors in profile_elements]
+        assert results == [('1', []), ('2', ['b', 'c']), ('3', ['d'])]
+
+    def test_generate_student_profile_tables_in_processes(self, app, metadata_db, student_tables):
+        """Stages the same profile rows from worker processes as from a single process."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+
+        def _generate_student_profile_tables():
+            job = GenerateMergedStudentFeeds()
+            job.incremental = True
+            job.successes = []
+            job.failures = []
+            with mock.patch('nessie.jobs.generate_merged_student_feeds.queries.stream_advisee_advisor_mappings', return_value=[]):
+                with mock_s3(app):
+                    assert job.generate_student_profile_tables()
+            rows = redshift.fetch(f'SELECT sid, profile, profile_summary FROM {staging_schema()}.student_profiles ORDER BY sid')
+            staged = [(r['sid'], json.loads(r['profile']), json.loads(r['profile_summary'])) for r in rows]
+            return staged, sorted(job.successes), sorted(job.failures)
+
+        # One student per batch, so that batches outnumber worker processes.
+        with override_config(app, 'STUDENT_PROFILE_BATCH_SIZE', 1):
+            single_process_result = _generate_student_profile_tables()
+            with override_config(app, 'STUDENT_PROFILE_MAX_PROCESSES', 2):
+                multi_process_result = _generate_student_profile_tables()
+
+        staged, successes, failures = single_process_result
+        assert [sid for sid, profile, profile_summary in staged] == ['11667051', '2141', '3242881']
+        assert successes == ['11667051', '2141', '3242881']
+        assert failures == []
+        assert multi_process_result == single_process_result
+
+    def test_changed_profile_elements(self, app, metadata_db):
+        """Passes on only students whose profile sources have changed since fingerprints were last stored."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        job = GenerateMergedStudentFeeds()
+        job.profile_fingerprints = {}
+        job.student_count = 0
+        elements = [({'sid': '1', 'feed': 'a'}, []), ({'sid': '2', 'feed': 'b'}, [{'advisor_uid': 'x'}])]
+        assert [e['sid'] for e, advisors in job._changed_profile_elements(elements, {})] == ['1', '2']
+        assert metadata.update_merged_feed_fingerprints('profile', job.profile_fingerprints, replace_all=True)
+        previous_fingerprints = metadata.get_merged_feed_fingerprints('profile')
+        assert previous_fingerprints == job.profile_fingerprints
+
+        job.profile_fingerprints = {}
+        job.student_count = 0
+        elements = [elements[0], ({'sid': '2', 'feed': 'b'}, [{'advisor_uid': 'y'}]), ({'sid': '3', 'feed': 'c'}, [])]
+        assert [e['sid'] for e, advisors in job._changed_profile_elements(elements, previous_fingerprints)] == ['2', '3']
+        assert job.student_count == 3
+        assert metadata.update_merged_feed_fingerprints('profile', job.profile_fingerprints)
+        assert metadata.get_merged_feed_fingerprints('profile') == {'1': previous_fingerprints['1'], **job.profile_fingerprints}
+        assert metadata.get_merged_feed_fingerprints('enrollment_terms') == {}
+
+    def test_fingerprint_enrollment_sources_ignores_row_order(self, app, sis_enrollment_rows):
+        """Fingerprints the same source rows identically, whatever order they arrive in within a student."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        with mock_feed_sources([], sis_enrollment_rows):
+            fingerprints = GenerateMergedStudentFeeds().fingerprint_enrollment_sources()
+        with mock_feed_sources([], list(reversed(sis_enrollment_rows))):
+            assert GenerateMergedStudentFeeds().fingerprint_enrollment_sources() == fingerprints
+        assert sorted(fingerprints.keys()) == FEED_SIDS
+
+        changed_rows = [{**r, 'grade': 'F'} if r['sid'] == FEED_SIDS[1] and r['sis_section_id'] == 90100 else r for r in sis_enrollment_rows]
+        with mock_feed_sources([], changed_rows):
+            changed_fingerprints = GenerateMergedStudentFeeds().fingerprint_enrollment_sources()
+        assert changed_fingerprints[FEED_SIDS[0]] == fingerprints[FEED_SIDS[0]]
+        assert changed_fingerprints[FEED_SIDS[1]] != fingerprints[FEED_SIDS[1]]
+
+    def test_no_enrollment_sources(self, app, student_tables):
+        """Fails rather than generating nothing when no student has enrollment source rows."""
+        from nessie.jobs.generate_merged_student_feeds import GenerateMergedStudentFeeds
+        job = GenerateMergedStudentFeeds()
+        job.incremental = True
+        with mock_feed_sources([], []):
+            with pytest.raises(BackgroundJobError):
+                job.generate_student_enrollments_table()
+
+    def test_generate_feeds_incrementally(self, app, metadata_db, student_tables, sis_enrollment_rows):
+        """Regenerates feeds only for students whose source rows changed since the last run."""
+        from nessie.jobs.generate_merged_student_feeds import PROFILE_TABLES
+        profile_rows = queries.stream_all_student_profile_elements()
+        profile_sids = [r['sid'] for r in profile_rows]
+        all_terms = [(sid, term_id) for sid in FEED_SIDS for term_id in ['2162', '2172', '2178']]
+
+        with mock_s3(app):
+            # A full run generates and stores fingerprints for every student.
+            with mock_feed_sources(profile_rows, sis_enrollment_rows) as sources:
+                result = _generate_feeds(incremental=False)
+            assert result == 'Generated merged profiles (3 successes, 0 failures). Generated merged enrollment terms (6 feeds.)'
+            assert [c.args[0] for c in sources['write_shards_to_staging'].call_args_list] == PROFILE_TABLES
+            assert sources['staged_enrollment_terms'] == all_terms
+            assert sources['refresh_rds_enrollment_terms'].call_count == 1
+            profile_fingerprints = metadata.get_merged_feed_fingerprints('profile')
+            enrollment_fingerprints = metadata.get_merged_feed_fingerprints('enrollment_terms')
+            assert sorted(profile_fingerprints.keys()) == sorted(profile_sids)
+            assert sorted(enrollment_fingerprints.keys()) == FEED_SIDS
+
+            # With no source rows changed, an incremental run generates nothing.
+            with mock_feed_sources(profile_rows, sis_enrollment_rows) as sources:
+                result = _generate_feeds(incremental=True)
+            assert result == 'Generated merged profiles (0 successes, 0 failures).'
+            assert sources['write_shards_to_staging'].call_count == 0
+            assert sources['stream_sis_enrollments'].call_count == 1
+            assert sources['staged_enrollment_terms'] == []
+            assert sources['refresh_rds_enrollment_terms'].call_count == 0
+            assert metadata.get_merged_feed_fingerprints('profile') == profile_fingerprints
+            assert metadata.get_merged_feed_fingerprints('enrollment_terms') == enrollment_fingerprints
+
+            # Changed students are regenerated, and profile tables which get no rows from them are left alone.
+            changed_profile_rows = [{**r, 'first_name': 'Ozzie'} if r['sid'] == profile_sids[1] else r for r in profile_rows]
+            changed_enrollment_rows = [
+                {**r, 'grade': 'F'} if r['sid'] == FEED_SIDS[1] and r['sis_section_id'] == 90100 else r for r in sis_enrollment_rows
+            ]
+            with mock_feed_sources(changed_profile_rows, changed_enrollment_rows) as sources:
+                result = _generate_feeds(incremental=True)
+            assert result == 'Generated merged profiles (1 successes, 0 failures). Generated merged enrollment terms (3 feeds.)'
+            assert [c.args[:3] for c in sources['write_shards_to_staging'].call_args_list] == [('student_profiles', mock.ANY, 1)]
+            assert sources['stream_sis_enrollments'].call_args_list[-1] == mock.call(sids=[FEED_SIDS[1]])
+            assert sources['staged_enrollment_terms'] == [t for t in all_terms if t[0] == FEED_SIDS[1]]
+            assert sources['refresh_rds_enrollment_terms'].call_count == 1
+
+            changed_profile_fingerprints = metadata.get_merged_feed_fingerprints('profile')
+            assert [sid for sid in profile_sids if changed_profile_fingerprints[sid] != profile_fingerprints[sid]] == [profile_sids[1]]
+            changed_enrollment_fingerprints = metadata.get_merged_feed_fingerprints('enrollment_terms')
+            assert changed_enrollment_fingerprints[FEED_SIDS[0]] == enrollment_fingerprints[FEED_SIDS[0]]
+            assert changed_enrollment_fingerprints[FEED_SIDS[1]] != enrollment_fingerprints[FEED_SIDS[1]]
+
+    def test_generate_all_enrollment_feeds_incrementally(self, app, metadata_db, student_tables, sis_enrollment_rows):
+        """Regenerates every enrollment term feed on a first incremental run, or when too many students changed."""
+        profile_rows = queries.stream_all_student_profile_elements()
+        all_terms = [(sid, term_id) for sid in FEED_SIDS for term_id in ['2162', '2172', '2178']]
+
+        with mock_s3(app):
+            with mock_feed_sources(profile_rows, sis_enrollment_rows) as sources:
+                result = _generate_feeds(incremental=True)
+            assert result.endswith('Generated merged enrollment terms (6 feeds.)')
+            assert sources['stream_sis_enrollments'].call_args_list[-1] == mock.call(sids=None)
+            assert sources['staged_enrollment_terms'] == all_terms
+            assert sorted(metadata.get_merged_feed_fingerprints('enrollment_terms').keys()) == FEED_SIDS
+
+            changed_rows = [{**r, 'grade': 'F'} if r['sis_section_id'] == 90100 else r for r in sis_enrollment_rows]
+            with mock_feed_sources(profile_rows, changed_rows) as sources, \
+                    override_config(app, 'MERGED_FEEDS_INCREMENTAL_MAX_STUDENTS', 1):
+                result = _generate_feeds(incremental=True)
+            assert result.endswith('Generated merged enrollment terms (6 feeds.)')
+            assert sources['stream_sis_enrollments'].call_args_list[-1] == mock.call(sids=None)
+            assert sources['staged_enrollment_terms'] == all_terms
+
+    def test_stream_to_staging_errors(self, app, student_tables):
+        """Reports S3 errors as job failures, but passes on errors from feed generation unchanged."""
+        with mock_s3(app):
+            with pytest.raises(ValueError, match='Malformed feed'):
+                with stream_to_staging('student_enrollment_terms') as feed_file:
+                    feed_file.write(b'11667051\t2178\t{}\n')
+                    raise ValueError('Malformed feed')
+
+            upload_error = ClientError({'Error': {'Code': 'SlowDown'}}, 'UploadPart')
+            with mock.patch('nessie.models.student_schema_manager.s3.ShardedUpload.write', side_effect=upload_error):
+                with pytest.raises(BackgroundJobError, match='Failed upload to s3'):
+                    with stream_to_staging('student_enrollment_terms') as feed_file:
+                        feed_file.write(b'11667051\t2178\t{}\n')
@@ -30,6 +30,7 @@ from nessie.jobs.sync_file_to_s3 import SyncFileToS3
 from nessie.lib import metadata
 from nessie.lib.mockingbird import _get_fixtures_path
 import pytest
+import requests
 import responses
 from tests.util import capture_app_logs, mock_s3
 
@@ -96,3 +97,26 @@ class TestSyncFileToS3:
             assert snapshot_metadata[0]['size'] == 767
             assert snapshot_metadata[0]['created_at']
             assert snapshot_metadata[0]['deleted_at'] is None
+
+    @responses.activate
+    def test_canvas_sync_source_error(self, app, metadata_db):
+        """Records an error status when the source download fails."""
+        url = 'https://canvas-data.example.com/requests/part-00002.gz'
+        key = 'canvas/requests/part-00002.gz'
+
+        def _respond(request):
+            if request.headers['Range'] == 'bytes=0-0':
+                return (206, {'Content-Range': 'bytes 0-0/767'}, b'x')
+            raise requests.exceptions.Timeout('Read timed out')
+
+        responses.add_callback(responses.GET, url, callback=_respond)
+        with mock_s3(app):
+            metadata.create_canvas_sync_status('job_1', 'part-00002.gz', 'requests', url)
+            result = SyncFileToS3().run(url=url, key=key, canvas_sync_job_id='job_1')
+            assert result is False
+
+        schema = app.config['RDS_SCHEMA_METADATA']
+        sync_metadata = rds.fetch(f'SELECT * FROM {schema}.canvas_sync_job_status')
+        assert len(sync_metadata) == 1
+        assert sync_metadata[0]['status'] == 'error'
+        assert 'Read timed out' in sync_metadata[0]['details']
@@ -0,0 +1,179 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from threading import Barrier, Thread
+
+from nessie.lib.db import call_with_retries, ConnectionPool, get_psycopg_cursor, is_transient_error, TransientQueryError
+import psycopg2.extensions
+import psycopg2.pool
+import pytest
+
+
+@pytest.fixture()
+def pool(app):
+    _pool = ConnectionPool(
+        min_size=0,
+        max_size=2,
+        checkout_timeout=0.1,
+        dbname=app.config['REDSHIFT_DATABASE'],
+        host=app.config['REDSHIFT_HOST'],
+        port=app.config['REDSHIFT_PORT'],
+        user=app.config['REDSHIFT_USER'],
+        password=app.config['REDSHIFT_PASSWORD'],
+    )
+    yield _pool
+    _pool.closeall()
+
+
+def _backend_pid(pool):
+    with get_psycopg_cursor(operation='read', pool=pool) as cursor:
+        cursor.execute('SELECT pg_backend_pid() AS pid')
+        return cursor.fetchone()['pid']
+
+
+class TestConnectionPool:
+    """Pooled psycopg2 connections."""
+
+    def test_reuses_connections(self, pool):
+        """Reuses a returned connection rather than opening a new one."""
+        assert _backend_pid(pool) == _backend_pid(pool)
+        stats = pool.get_stats()
+        assert stats['connections_created'] == 1
+        assert stats['checkouts'] == 2
+        assert stats['idle'] == 1
+        assert stats['in_use'] == 0
+
+    def test_rolls_back_abandoned_transactions(self, pool):
+        """Rolls back any transaction left open by the previous borrower."""
+        with get_psycopg_cursor(operation='write', autocommit=False, pool=pool) as cursor:
+            cursor.execute('SELECT 1')
+            assert cursor.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        with get_psycopg_cursor(operation='write', pool=pool) as cursor:
+            assert cursor.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            assert cursor.connection.autocommit is True
+
+    def test_discards_closed_connections(self, pool):
+        """Replaces a connection that was closed while checked out."""
+        with get_psycopg_cursor(pool=pool) as cursor:
+            cursor.connection.close()
+        assert pool.get_stats()['connections_discarded'] == 1
+        assert _backend_pid(pool)
+        assert pool.get_stats()['connections_created'] == 2
+
+    def test_thread_affinity(self, pool):
+        """Hands each thread back the connection it last returned."""
+        barrier = Barrier(2)
+        connections = {}
+
+        def _run(name):
+            first = pool.getconn()
+            # Both threads hold a connection at once, so each returns a different one.
+            barrier.wait()
+            pool.putconn(first)
+            barrier.wait()
+            second = pool.getconn()
+            pool.putconn(second)
+            connections[name] = (first, second)
+
+        threads = [Thread(target=_run, args=[name]) for name in ('a', 'b')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert connections['a'][0] is connections['a'][1]
+        assert connections['b'][0] is connections['b'][1]
+        assert connections['a'][0] is not connections['b'][0]
+
+    def test_max_size(self, pool):
+        """Raises a pool error when no connection frees up within the checkout timeout."""
+        connections = [pool.getconn(), pool.getconn()]
+        with pytest.raises(psycopg2.pool.PoolError):
+            pool.getconn()
+        for c in connections:
+            pool.putconn(c)
+        assert pool.getconn() in connections
+
+    def test_idle_eviction(self, pool):
+        """Closes idle connections above the minimum size once they pass the idle timeout."""
+        pool.idle_timeout = 0
+        connection = pool.getconn()
+        pool.putconn(connection)
+        assert connection.closed
+        assert pool.get_stats()['connections_evicted'] == 1
+
+
+class _PgError(psycopg2.DatabaseError):
+    """A psycopg2 error with an arbitrary error code, which psycopg2 only sets on errors raised by the server."""
+
+    def __init__(self, message, pgcode=None):
+        super().__init__(message)
+        self._pgcode = pgcode
+
+    @property
+    def pgcode(self):
+        return self._pgcode
+
+
+class TestRetries:
+    """Retrying transient errors."""
+
+    @pytest.mark.parametrize('error,transient', [
+        (_PgError('could not serialize access', '40001'), True),
+        (_PgError('deadlock detected', '40P01'), True),
+        (_PgError('terminating connection due to administrator command', '57P01'), True),
+        (_PgError('connection failure', '08006'), True),
+        (_PgError('Query (1234) cancelled by WLM abort action of Query Monitoring Rule', '57014'), True),
+        (_PgError('canceling statement due to statement timeout', '57014'), False),
+        (_PgError('1023 Serializable isolation violation on table - 123, transactions forming the cycle are', 'XX000'), True),
+        (_PgError('relation "nonexistent" does not exist', '42P01'), False),
+        (psycopg2.OperationalError('server closed the connection unexpectedly'), True),
+        (psycopg2.ProgrammingError('no results to fetch'), False),
+    ])
+    def test_is_transient_error(self, error, transient):
+        assert is_transient_error(error) is transient
+
+    def test_call_with_retries(self, monkeypatch):
+        """Retries transient errors with capped, jittered delays, leaving the last attempt to handle errors itself."""
+        delays = []
+        monkeypatch.setattr('nessie.lib.db.time.sleep', delays.append)
+        attempts = []
+
+        def _attempt(raise_transient):
+            attempts.append(raise_transient)
+            if raise_transient:
+                raise TransientQueryError(_PgError('deadlock detected', '40P01'))
+            return 'handled'
+        retries = []
+        result = call_with_retries(_attempt, max_retries=3, base_delay=2, max_delay=3, on_retry=lambda e, n, d: retries.append((e.pgcode, n)))
+        assert result == 'handled'
+        assert attempts == [True, True, True, False]
+        assert retries == [('40P01', 1), ('40P01', 2), ('40P01', 3)]
+        assert 0 <= delays[0] <= 2
+        assert all(0 <= d <= 3 for d in delays[1:])
+
+    def test_call_with_retries_success(self, monkeypatch):
+        """Returns the first successful result without retrying."""
+        monkeypatch.setattr('nessie.lib.db.time.sleep', lambda d: pytest.fail('Unexpected retry'))
+        assert call_with_retries(lambda raise_transient: 'ok', max_retries=3, base_delay=1, max_delay=1) == 'ok'
@@ -32,8 +32,12 @@ from nessie.lib.mockingdata import MockRows, register_mock
 class TestQueries:
 
     def test_canvas_course_scores_fixture(self, app):
-        results = queries.stream_canvas_enrollments('2178')
-        assert len(results) > 0
+        frames = queries.stream_canvas_enrollment_frames('2178')
+        assert len(frames) > 0
+        course_ids = [course_id for course_id, frame in frames]
+        assert course_ids == sorted(set(course_ids))
+        assert all((frame['canvas_course_id'] == course_id).all() for course_id, frame in frames)
+        results = [row for course_id, frame in frames for row in frame.to_dict('records')]
         assert {
             'canvas_course_id': 7654321, 'canvas_course_term': 'Fall 2017', 'uid': '9000100',
             'canvas_user_id': 9000100, 'current_score': 84, 'last_activity_at': 1535275620,
@@ -131,8 +135,8 @@ class TestQueries:
 
     def test_override_fixture(self, app):
         mr = MockRows(io.StringIO('course_id,uid,canvas_user_id,current_score,last_activity_at,sis_enrollment_status\n1,2,3,4,5,F'))
-        with register_mock(queries.stream_canvas_enrollments, mr):
-            data = queries.stream_canvas_enrollments('2178')
+        with register_mock(queries.stream_canvas_sites, mr):
+            data = queries.stream_canvas_sites('2178')
         assert len(data) == 1
         assert {
             'course_id': 1, 'uid': '2', 'canvas_user_id': 3, 'current_score': 4, 'last_activity_at': 5,
@@ -140,7 +144,7 @@ class TestQueries:
         } == data[0]
 
     def test_user_for_uid(self, app):
-        data = queries.get_all_student_profile_elements()
+        data = queries.stream_all_student_profile_elements()
         oliver = next(r for r in data if r['ldap_uid'] == '2040')
         assert oliver['canvas_user_id'] == 10001
         assert oliver['canvas_user_name'] == 'Oliver Heyer'
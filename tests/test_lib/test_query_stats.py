@@ -0,0 +1,78 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from nessie.lib import query_stats
+from tests.util import capture_app_logs, override_config
+
+
+class TestQueryStats:
+    """Statement-level query statistics."""
+
+    def test_normalize_sql(self):
+        """Replaces literals and collapses whitespace and value lists."""
+        sql = """SELECT * FROM boac_analytics.students -- all of them
+            WHERE sid IN ('123', '456', '789') AND term_id = 2178 AND name = 'O''Brien'"""
+        assert query_stats.normalize_sql(sql) == 'SELECT * FROM boac_analytics.students WHERE sid IN (?) AND term_id = ? AND name = ?'
+
+    def test_job_attribution(self, app):
+        """Attributes statements to the current job and to any enclosing job chain."""
+        query_stats.reset()
+        with query_stats.job_context('Chain_1'):
+            with query_stats.job_context('Step_1'):
+                query_stats.record('redshift', 'SELECT 1', 0.5, rows=1)
+            query_stats.record('redshift', 'SELECT 2', 1.5, rows=1)
+        query_stats.record('redshift', 'SELECT 3', 0.1, rows=1)
+        assert query_stats.get_job_ids() == ['Chain_1', 'Step_1']
+        assert [s['count'] for s in query_stats.get_query_stats(job_id='Step_1')] == [1]
+        chain_stats = query_stats.get_query_stats(job_id='Chain_1')
+        assert len(chain_stats) == 1
+        assert chain_stats[0]['count'] == 2
+        assert chain_stats[0]['total_seconds'] == 2.0
+        all_stats = query_stats.get_query_stats()
+        assert all_stats[0]['count'] == 3
+        assert all_stats[0]['max_seconds'] == 1.5
+        assert all_stats[0]['p50_seconds'] == 0.5
+
+    def test_slow_query_log(self, app, caplog):
+        """Logs statements running longer than the threshold."""
+        with capture_app_logs(app), override_config(app, 'SLOW_QUERY_THRESHOLD_SECONDS', 1):
+            query_stats.record('rds', 'SELECT 1', 0.5)
+            assert 'Slow rds query' not in caplog.text
+            query_stats.record('rds', 'SELECT 1', 1.5, rows=7)
+            assert 'Slow rds query' in caplog.text
+            assert '7 rows' in caplog.text
+
+    def test_record_retry(self, app):
+        """Counts retries by statement and by error code."""
+        query_stats.reset()
+        query_stats.record('redshift', 'SELECT 1', 0.5)
+        query_stats.record_retry('redshift', 'SELECT 2', '40001')
+        query_stats.record_retry('redshift', 'SELECT 2', '40001')
+        query_stats.record_retry('rds', 'SELECT 1', None)
+        assert query_stats.get_query_stats()[0]['retries'] == 2
+        assert sorted(query_stats.get_retry_counts(), key=lambda r: r['source']) == [
+            {'source': 'rds', 'pgcode': None, 'count': 1},
+            {'source': 'redshift', 'pgcode': '40001', 'count': 2},
+        ]
@@ -0,0 +1,76 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+
+import gzip
+import json
+
+from nessie.lib import s3_index
+from tests.util import mock_s3
+
+
+class TestS3Index:
+    """Index of S3 keys in RDS metadata."""
+
+    def test_prefix_lookups(self, app, metadata_db):
+        """Answers lookups under a freshly indexed prefix from the index, and confirms empty results live."""
+        with mock_s3(app) as m3:
+            bucket = app.config['LOCH_S3_BUCKET']
+            m3.Object(bucket, 'daily/a/1').put(Body=b'1')
+            m3.Object(bucket, 'daily/a/2').put(Body=b'2')
+            assert s3_index.get_keys_with_prefix('daily/') == ['daily/a/1', 'daily/a/2']
+
+            m3.Object(bucket, 'daily/a/1').delete()
+            m3.Object(bucket, 'daily/b/1').put(Body=b'3')
+            assert s3_index.get_keys_with_prefix('daily/a/') == ['daily/a/1', 'daily/a/2']
+            assert s3_index.get_keys_with_prefix('daily/b/') == ['daily/b/1']
+            assert s3_index.get_keys_with_prefix('daily/', max_age=0) == ['daily/a/2', 'daily/b/1']
+
+            assert s3_index.find_missing_keys(['daily/a/2', 'daily/b/1', 'daily/b/2'], 'daily/') == ['daily/b/2']
+            s3_index.remove_keys(['daily/a/2'])
+            assert s3_index.find_missing_keys(['daily/a/2'], 'daily/') == []
+
+    def test_load_inventory(self, app, metadata_db):
+        """Indexes the current objects listed in an S3 Inventory report."""
+        with mock_s3(app) as m3:
+            bucket = app.config['LOCH_S3_BUCKET']
+            rows = [
+                '"source","reports/r%C3%A9sum%C3%A9+1.pdf","12","2022-03-01T00:00:00.000Z","true","false"',
+                '"source","reports/old.pdf","34","2022-02-01T00:00:00.000Z","false","false"',
+                '"source","reports/deleted.pdf","","2022-02-02T00:00:00.000Z","true","true"',
+            ]
+            m3.Object(bucket, 'inventory/data/1.csv.gz').put(Body=gzip.compress('\n'.join(rows).encode()))
+            manifest = {
+                'sourceBucket': 'source',
+                'fileFormat': 'CSV',
+                'fileSchema': 'Bucket, Key, Size, LastModifiedDate, IsLatest, IsDeleteMarker',
+                'files': [{'key': 'inventory/data/1.csv.gz'}],
+                'creationTimestamp': '1646096400000',
+            }
+            m3.Object(bucket, 'inventory/manifest.json').put(Body=json.dumps(manifest).encode())
+            assert s3_index.load_inventory('inventory/manifest.json') == 1
+            assert s3_index._fetch_indexed_keys('source', 'reports/') == ['reports/résumé 1.pdf']
+            assert s3_index._is_fresh('source', 'reports/', max_age=10 * 365 * 24 * 3600)
+            assert not s3_index._is_fresh('source', 'reports/')
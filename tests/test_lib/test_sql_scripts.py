@@ -0,0 +1,83 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from nessie.lib import sql_scripts
+
+
+class TestSqlScripts:
+    """SQL script parsing and dependency analysis."""
+
+    def test_split_statements(self):
+        """Splits on semicolons outside quotes, dollar quotes and comments."""
+        sql = """
+            /* Header; with a semicolon. */
+            CREATE TABLE s.a AS (SELECT 'x;y' AS v);
+            -- Comment; with a semicolon.
+            CREATE FUNCTION s.f() RETURNS int AS $$ SELECT 1; $$ LANGUAGE sql;
+            SELECT "odd;name" FROM s.a;
+            -- Trailing comment.
+        """
+        statements = sql_scripts.split_statements(sql)
+        assert len(statements) == 3
+        assert statements[0].endswith("CREATE TABLE s.a AS (SELECT 'x;y' AS v)")
+        assert statements[1].endswith('$$ SELECT 1; $$ LANGUAGE sql')
+        assert statements[2] == 'SELECT "odd;name" FROM s.a'
+
+    def test_statement_dependencies(self):
+        """Infers tables and schemas read and written."""
+        reads, writes = sql_scripts.statement_dependencies(
+            "CREATE TABLE s.c AS (SELECT * FROM s.a JOIN t.b ON a.id = b.id WHERE a.name = 'u.v')",
+        )
+        assert writes == {'s.c'}
+        assert {'s.a', 't.b', 'schema:s', 'schema:t'} <= reads
+        assert 'u.v' not in reads
+        assert sql_scripts.statement_dependencies('DROP SCHEMA IF EXISTS s CASCADE') == (set(), {'schema:s'})
+        assert sql_scripts.statement_dependencies('DROP TABLE IF EXISTS s.a, s.b')[1] == {'s.a', 's.b'}
+        assert sql_scripts.statement_dependencies('VACUUM s.a') is None
+
+    def test_dependency_graph(self):
+        """Orders statements that share tables or schemas, leaving independent statements unordered."""
+        statements = sql_scripts.split_statements("""
+            CREATE SCHEMA s;
+            CREATE TABLE s.a AS (SELECT 1 AS id);
+            CREATE TABLE s.b AS (SELECT 2 AS id);
+            CREATE TABLE s.c AS (SELECT * FROM s.a UNION SELECT * FROM s.b);
+            BEGIN TRANSACTION;
+            DELETE FROM s.a;
+            INSERT INTO s.a (SELECT 3 AS id);
+            COMMIT TRANSACTION;
+            VACUUM s.b;
+        """)
+        units = sql_scripts.group_transactions(statements)
+        assert len(units) == 6
+        assert len(units[4]) == 4
+        assert sql_scripts.dependency_graph(units) == [
+            set(),
+            {0},
+            {0},
+            {0, 1, 2},
+            {0, 1, 3},
+            {0, 1, 2, 3, 4},
+        ]
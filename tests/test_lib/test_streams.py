@@ -0,0 +1,102 @@
+"""
+Copyright ©2022. The Regents of the University of California (Regents). All Rights Reserved.
+
+Permission to use, copy, modify, and distribute this software and its documentation
+for educational, research, and not-for-profit purposes, without fee and without a
+signed licensing agreement, is hereby granted, provided that the above copyright
+notice, this paragraph and the following two paragraphs appear in all copies,
+modifications, and distributions.
+
+Contact The Office of Technology Licensing, UC Berkeley, 2150 Shattuck Avenue,
+Suite 510, Berkeley, CA 94720-1620, (510) 643-7201, otl@berkeley.edu,
+http://ipira.berkeley.edu/industry-info for commercial licensing opportunities.
+
+IN NO EVENT SHALL REGENTS BE LIABLE TO ANY PARTY FOR DIRECT, INDIRECT, SPECIAL,
+INCIDENTAL, OR CONSEQUENTIAL DAMAGES, INCLUDING LOST PROFITS, ARISING OUT OF
+THE USE OF THIS SOFTWARE AND ITS DOCUMENTATION, EVEN IF REGENTS HAS BEEN ADVISED
+OF THE POSSIBILITY OF SUCH DAMAGE.
+
+REGENTS SPECIFICALLY DISCLAIMS ANY WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE. THE
+SOFTWARE AND ACCOMPANYING DOCUMENTATION, IF ANY, PROVIDED HEREUNDER IS PROVIDED
+"AS IS". REGENTS HAS NO OBLIGATION TO PROVIDE MAINTENANCE, SUPPORT, UPDATES,
+ENHANCEMENTS, OR MODIFICATIONS.
+"""
+
+from operator import itemgetter
+
+from nessie.lib.streams import Descending, merge_join, open_streams, sorted_difference, SortedGroups
+import pytest
+
+
+class TestStreams:
+    """Merge-join utilities for sorted streams."""
+
+    def test_sorted_groups(self):
+        """Looks up groups in ascending key order, skipping keys absent from the stream."""
+        rows = [{'sid': '1', 'n': 1}, {'sid': '1', 'n': 2}, {'sid': '3', 'n': 3}]
+        groups = SortedGroups(rows, key=itemgetter('sid'))
+        assert [r['n'] for r in groups.get('1')] == [1, 2]
+        assert groups.get('2') is None
+        assert [r['n'] for r in groups.get('3')] == [3]
+        assert groups.get('4', []) == []
+
+    def test_sorted_groups_descending(self):
+        """Supports streams ordered descending on some key components."""
+        rows = [
+            {'term_id': '2218', 'sid': '1'},
+            {'term_id': '2218', 'sid': '2'},
+            {'term_id': '2215', 'sid': '1'},
+        ]
+        groups = SortedGroups(rows, key=lambda r: (Descending(r['term_id']), r['sid']))
+        assert groups.get((Descending('2218'), '2'))
+        assert groups.get((Descending('2215'), '0')) is None
+        assert groups.get((Descending('2215'), '1'))
+        assert groups.get((Descending('2212'), '1')) is None
+
+    def test_merge_join(self):
+        """Left-joins secondary streams to a primary stream."""
+        profiles = [{'sid': '1'}, {'sid': '2'}, {'sid': '3'}]
+        holds = [{'sid': '2', 'hold': 'a'}, {'sid': '2', 'hold': 'b'}]
+        plans = [{'sid': '0', 'plan': 'x'}, {'sid': '1', 'plan': 'y'}, {'sid': '3', 'plan': 'z'}]
+        results = [
+            (sid, len(list(profile_rows)), {k: [r.get('hold') or r.get('plan') for r in v] for k, v in matches.items()})
+            for sid, profile_rows, matches in merge_join(profiles, itemgetter('sid'), {'holds': holds, 'plans': plans})
+        ]
+        assert results == [
+            ('1', 1, {'plans': ['y']}),
+            ('2', 1, {'holds': ['a', 'b']}),
+            ('3', 1, {'plans': ['z']}),
+        ]
+
+    def test_sorted_difference(self):
+        """Yields items missing from the right-hand stream, reading it no further than needed."""
+        right = iter(['a/1', 'a/3', 'b/1', 'b/2', 'c/1', 'c/2'])
+        assert list(sorted_difference(['a/1', 'a/2', 'b/2', 'b/3'], right)) == ['a/2', 'b/3']
+        assert next(right) == 'c/2'
+        assert list(sorted_difference(['x', 'y'], [])) == ['x', 'y']
+
+    def test_open_streams_closes_all(self, app):
+        """Closes every opened stream, even if one fails to open."""
+        closed = []
+
+        class Stream(list):
+            def __init__(self, name):
+                super().__init__()
+                self.name = name
+
+            def close(self):
+                closed.append(self.name)
+
+        def _fail():
+            raise ValueError('no such table')
+
+        with open_streams(a=lambda: Stream('a'), b=lambda: Stream('b')) as streams:
+            assert sorted(streams.keys()) == ['a', 'b']
+        assert sorted(closed) == ['a', 'b']
+
+        closed.clear()
+        with pytest.raises(ValueError):
+            with open_streams(a=lambda: Stream('a'), b=_fail):
+                pass
+        assert closed == ['a']
@@ -25,8 +25,9 @@ ENHANCEMENTS, OR MODIFICATIONS.
 
 from datetime import datetime
 
+from flask import current_app
 import mock
-from nessie.lib import util
+from nessie.lib import berkeley, util
 
 
 class TestUtil:
@@ -36,6 +37,15 @@ class TestUtil:
         """Cleans up leading, trailing, and repeated whitespace."""
         assert util.vacuum_whitespace('  Firstname    Lastname   ') == 'Firstname Lastname'
 
+    def test_forked_process_pool(self, app):
+        """Runs work in forked processes under an app context with the parent's config and terms."""
+        with util.forked_process_pool(2, initializer=_set_worker_label, initargs=('forked',)) as executor:
+            results = list(executor.map(_describe_worker, range(4)))
+        assert [r['index'] for r in results] == [0, 1, 2, 3]
+        assert {r['label'] for r in results} == {'forked'}
+        assert {r['bucket'] for r in results} == {app.config['LOCH_S3_BUCKET']}
+        assert {r['current_term_id'] for r in results} == {berkeley.current_term_id()}
+
     @mock.patch('nessie.lib.util.datetime', autospec=True)
     def test_get_s3_sis_attachment_current_paths(self, mock_datetime, app):
         """Returns a list of S3 paths to SIS attachments that need to be migrated."""
@@ -83,3 +93,20 @@ class TestUtil:
         assert len(paths) == 2
         assert paths[0] == f'{prefix}/2019/09/20'
         assert paths[1] == f'{prefix}/2019/09/21'
+
+
+_worker_label = None
+
+
+def _describe_worker(index):
+    return {
+        'index': index,
+        'label': _worker_label,
+        'bucket': current_app.config['LOCH_S3_BUCKET'],
+        'current_term_id': berkeley.current_term_id(),
+    }
+
+
+def _set_worker_label(label):
+    global _worker_label
+    _worker_label = label
@@ -30,7 +30,7 @@ import logging
 
 import boto3
 import moto
-from nessie.externals import rds
+from nessie.externals import aws, rds
 
 
 @contextmanager
@@ -49,6 +49,7 @@ def capture_app_logs(app):
 @contextmanager
 def mock_s3(app, bucket=None):
     with moto.mock_s3(), moto.mock_sts():
+        aws.reset()
         s3 = boto3.resource('s3', app.config['LOCH_S3_REGION'])
         s3.create_bucket(Bucket=bucket or app.config['LOCH_S3_BUCKET'])
         yield s3